@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+批次生成執行器
+- 一個批次包含多個生成請求，以有限的並行數送出（送出後等待不佔用並行名額）
+- 每個項目完成就追加一筆結果，串流端點可依序讀取（NDJSON）
+- 送出與輪詢都走 server 的共用連線池、限流器與輪詢器
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# 每個批次預設同時送出的項目數
+DEFAULT_CONCURRENCY = int(os.environ.get("VEO_BATCH_CONCURRENCY", "8"))
+# 批次完成後保留結果多久（秒）
+RETAIN_SECONDS = float(os.environ.get("VEO_BATCH_RETAIN_SECONDS", "3600"))
+
+# submit(item) -> {"ok", "operationName", ...}；wait(item, submitted) -> 最終結果
+SubmitFn = Callable[[Any], Awaitable[Dict[str, Any]]]
+WaitFn = Callable[[Any, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class Batch:
+    """單一批次的進度與已完成的結果"""
+
+    def __init__(self, batch_id: str, total: int):
+        self.id = batch_id
+        self.total = total
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.results: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) >= self.total
+
+    def add(self, result: Dict[str, Any]):
+        self.results.append(result)
+        if self.done:
+            self.finished_at = time.time()
+        # 喚醒所有串流讀取者，再換一個新的事件給下一輪
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def summary(self) -> Dict[str, Any]:
+        succeeded = sum(1 for r in self.results if r.get("ok") and r.get("done"))
+        return {
+            "batchId": self.id,
+            "total": self.total,
+            "completed": len(self.results),
+            "succeeded": succeeded,
+            "failed": len(self.results) - succeeded,
+            "elapsedSeconds": int((self.finished_at or time.time()) - self.created_at),
+        }
+
+    async def stream(self) -> AsyncIterator[str]:
+        """從頭逐行輸出結果（NDJSON），全部完成後輸出一行摘要"""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.results):
+                yield json.dumps(self.results[sent], ensure_ascii=False) + "\n"
+                sent += 1
+            if self.done:
+                yield json.dumps({"summary": self.summary()}, ensure_ascii=False) + "\n"
+                return
+            await changed.wait()
+
+
+class BatchRunner:
+    """建立與追蹤批次"""
+
+    def __init__(self, submit: SubmitFn, wait: WaitFn, retain_seconds: float = RETAIN_SECONDS):
+        """
+        Args:
+            submit: 送出單一項目
+            wait: 等待已送出的項目完成
+            retain_seconds: 完成的批次保留多久
+        """
+        self.submit = submit
+        self.wait = wait
+        self.retain_seconds = retain_seconds
+        self._batches: Dict[str, Batch] = {}
+
+    def create(self, items: List[Any], concurrency: int = DEFAULT_CONCURRENCY) -> Batch:
+        self._purge()
+        batch = Batch(uuid.uuid4().hex, len(items))
+        self._batches[batch.id] = batch
+        batch.task = asyncio.get_running_loop().create_task(self._run(batch, items, max(1, concurrency)))
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        return self._batches.get(batch_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": len(self._batches),
+            "running": sum(1 for b in self._batches.values() if not b.done),
+        }
+
+    async def stop(self):
+        tasks = [b.task for b in self._batches.values() if b.task is not None and not b.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, batch: Batch, items: List[Any], concurrency: int):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run_item(index: int, item: Any):
+            started = time.time()
+            try:
+                # 只有送出佔用並行名額；等待交給共用輪詢器
+                async with slots:
+                    submitted = await self.submit(item)
+                result = await self.wait(item, submitted) if submitted.get("ok") else submitted
+            except Exception as e:
+                result = {"ok": False, "error": f"批次項目失敗: {e}"}
+            batch.add({"index": index, **result, "elapsedSeconds": int(time.time() - started)})
+
+        await asyncio.gather(*[run_item(i, item) for i, item in enumerate(items)])
+
+    def _purge(self):
+        now = time.time()
+        for batch_id in [b.id for b in self._batches.values() if b.finished_at and now - b.finished_at > self.retain_seconds]:
+            del self._batches[batch_id]
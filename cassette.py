@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+上游互動的錄製與重播（httpx 傳輸層）
+- 錄製模式：upstream.py 的同步與非同步用戶端把每個請求/回應連同時間寫進 cassette（JSON Lines）
+- 重播模式：不連網，依 cassette 回應；每個回應等待錄製時的延遲（可用倍速加快）
+- 輪詢依「送出後經過的時間」挑選當時錄到的狀態，所以改了輪詢間隔也能得到真實的完成時間與輪詢次數
+- 不記錄 Authorization 等標頭；請求中超過 256 字元的字串（圖片 Base64 等）只保留長度與雜湊
+
+設定：
+    VEO_CASSETTE=traces/veo.jsonl VEO_CASSETTE_MODE=record uvicorn server:app
+    VEO_CASSETTE=traces/veo.jsonl VEO_CASSETTE_MODE=replay VEO_REPLAY_SPEED=10 uvicorn server:app
+
+錄製模式會把回應本文完整讀進記憶體後才交給呼叫端（串流解碼的記憶體優勢在錄製時不存在）。
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+PATH = os.environ.get("VEO_CASSETTE") or None
+# record、replay；未設定時不啟用
+MODE = (os.environ.get("VEO_CASSETTE_MODE") or "").lower() or None
+# 1 為錄製時的速度，10 為十倍速；0 表示不等待、輪詢直接得到最後的狀態
+REPLAY_SPEED = float(os.environ.get("VEO_REPLAY_SPEED", "1"))
+# 請求本文中超過此長度的字串只記錄雜湊
+MAX_RECORDED_STRING = 256
+# 回應標頭中描述原始傳輸編碼的欄位；本文已解碼保存，重播時不能再帶
+_DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+MatchKey = Tuple[str, str, str]
+
+
+def _redact(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > MAX_RECORDED_STRING:
+        return f"<{len(value)} chars sha256:{hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]}>"
+    if isinstance(value, dict):
+        return {k: _redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _request_body(content: bytes) -> Any:
+    if not content:
+        return None
+    try:
+        return _redact(json.loads(content))
+    except ValueError:
+        return {"bytes": len(content), "sha256": hashlib.sha256(content).hexdigest()[:16]}
+
+
+def _target(url: httpx.URL) -> str:
+    """路徑與查詢字串（不含主機，重播時基底網址可以不同）"""
+    parts = urlsplit(str(url))
+    return parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def _match_key(method: str, target: str, range_header: Optional[str]) -> MatchKey:
+    return method, target, range_header or ""
+
+
+class Cassette:
+    """一個 cassette 檔案的錄製與重播狀態"""
+
+    def __init__(self, path: Optional[str] = PATH, mode: Optional[str] = MODE, speed: float = REPLAY_SPEED):
+        """
+        Args:
+            path: cassette 檔案（JSON Lines，每行一次互動）
+            mode: "record"、"replay" 或 None（不啟用）
+            speed: 重播倍速；0 表示不等待
+        """
+        if mode not in (None, "record", "replay"):
+            raise ValueError(f"不支援的 VEO_CASSETTE_MODE: {mode}")
+        if mode and not path:
+            raise ValueError("啟用錄製或重播時必須設定 VEO_CASSETTE")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._loaded = False
+        # 非輪詢請求：依序循環回應
+        self._sequences: Dict[MatchKey, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[MatchKey, int] = {}
+        # 輪詢：operationName -> [(送出後的秒數, 互動)]
+        self._polls: Dict[str, List[Tuple[float, Dict[str, Any]]]] = {}
+        # 重播時每個操作的起點（time.monotonic()）
+        self._replay_started: Dict[str, float] = {}
+        self.misses = 0
+
+    # ---- 錄製 ----
+
+    def record(self, request: httpx.Request, response: httpx.Response, started_at: float, elapsed: float):
+        content = response.content
+        entry = {
+            "at": round(started_at, 4),
+            "elapsed": round(elapsed, 4),
+            "request": {
+                "method": request.method,
+                "host": request.url.host,
+                "target": _target(request.url),
+                "range": request.headers.get("range"),
+                "body": _request_body(request.content),
+            },
+            "response": {
+                "status": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_RESPONSE_HEADERS},
+            },
+        }
+        try:
+            entry["response"]["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["response"]["bodyBase64"] = base64.b64encode(content).decode("ascii")
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    # ---- 重播 ----
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            entries = []
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entries.append(json.loads(line))
+            entries.sort(key=lambda e: e["at"])
+            submitted_at: Dict[str, float] = {}
+            for entry in entries:
+                name = _operation_name(entry)
+                if name is not None and name not in submitted_at:
+                    submitted_at[name] = entry["at"]
+            for entry in entries:
+                request = entry["request"]
+                polled = (request.get("body") or {}).get("operationName") if isinstance(request.get("body"), dict) else None
+                if polled:
+                    origin = submitted_at.setdefault(polled, entry["at"])
+                    self._polls.setdefault(polled, []).append((entry["at"] - origin, entry))
+                else:
+                    key = _match_key(request["method"], request["target"], request.get("range"))
+                    self._sequences.setdefault(key, []).append(entry)
+            self._loaded = True
+
+    def lookup(self, request: httpx.Request) -> Optional[Dict[str, Any]]:
+        """挑選要重播的互動；找不到時回傳 None"""
+        self.load()
+        now = time.monotonic()
+        body = _request_body(request.content) if request.method == "POST" else None
+        polled = body.get("operationName") if isinstance(body, dict) else None
+        with self._lock:
+            if polled and polled in self._polls:
+                started = self._replay_started.setdefault(polled, now)
+                offset = float("inf") if self.speed <= 0 else (now - started) * self.speed
+                polls = self._polls[polled]
+                chosen = polls[0][1]
+                for recorded_offset, entry in polls:
+                    if recorded_offset > offset:
+                        break
+                    chosen = entry
+                return chosen
+            key = _match_key(request.method, _target(request.url), request.headers.get("range"))
+            sequence = self._sequences.get(key)
+            if not sequence:
+                self.misses += 1
+                return None
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            entry = sequence[index % len(sequence)]
+            name = _operation_name(entry)
+            if name is not None:
+                self._replay_started[name] = now
+            return entry
+
+    def delay(self, entry: Optional[Dict[str, Any]]) -> float:
+        if entry is None or self.speed <= 0:
+            return 0.0
+        return entry["elapsed"] / self.speed
+
+    def response(self, request: httpx.Request, entry: Optional[Dict[str, Any]]) -> httpx.Response:
+        if entry is None:
+            error = {"error": {"code": 404, "status": "NOT_FOUND",
+                               "message": f"cassette 中沒有對應的請求: {request.method} {_target(request.url)}"}}
+            return httpx.Response(404, json=error, request=request)
+        recorded = entry["response"]
+        if "bodyBase64" in recorded:
+            content = base64.b64decode(recorded["bodyBase64"])
+        else:
+            content = recorded.get("body", "").encode("utf-8")
+        return httpx.Response(recorded["status"], headers=recorded["headers"], content=content, request=request)
+
+    # ---- 傳輸層 ----
+
+    def transport(self, inner: httpx.BaseTransport) -> httpx.BaseTransport:
+        """依模式包裝同步傳輸層；未啟用時原樣回傳"""
+        if self.mode == "record":
+            return RecordingTransport(self, inner)
+        if self.mode == "replay":
+            return ReplayTransport(self)
+        return inner
+
+    def async_transport(self, inner: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        """依模式包裝非同步傳輸層；未啟用時原樣回傳"""
+        if self.mode == "record":
+            return AsyncRecordingTransport(self, inner)
+        if self.mode == "replay":
+            return AsyncReplayTransport(self)
+        return inner
+
+
+def _operation_name(entry: Dict[str, Any]) -> Optional[str]:
+    """送出請求（:predictLongRunning）回應中的操作名稱"""
+    if not entry["request"]["target"].endswith(":predictLongRunning") or entry["response"]["status"] != 200:
+        return None
+    try:
+        return json.loads(entry["response"].get("body") or "{}").get("name")
+    except ValueError:
+        return None
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette, inner: httpx.BaseTransport):
+        self.cassette = cassette
+        self.inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        started_at, started = time.time(), time.perf_counter()
+        response = self.inner.handle_request(request)
+        try:
+            response.read()
+        finally:
+            response.close()
+        elapsed = time.perf_counter() - started
+        replayable = _replayable(request, response)
+        self.cassette.record(request, replayable, started_at, elapsed)
+        return replayable
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, inner: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        started_at, started = time.time(), time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        elapsed = time.perf_counter() - started
+        replayable = _replayable(request, response)
+        await asyncio.to_thread(self.cassette.record, request, replayable, started_at, elapsed)
+        return replayable
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def _replayable(request: httpx.Request, response: httpx.Response) -> httpx.Response:
+    """已讀完的上游回應轉成與重播相同的形式（本文已解碼、去掉傳輸編碼標頭）"""
+    headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_RESPONSE_HEADERS}
+    return httpx.Response(response.status_code, headers=headers, content=response.content, request=request)
+
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        entry = self.cassette.lookup(request)
+        time.sleep(self.cassette.delay(entry))
+        return self.cassette.response(request, entry)
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        entry = self.cassette.lookup(request)
+        await asyncio.sleep(self.cassette.delay(entry))
+        return self.cassette.response(request, entry)
+
+
+# 整個程序共用的實例
+default_cassette = Cassette()
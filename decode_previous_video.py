@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 """
 解碼之前生成的 Base64 影片資料並儲存為 MP4 檔案
+- 優先從本機結果封存（result_store）讀取，已解碼過的影片直接複製
+- 用法：python decode_previous_video.py [operationName]
 """
 
 import base64
 import os
+import shutil
 import subprocess
+import sys
 import json
 import time
-import requests
 from datetime import datetime
+from typing import Optional
+
+import upstream
+from poll_scheduler import default_scheduler as poll_scheduler
+from result_store import default_store as result_store
+from token_provider import STATIC_TOKEN
 
 
 class Base64VideoDecoder:
@@ -26,6 +35,8 @@ class Base64VideoDecoder:
     
     def get_access_token(self) -> str:
         """獲取存取權杖"""
+        if STATIC_TOKEN:
+            return STATIC_TOKEN
         result = subprocess.run(
             ["gcloud", "auth", "print-access-token"],
             capture_output=True,
@@ -34,14 +45,27 @@ class Base64VideoDecoder:
         )
         return result.stdout.strip()
     
-    def get_last_operation_result(self) -> dict:
-        """重新獲取之前操作的結果"""
+    def get_last_operation_result(self, operation_name: Optional[str] = None) -> dict:
+        """
+        取得之前操作的結果：未指定操作名稱時使用封存中最近使用的操作。
+        封存中沒有任何結果時，才重新生成一次。
+        """
         
         print("🔍 正在重新獲取之前的影片生成結果...")
         
-        # 我們需要重新運行一個快速測試來獲取結果
+        operation_name = operation_name or result_store.latest()
+        if operation_name:
+            archived = result_store.load(operation_name)
+            if archived is not None:
+                print(f"📦 從本機封存讀取: {operation_name}")
+                return {"name": operation_name, "done": True, "response": archived}
+            # 封存裡沒有：查詢上游一次（已完成的操作會立即回傳）
+            return self.wait_for_completion(operation_name)
+        
+        print("⚠️ 本機封存中沒有任何結果，重新生成一次")
+        # 使用相同的參數重新運行一個快速測試
         # 使用相同的參數
-        url = f"https://{self.location}-aiplatform.googleapis.com/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/veo-3.0-fast-generate-001:predictLongRunning"
+        url = f"{upstream.vertex_base_url(self.location)}/projects/{self.project_id}/locations/{self.location}/publishers/google/models/veo-3.0-fast-generate-001:predictLongRunning"
         
         headers = {
             "Authorization": f"Bearer {self.get_access_token()}",
@@ -62,7 +86,7 @@ class Base64VideoDecoder:
         }
         
         print("📤 發送影片生成請求...")
-        response = requests.post(url, headers=headers, json=payload)
+        response = upstream.post(url, headers=headers, json=payload, retry=False)
         
         if response.status_code != 200:
             raise Exception(f"API 請求失敗: {response.status_code} - {response.text}")
@@ -73,13 +97,24 @@ class Base64VideoDecoder:
         print(f"✅ 請求已提交，等待生成完成...")
         
         # 等待完成
-        return self.wait_for_completion(operation_name)
+        parameters = payload["parameters"]
+        return self.wait_for_completion(operation_name, resolution=parameters["resolution"],
+                                        duration_seconds=parameters["durationSeconds"])
     
-    def wait_for_completion(self, operation_name: str, max_wait: int = 300) -> dict:
-        """等待操作完成"""
+    def wait_for_completion(self, operation_name: str, max_wait: int = 300,
+                            resolution: Optional[str] = None, duration_seconds: Optional[int] = None) -> dict:
+        """
+        等待操作完成
+        
+        Args:
+            operation_name: 操作名稱
+            max_wait: 最大等待時間（秒）
+            resolution: 影片解析度；None 表示不是本次送出的操作，參數未知
+            duration_seconds: 影片長度；None 表示參數未知
+        """
         
         model_id = "veo-3.0-fast-generate-001"
-        poll_url = f"https://{self.location}-aiplatform.googleapis.com/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/{model_id}:fetchPredictOperation"
+        poll_url = f"{upstream.vertex_base_url(self.location)}/projects/{self.project_id}/locations/{self.location}/publishers/google/models/{model_id}:fetchPredictOperation"
         
         headers = {
             "Authorization": f"Bearer {self.get_access_token()}",
@@ -95,18 +130,35 @@ class Base64VideoDecoder:
             check_count += 1
             elapsed = int(time.time() - start_time)
             
-            response = requests.post(poll_url, headers=headers, json=poll_payload)
+            try:
+                # 查詢是冪等的：429/5xx 與網路錯誤會依退避自動重試
+                response = upstream.post(poll_url, headers=headers, json=poll_payload, idempotent=True)
+            except Exception as e:
+                # 重試後仍失敗：生成仍在上游進行，稍後再查而不是放棄整個工作
+                print(f"   ⚠️ 檢查 {check_count}: 狀態檢查暫時失敗 ({e})")
+                response = None
             
-            if response.status_code == 200:
+            if response is not None and response.status_code != 200 and not upstream.is_transient_status(response.status_code):
+                # 400/403/404 等永久錯誤：再查也不會成功
+                raise Exception(f"狀態檢查失敗: {response.status_code} - {response.text}")
+            if response is not None and response.status_code == 200:
                 status = response.json()
                 
                 if status.get("done", False):
                     print(f"\n🎉 影片生成完成！(總時間: {elapsed} 秒)")
+                    if resolution is not None and duration_seconds is not None:
+                        # 只有本次送出的操作才知道從送出到完成的完整耗時
+                        poll_scheduler.record_completion(model_id, resolution, duration_seconds, time.time() - start_time)
+                    if status.get("response"):
+                        # 解碼一次並封存，之後重新讀取只需讀磁碟
+                        status["response"] = result_store.store(operation_name, status["response"])
                     return status
                 else:
-                    print(f"   檢查 {check_count}: 處理中... (已等待 {elapsed} 秒)")
+                    remaining = poll_scheduler.estimate_remaining(elapsed, model_id, resolution, duration_seconds)
+                    print(f"   檢查 {check_count}: 處理中... (已等待 {elapsed} 秒，預估還需 {remaining} 秒)")
             
-            time.sleep(15)
+            # 依歷史完成時間決定下一次檢查時間
+            time.sleep(poll_scheduler.next_interval(time.time() - start_time, model_id, resolution, duration_seconds))
         
         raise Exception(f"等待超時 ({max_wait} 秒)")
     
@@ -141,6 +193,24 @@ class Base64VideoDecoder:
             print(f"❌ 解碼失敗: {str(e)}")
             raise
     
+    def save_archived_video(self, operation_name: str, sample_index: int, filename_prefix: str = "veo_rose") -> str:
+        """從本機封存複製已解碼的影片"""
+        
+        sample = result_store.get_sample(operation_name, sample_index)
+        if sample is None:
+            raise Exception("封存中找不到影片檔案")
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filepath = os.path.join(self.output_dir, f"{filename_prefix}_{timestamp}.mp4")
+        shutil.copyfile(sample["path"], filepath)
+        
+        print(f"\n🎥 影片已成功儲存！")
+        print(f"📁 檔案位置: {filepath}")
+        print(f"📏 檔案大小: {sample['bytes'] / (1024 * 1024):.2f} MB")
+        print(f"🎬 格式: {sample.get('mimeType', 'video/mp4')}")
+        
+        return filepath
+    
     def open_video(self, filepath: str):
         """在預設播放器中開啟影片"""
         try:
@@ -158,7 +228,7 @@ class Base64VideoDecoder:
         except Exception as e:
             print(f"⚠️ 無法開啟 Finder: {e}")
     
-    def process_previous_video(self):
+    def process_previous_video(self, operation_name: Optional[str] = None):
         """處理之前生成的影片"""
         
         print("🎬 Veo 影片解碼與儲存工具")
@@ -168,7 +238,7 @@ class Base64VideoDecoder:
         
         try:
             # 重新獲取之前的操作結果
-            result = self.get_last_operation_result()
+            result = self.get_last_operation_result(operation_name)
             
             # 檢查回應
             if "response" not in result:
@@ -184,24 +254,29 @@ class Base64VideoDecoder:
             
             video = videos[0]  # 取第一個影片
             
-            if "bytesBase64Encoded" not in video:
+            if "sampleIndex" in video:
+                # 已解碼並封存
+                print(f"📊 找到影片資料: {video['bytes'] / (1024 * 1024):.2f} MB ({video.get('mimeType', 'video/mp4')})")
+                print()
+                filepath = self.save_archived_video(result["name"], video["sampleIndex"])
+            elif "bytesBase64Encoded" in video:
+                # 顯示影片資訊
+                base64_data = video["bytesBase64Encoded"]
+                data_size = len(base64_data)
+                estimated_mb = (data_size * 3 / 4) / (1024 * 1024)  # Base64 解碼後大約是原大小的 3/4
+                
+                print(f"📊 找到影片資料:")
+                print(f"   Base64 資料大小: {data_size:,} 字符")
+                print(f"   預估影片大小: {estimated_mb:.2f} MB")
+                print(f"   格式: {video.get('mimeType', 'video/mp4')}")
+                print()
+                
+                # 儲存影片
+                filepath = self.save_base64_video(base64_data)
+            else:
                 print("❌ 影片不是 Base64 格式")
                 return
             
-            # 顯示影片資訊
-            base64_data = video["bytesBase64Encoded"]
-            data_size = len(base64_data)
-            estimated_mb = (data_size * 3 / 4) / (1024 * 1024)  # Base64 解碼後大約是原大小的 3/4
-            
-            print(f"📊 找到影片資料:")
-            print(f"   Base64 資料大小: {data_size:,} 字符")
-            print(f"   預估影片大小: {estimated_mb:.2f} MB")
-            print(f"   格式: {video.get('mimeType', 'video/mp4')}")
-            print()
-            
-            # 儲存影片
-            filepath = self.save_base64_video(base64_data)
-            
             # 詢問是否開啟
             print("\n選擇操作:")
             print("1. 在影片播放器中開啟")
@@ -231,4 +306,4 @@ class Base64VideoDecoder:
 
 if __name__ == "__main__":
     decoder = Base64VideoDecoder()
-    decoder.process_previous_video()
\ No newline at end of file
+    decoder.process_previous_video(sys.argv[1] if len(sys.argv) > 1 else None)
\ No newline at end of file
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+本機的 Vertex AI Veo 替身（離線壓測與故障測試用）
+- 實作 :predictLongRunning 與 :fetchPredictOperation，請求與回應格式與真實 API 相同
+  （videos[].bytesBase64Encoded、raiMediaFilteredCount；指定 storageUri 時改回 videos[].gcsUri）
+- 同時提供 Cloud Storage JSON API 的物件下載（含 Range），讓 gcsUri 結果也能離線取回
+- 完成時間分佈、影片大小、429/5xx 注入比例、回應延遲都可用 VEO_FAKE_* 環境變數設定
+
+使用方式：
+    uvicorn fake_vertex:app --port 8090
+    VEO_BASE_URL=http://127.0.0.1:8090/v1 VEO_GCS_ENDPOINT=http://127.0.0.1:8090 \\
+        VEO_STATIC_TOKEN=fake uvicorn server:app --port 8001
+
+分佈格式："30"（固定）、"uniform:20:60"、"normal:40:8"、"lognormal:35:0.3"（中位數, sigma）
+"""
+
+import asyncio
+import base64
+import math
+import os
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+RESPONSE_TYPE = "type.googleapis.com/cloud.ai.large_models.vision.GenerateVideoResponse"
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """把分佈字串轉成抽樣函式（結果不小於 0）"""
+    kind, _, args = spec.partition(":")
+    try:
+        value = float(kind)
+        return lambda rng: value
+    except ValueError:
+        pass
+    params = [float(x) for x in args.split(":")] if args else []
+    if kind == "uniform":
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == "normal":
+        mean, sd = params
+        return lambda rng: max(0.0, rng.gauss(mean, sd))
+    if kind == "lognormal":
+        median, sigma = params
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"不支援的分佈: {spec}")
+
+
+class FakeVertex:
+    """操作狀態與故障注入設定"""
+
+    def __init__(
+        self,
+        completion: str = "30",
+        latency: str = "0",
+        video_bytes: int = 3 * 1024 * 1024,
+        rate_429: float = 0.0,
+        rate_5xx: float = 0.0,
+        rai_filter_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            completion: 送出到完成的秒數分佈
+            latency: 每個請求回應前的延遲秒數分佈
+            video_bytes: 每個樣本的影片大小（位元組）
+            rate_429: 送出與輪詢回 429 的比例
+            rate_5xx: 送出與輪詢回 503 的比例
+            rai_filter_rate: 每個樣本被安全過濾（不回傳、計入 raiMediaFilteredCount）的比例
+            seed: 亂數種子（固定後結果可重現）
+        """
+        self.completion = parse_distribution(completion)
+        self.latency = parse_distribution(latency)
+        self.video_bytes = video_bytes
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rai_filter_rate = rai_filter_rate
+        self.rng = random.Random(seed)
+        self.operations: Dict[str, Dict[str, Any]] = {}
+        # gs:// 物件名稱 -> 樣本序號（內容都是同一段假影片）
+        self.objects: Dict[str, int] = {}
+        self._video: Optional[bytes] = None
+        self._video_b64: Optional[str] = None
+        self.counts = {"submitted": 0, "fetches": 0, "completed": 0, "injected429": 0, "injected5xx": 0,
+                       "objectDownloads": 0}
+
+    @classmethod
+    def from_env(cls) -> "FakeVertex":
+        seed = os.environ.get("VEO_FAKE_SEED")
+        return cls(
+            completion=os.environ.get("VEO_FAKE_COMPLETION_SECONDS", "30"),
+            latency=os.environ.get("VEO_FAKE_LATENCY_SECONDS", "0"),
+            video_bytes=int(os.environ.get("VEO_FAKE_VIDEO_BYTES", str(3 * 1024 * 1024))),
+            rate_429=float(os.environ.get("VEO_FAKE_429_RATE", "0")),
+            rate_5xx=float(os.environ.get("VEO_FAKE_5XX_RATE", "0")),
+            rai_filter_rate=float(os.environ.get("VEO_FAKE_RAI_FILTER_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+
+    @property
+    def video(self) -> bytes:
+        # 所有樣本共用同一段內容；只產生與編碼一次，壓測時不會被替身本身的 CPU 拖慢
+        if self._video is None:
+            self._video = random.Random(0).randbytes(self.video_bytes)
+            self._video_b64 = base64.b64encode(self._video).decode("ascii")
+        return self._video
+
+    @property
+    def video_b64(self) -> str:
+        self.video
+        return self._video_b64
+
+    def injected_error(self) -> Optional[JSONResponse]:
+        """依設定的比例回傳 429 或 503"""
+        roll = self.rng.random()
+        if roll < self.rate_429:
+            self.counts["injected429"] += 1
+            return _error(429, "RESOURCE_EXHAUSTED", "Quota exceeded for aiplatform.googleapis.com/online_prediction_requests_per_base_model")
+        if roll < self.rate_429 + self.rate_5xx:
+            self.counts["injected5xx"] += 1
+            return _error(503, "UNAVAILABLE", "The service is currently unavailable.")
+        return None
+
+    def submit(self, project: str, location: str, model: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        parameters = body.get("parameters") or {}
+        name = f"projects/{project}/locations/{location}/publishers/google/models/{model}/operations/{uuid.uuid4()}"
+        self.operations[name] = {
+            "doneAt": time.time() + self.completion(self.rng),
+            "samples": int(parameters.get("sampleCount", 1)),
+            "storageUri": parameters.get("storageUri"),
+        }
+        self.counts["submitted"] += 1
+        return {"name": name}
+
+    def fetch(self, name: str) -> Optional[Dict[str, Any]]:
+        """操作目前的狀態；不存在回傳 None"""
+        op = self.operations.get(name)
+        if op is None:
+            return None
+        self.counts["fetches"] += 1
+        if time.time() < op["doneAt"]:
+            return {"name": name}
+        if "response" not in op:
+            self.counts["completed"] += 1
+            op["response"] = self._response(name, op)
+        return {"name": name, "done": True, "response": op["response"]}
+
+    def _response(self, name: str, op: Dict[str, Any]) -> Dict[str, Any]:
+        kept = [i for i in range(op["samples"]) if self.rng.random() >= self.rai_filter_rate]
+        videos = []
+        for i in kept:
+            if op["storageUri"]:
+                uri = f"{op['storageUri'].rstrip('/')}/{name.rsplit('/', 1)[-1]}/sample_{i}.mp4"
+                self.objects[uri] = i
+                videos.append({"gcsUri": uri, "mimeType": "video/mp4"})
+            else:
+                # 只記住樣本數；實際的 Base64 在輸出時才放進去，避免每個操作都保留一份
+                videos.append({"mimeType": "video/mp4"})
+        return {"@type": RESPONSE_TYPE, "raiMediaFilteredCount": op["samples"] - len(kept), "videos": videos}
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, "operations": len(self.operations),
+                "running": sum(1 for op in self.operations.values() if "response" not in op)}
+
+
+def _error(code: int, status: str, message: str) -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": message, "status": status}}, status_code=code)
+
+
+def _with_video_bytes(fake: FakeVertex, result: Dict[str, Any]) -> Dict[str, Any]:
+    response = result.get("response")
+    if not response:
+        return result
+    videos = [v if "gcsUri" in v else {"bytesBase64Encoded": fake.video_b64, **v} for v in response["videos"]]
+    return {**result, "response": {**response, "videos": videos}}
+
+
+def create_app(fake: FakeVertex) -> FastAPI:
+    app = FastAPI(title="Fake Vertex AI (Veo)")
+    app.state.fake = fake
+
+    async def delay():
+        seconds = fake.latency(fake.rng)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    @app.post("/v1/projects/{project}/locations/{location}/publishers/google/models/{model_method}")
+    async def model_method(project: str, location: str, model_method: str, request: Request):
+        await delay()
+        model, _, method = model_method.rpartition(":")
+        error = fake.injected_error()
+        if error is not None:
+            return error
+        body = await request.json()
+        if method == "predictLongRunning":
+            if not body.get("instances"):
+                return _error(400, "INVALID_ARGUMENT", "instances is required")
+            return fake.submit(project, location, model, body)
+        if method == "fetchPredictOperation":
+            result = fake.fetch(body.get("operationName", ""))
+            if result is None:
+                return _error(404, "NOT_FOUND", f"Operation {body.get('operationName')} not found")
+            return _with_video_bytes(fake, result)
+        return _error(404, "NOT_FOUND", f"Unknown method {method}")
+
+    @app.get("/storage/v1/b/{bucket}/o/{name:path}")
+    async def storage_object(bucket: str, name: str, request: Request, alt: Optional[str] = None):
+        """Cloud Storage JSON API：物件中繼資料，或 alt=media 下載（支援單一 Range）"""
+        await delay()
+        uri = f"gs://{bucket}/{name}"
+        if uri not in fake.objects:
+            return _error(404, "NOT_FOUND", f"No such object: {bucket}/{name}")
+        video = fake.video
+        if alt != "media":
+            return {"bucket": bucket, "name": name, "size": str(len(video)), "contentType": "video/mp4"}
+        fake.counts["objectDownloads"] += 1
+        range_header = request.headers.get("range", "")
+        if not range_header.startswith("bytes="):
+            return Response(video, media_type="video/mp4")
+        start_s, _, end_s = range_header[len("bytes="):].partition("-")
+        start = int(start_s)
+        end = min(int(end_s) if end_s else len(video) - 1, len(video) - 1)
+        return Response(video[start:end + 1], status_code=206, media_type="video/mp4",
+                        headers={"Content-Range": f"bytes {start}-{end}/{len(video)}"})
+
+    @app.get("/fake/stats")
+    def stats():
+        return fake.stats()
+
+    return app
+
+
+app = create_app(FakeVertex.from_env())
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get("VEO_FAKE_PORT", "8090")))
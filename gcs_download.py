@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+gs:// 結果的平行分段下載
+- 設定 storageUri 時 Veo 把影片寫到 Cloud Storage，回應只帶 gcsUri（不再有數十 MB 的 Base64）
+- 先以 JSON API 取得物件大小，再以多個 Range GET 平行下載，直接寫到檔案的對應位置
+- 端點由 VEO_GCS_ENDPOINT 設定，測試時可指向本機的 fake-gcs-server（非 Google 端點不帶認證）
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+import upstream
+from retry_policy import default_policy
+
+GOOGLE_ENDPOINT = "https://storage.googleapis.com"
+ENDPOINT = os.environ.get("VEO_GCS_ENDPOINT", GOOGLE_ENDPOINT).rstrip("/")
+# 每個 Range 請求的大小（位元組）
+PART_SIZE = int(os.environ.get("VEO_GCS_PART_SIZE", str(8 * 1024 * 1024)))
+# 平行下載的請求數
+WORKERS = int(os.environ.get("VEO_GCS_WORKERS", "8"))
+# 寫入檔案的區塊大小
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_gs_uri(uri: str) -> Tuple[str, str]:
+    """gs://bucket/path/to/object -> (bucket, path/to/object)"""
+    if not uri.startswith("gs://"):
+        raise ValueError(f"不是 gs:// 網址: {uri}")
+    bucket, _, name = uri[len("gs://"):].partition("/")
+    if not bucket or not name:
+        raise ValueError(f"gs:// 網址缺少 bucket 或物件名稱: {uri}")
+    return bucket, name
+
+
+class GCSDownloader:
+    """以 Cloud Storage JSON API 下載物件"""
+
+    def __init__(self, endpoint: str = ENDPOINT, part_size: int = PART_SIZE, workers: int = WORKERS,
+                 token: Optional[Callable[[], str]] = None):
+        """
+        Args:
+            endpoint: Storage API 端點（例如 http://localhost:4443 的 fake-gcs-server）
+            part_size: 每個 Range 請求的大小
+            workers: 平行請求數
+            token: 取得 Bearer 權杖的函式；None 時 Google 端點使用共用的 token_provider，其他端點不帶認證
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.part_size = max(1, part_size)
+        self.workers = max(1, workers)
+        if token is None and self.endpoint == GOOGLE_ENDPOINT:
+            from token_provider import default_provider
+            token = default_provider.get_token
+        self.token = token
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def object_url(self, uri: str) -> str:
+        bucket, name = parse_gs_uri(uri)
+        return f"{self.endpoint}/storage/v1/b/{quote(bucket, safe='')}/o/{quote(name, safe='')}"
+
+    def size(self, uri: str) -> int:
+        response = self._get(self.object_url(uri))
+        return int(response.json()["size"])
+
+    def download(self, uri: str, path: str) -> Dict[str, Any]:
+        """
+        下載到 path，回傳 {"bytes", "etag"}（etag 與 Base64 解碼的樣本相同，為內容 SHA-256 的前 32 字元）
+        """
+        size = self.size(uri)
+        media_url = self.object_url(uri) + "?alt=media"
+        ranges = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+        with open(path, "wb") as f:
+            f.truncate(size)
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            if len(ranges) <= 1:
+                for start, end in ranges:
+                    self._fetch_range(media_url, fd, start, end)
+            else:
+                # 任一段失敗就整個失敗；list() 會把例外拋出來
+                list(self._executor().map(lambda r: self._fetch_range(media_url, fd, *r), ranges))
+        finally:
+            os.close(fd)
+        return {"bytes": size, "etag": _file_sha256(path)[:32]}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token()}"} if self.token else {}
+
+    def _get(self, url: str) -> httpx.Response:
+        delays = default_policy.delays()
+        while True:
+            try:
+                response = upstream.get_client().get(url, headers=self._headers())
+            except httpx.TransportError as e:
+                delay = next(delays, None) if default_policy.should_retry_error(e, idempotent=True) else None
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            delay = next(delays, None) if default_policy.should_retry_status(response.status_code, idempotent=True) else None
+            if delay is None:
+                response.raise_for_status()
+                return response
+            time.sleep(default_policy.wait_time(delay, response.headers))
+
+    def _fetch_range(self, url: str, fd: int, start: int, end: int):
+        """下載 [start, end] 並寫到檔案的相同位置；網路錯誤時整段重新下載"""
+        delays = default_policy.delays()
+        while True:
+            headers = dict(self._headers(), Range=f"bytes={start}-{end}")
+            try:
+                with upstream.get_client().stream("GET", url, headers=headers) as response:
+                    if default_policy.should_retry_status(response.status_code, idempotent=True):
+                        delay = next(delays, None)
+                        if delay is not None:
+                            time.sleep(default_policy.wait_time(delay, response.headers))
+                            continue
+                    response.raise_for_status()
+                    offset = start
+                    # 伺服器忽略 Range（回 200 整個物件）時跳過前面的部分，只取需要的範圍
+                    skip = start if response.status_code == 200 else 0
+                    for chunk in response.iter_bytes(WRITE_CHUNK_SIZE):
+                        if skip:
+                            chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                        chunk = chunk[: end + 1 - offset]
+                        if chunk:
+                            os.pwrite(fd, chunk, offset)
+                            offset += len(chunk)
+                        if offset > end:
+                            break
+                if offset != end + 1:
+                    raise httpx.ReadError(f"分段下載不完整: {start}-{end} 只收到 {offset - start} 位元組")
+                return
+            except httpx.TransportError as e:
+                delay = next(delays, None) if default_policy.should_retry_error(e, idempotent=True) else None
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="veo-gcs")
+        return self._pool
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(WRITE_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 整個程序共用的實例
+default_downloader = GCSDownloader()
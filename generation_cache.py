@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+以內容定址的生成結果快取（預設關閉，設定 VEO_GENERATION_CACHE=1 開啟）
+- 鍵為 (模型, instance, parameters) 正規化後的 SHA-256；圖片只取內容雜湊
+- 值只記錄操作名稱，影片本身放在 result_store 封存，快取不重複保存檔案
+- 支援存活時間（TTL）與位元組預算，超過預算時淘汰最久未使用的項目
+server.py 與 CLI 工具共用同一份索引檔：檔案被其他程序改過時先合併再使用，
+寫檔時持有檔案鎖，重新讀取、合併後才覆寫，不會蓋掉其他程序的項目
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Set, Tuple
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows：只有程序內的鎖
+    FCNTL_AVAILABLE = False
+
+INDEX_PATH = os.environ.get(
+    "VEO_GENERATION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "veo_generation_cache.json"),
+)
+ENABLED = os.environ.get("VEO_GENERATION_CACHE", "0") == "1"
+TTL_SECONDS = float(os.environ.get("VEO_GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+# 快取所參照影片的總大小上限（位元組）
+MAX_BYTES = int(os.environ.get("VEO_GENERATION_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+# 命中只更新使用時間；距離上次寫檔超過這麼久才寫回，其餘隨下一次寫檔一起保存
+TOUCH_SAVE_SECONDS = 60
+
+
+def _normalize_instance(instance: Dict[str, Any]) -> Dict[str, Any]:
+    normalized = {}
+    for k, v in instance.items():
+        if k == "prompt" and isinstance(v, str):
+            # 前後空白與連續空白不影響生成結果
+            normalized[k] = " ".join(v.split())
+        elif isinstance(v, dict) and "bytesBase64Encoded" in v:
+            # 圖片只保留內容雜湊，避免把整張圖放進鍵
+            encoded = v["bytesBase64Encoded"]
+            if isinstance(encoded, str):
+                digest = hashlib.sha256("".join(encoded.split()).encode("ascii")).hexdigest()
+            else:
+                # multipart 上傳的圖片（image_upload.UploadedImage）接收時已算好同樣的雜湊
+                digest = encoded.base64_sha256
+            normalized[k] = dict(
+                {kk: vv for kk, vv in v.items() if kk != "bytesBase64Encoded"},
+                sha256=digest,
+            )
+        else:
+            normalized[k] = v
+    return normalized
+
+
+class GenerationCache:
+    """生成請求 → 已完成操作名稱 的索引"""
+
+    def __init__(
+        self,
+        path: Optional[str] = INDEX_PATH,
+        enabled: bool = ENABLED,
+        ttl_seconds: float = TTL_SECONDS,
+        max_bytes: int = MAX_BYTES,
+    ):
+        """
+        Args:
+            path: 索引檔路徑；None 表示只保存在記憶體
+            enabled: 是否啟用
+            ttl_seconds: 項目的存活時間（秒）
+            max_bytes: 所參照影片的總大小上限
+        """
+        self.path = path
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = {}
+        # 上次讀取或寫入時檔案的 (mtime, 大小)；不同表示其他程序改過
+        self._disk_version: Optional[Tuple[int, int]] = None
+        # 上次寫檔後本程序新增或更新的鍵，以及移除的鍵（值為被移除項目的 storedAt）
+        self._dirty: Set[str] = set()
+        self._removed: Dict[str, float] = {}
+        self._saved_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_id: str, payload: Dict[str, Any]) -> str:
+        """predictLongRunning payload 的正規化雜湊"""
+        canonical = {
+            "model": model_id,
+            "instances": [_normalize_instance(i) for i in payload.get("instances", [])],
+            "parameters": payload.get("parameters", {}),
+        }
+        data = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        取得未過期項目的操作名稱；呼叫端仍需確認封存中有結果。
+        使用時間（LRU 淘汰依據）每 TOUCH_SAVE_SECONDS 秒最多寫回一次，可能寫檔。
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None or time.time() - entry["storedAt"] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            now = time.time()
+            entry["usedAt"] = now
+            self._dirty.add(key)
+            self.hits += 1
+            if now - self._saved_at >= TOUCH_SAVE_SECONDS:
+                self._save()
+            return entry["operationName"]
+
+    def put(self, key: str, operation_name: str, size: int):
+        """記錄一個完成的生成（size 為影片總位元組數）並依預算淘汰"""
+        if not self.enabled:
+            return
+        with self._lock:
+            index = self._load()
+            now = time.time()
+            index[key] = {"operationName": operation_name, "bytes": int(size), "storedAt": now, "usedAt": now}
+            self._dirty.add(key)
+            self._save()
+
+    def forget(self, key: str):
+        """移除失效的項目（例如封存中的影片已被淘汰）"""
+        with self._lock:
+            entry = self._load().pop(key, None)
+            if entry is not None:
+                self._dirty.discard(key)
+                self._removed[key] = entry["storedAt"]
+                self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load()
+            return {
+                "enabled": self.enabled,
+                "entries": len(index),
+                "bytes": sum(e["bytes"] for e in index.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self, index: Dict[str, Dict[str, Any]], now: float):
+        for k in [k for k, e in index.items() if now - e["storedAt"] > self.ttl_seconds]:
+            del index[k]
+        total = sum(e["bytes"] for e in index.values())
+        for k in sorted(index, key=lambda k: index[k]["usedAt"]):
+            if total <= self.max_bytes:
+                break
+            total -= index.pop(k)["bytes"]
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """回傳記憶體中的索引；檔案被其他程序改過時先合併檔案內容"""
+        version = self._version()
+        if version != self._disk_version:
+            self._merge(self._read())
+            self._disk_version = version
+        return self._index
+
+    def _version(self) -> Optional[Tuple[int, int]]:
+        if not self.path:
+            return None
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _merge(self, disk: Dict[str, Dict[str, Any]]):
+        """
+        合併檔案中的索引：較新的 storedAt 為準、usedAt 取較晚者。
+        本程序未寫出的更新與移除優先；其他項目不在檔案中表示已被其他程序移除。
+        """
+        for key in [k for k in self._index if k not in disk and k not in self._dirty]:
+            del self._index[key]
+        for key, entry in disk.items():
+            if key in self._removed and entry["storedAt"] <= self._removed[key]:
+                continue
+            mine = self._index.get(key)
+            if mine is None:
+                self._index[key] = dict(entry)
+                continue
+            used_at = max(mine["usedAt"], entry["usedAt"])
+            if entry["storedAt"] > mine["storedAt"]:
+                mine = self._index[key] = dict(entry)
+            mine["usedAt"] = used_at
+
+    @contextmanager
+    def _file_lock(self):
+        """跨程序的寫檔鎖（fcntl 不可用時只靠程序內的鎖）"""
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        """重新讀取並合併檔案、依預算淘汰後寫回（呼叫端持有 self._lock）"""
+        now = time.time()
+        self._saved_at = now
+        if not self.path:
+            self._evict(self._index, now)
+            self._dirty.clear()
+            self._removed.clear()
+            return
+        try:
+            with self._file_lock():
+                self._merge(self._read())
+                self._evict(self._index, now)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._index, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._disk_version = self._version()
+        except OSError:
+            return
+        self._dirty.clear()
+        self._removed.clear()
+
+
+# 整個程序共用的實例
+default_cache = GenerationCache()
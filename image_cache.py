@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+已編碼圖片的快取（給 image_to_video.py 的參考圖片用）
+- 以 (絕對路徑, mtime, 檔案大小) 為鍵保存 Base64 字串，檔案被修改後自動失效
+- 依位元組預算 LRU 淘汰
+- 多張圖片同時未命中時，以執行緒池平行讀取與編碼
+- 命中時只需要一次 os.stat，不再讀檔與重新編碼
+"""
+
+import base64
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 快取的 Base64 總位元組上限
+MAX_BYTES = int(os.environ.get("VEO_ENCODED_IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# 平行讀取的執行緒數
+LOAD_WORKERS = int(os.environ.get("VEO_IMAGE_LOAD_WORKERS", "8"))
+
+CacheKey = Tuple[str, int, int]
+
+
+def _encode_file(path: str) -> str:
+    with open(path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+
+class EncodedImageCache:
+    """路徑 → Base64 的 LRU 快取"""
+
+    def __init__(self, max_bytes: int = MAX_BYTES, workers: int = LOAD_WORKERS):
+        """
+        Args:
+            max_bytes: 快取的 Base64 字串總位元組上限
+            workers: 未命中時平行讀取的執行緒數
+        """
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self._entries: "OrderedDict[CacheKey, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> str:
+        """單張圖片的 Base64"""
+        return self.get_many([path])[0]
+
+    def get_many(self, paths: Sequence[str]) -> List[str]:
+        """多張圖片的 Base64（依傳入順序）；未命中的圖片平行讀取"""
+        keys = [self._key(path) for path in paths]
+        found: Dict[CacheKey, str] = {}
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+                    self.hits += 1
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            if len(missing) == 1:
+                loaded = [_encode_file(missing[0][0])]
+            else:
+                loaded = list(self._executor().map(_encode_file, [key[0] for key in missing]))
+            with self._lock:
+                self.misses += len(missing)
+                for key, value in zip(missing, loaded):
+                    found[key] = value
+                    self._put(key, value)
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"images": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _key(self, path: str) -> CacheKey:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        return path, st.st_mtime_ns, st.st_size
+
+    def _put(self, key: CacheKey, value: str):
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = value
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="veo-image-load")
+        return self._pool
+
+
+# 整個程序共用的實例
+default_image_cache = EncodedImageCache()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+送出前的圖片正規化
+- 依請求的 aspectRatio / resolution 縮放並補黑邊（letterbox），重新壓成 JPEG
+- 20 MB 的原始 PNG 通常縮成幾百 KB，上游請求本文小一個數量級
+- 實際的解碼與編碼在程序池中進行，不佔用事件迴圈
+- 結果依「輸入 Base64 的 SHA-256 + 目標尺寸 + 品質」快取在記憶體中，依位元組預算 LRU 淘汰
+- 需要選用套件 Pillow；未安裝或 VEO_IMAGE_NORMALIZE=0 時圖片原樣送出
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps  # 選用套件
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = ImageOps = None
+    PIL_AVAILABLE = False
+
+from image_upload import UploadedImage
+
+ENABLED = os.environ.get("VEO_IMAGE_NORMALIZE", "1") != "0"
+JPEG_QUALITY = int(os.environ.get("VEO_IMAGE_JPEG_QUALITY", "90"))
+# 程序池大小（預設為 CPU 數）
+WORKERS = int(os.environ.get("VEO_IMAGE_WORKERS", "0")) or None
+# 正規化結果快取的位元組上限
+CACHE_MAX_BYTES = int(os.environ.get("VEO_IMAGE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+# resolution -> 短邊像素
+SHORT_SIDES = {"480p": 480, "720p": 720, "1080p": 1080}
+
+
+def target_size(aspect_ratio: str, resolution: str) -> Tuple[int, int]:
+    """例如 ("16:9", "720p") -> (1280, 720)、("9:16", "720p") -> (720, 1280)"""
+    w, h = (int(x) for x in aspect_ratio.split(":"))
+    if w <= 0 or h <= 0:
+        raise ValueError(f"aspectRatio 的兩個數字都必須大於 0: {aspect_ratio}")
+    short = SHORT_SIDES.get(resolution, 720)
+    if w >= h:
+        return int(round(short * w / h / 2)) * 2, short
+    return short, int(round(short * h / w / 2)) * 2
+
+
+def _normalize_image(data: bytes, width: int, height: int, quality: int) -> bytes:
+    """在子程序中執行：等比例縮放到目標框內，置中補黑邊後輸出 JPEG"""
+    with Image.open(io.BytesIO(data)) as src:
+        # EXIF 方向（手機照片常見）：先轉正再補邊，否則直拍的照片會被橫著放進框內
+        upright = src.getexif().get(0x0112, 1) == 1
+        if upright and src.format == "JPEG" and src.size == (width, height):
+            # 已經是目標尺寸的 JPEG：不再重新壓縮
+            return data
+        image = ImageOps.exif_transpose(src).convert("RGB")
+    scale = min(width / image.width, height / image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    image = image.resize(size, Image.LANCZOS)
+    canvas = Image.new("RGB", (width, height))
+    canvas.paste(image, ((width - size[0]) // 2, (height - size[1]) // 2))
+    out = io.BytesIO()
+    canvas.save(out, "JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+class ImageNormalizer:
+    """程序池 + 位元組預算的 LRU 快取"""
+
+    def __init__(self, enabled: bool = ENABLED, quality: int = JPEG_QUALITY, workers: Optional[int] = WORKERS,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        """
+        Args:
+            enabled: 是否正規化（未安裝 Pillow 時一律停用）
+            quality: JPEG 品質
+            workers: 程序池大小；None 為 CPU 數
+            max_bytes: 快取的正規化結果總位元組上限
+        """
+        self.enabled = enabled and PIL_AVAILABLE
+        self.quality = quality
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def normalize_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """把 payload 中每個 instance 的 image 換成正規化後的 JPEG（Base64）；停用時原樣回傳"""
+        if not self.enabled:
+            return payload
+        params = payload.get("parameters", {})
+        size = None
+        for instance in payload.get("instances", []):
+            image = instance.get("image")
+            if isinstance(image, dict) and "bytesBase64Encoded" in image:
+                # 只有真的帶圖片時才計算目標尺寸
+                if size is None:
+                    size = target_size(params.get("aspectRatio", "16:9"), params.get("resolution", "720p"))
+                encoded = await self.normalize(image["bytesBase64Encoded"], *size)
+                if encoded is not None:
+                    instance["image"] = {"bytesBase64Encoded": encoded, "mimeType": "image/jpeg"}
+        return payload
+
+    async def normalize(self, image, width: int, height: int) -> Optional[str]:
+        """
+        image 為 Base64 字串或 UploadedImage；回傳正規化後的 Base64，
+        無法解析的圖片回傳 None（交給上游回報錯誤）
+        """
+        if isinstance(image, UploadedImage):
+            digest = image.base64_sha256
+        else:
+            image = "".join(image.split())
+            digest = hashlib.sha256(image.encode("ascii")).hexdigest()
+        key = f"{digest}|{width}x{height}|q{self.quality}"
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        if isinstance(image, UploadedImage):
+            data = await asyncio.to_thread(_read_all, image.file)
+        else:
+            data = base64.b64decode(image)
+        loop = asyncio.get_running_loop()
+        try:
+            out = await loop.run_in_executor(self._executor(), _normalize_image, data, width, height, self.quality)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            return None
+        encoded = base64.b64encode(out).decode("ascii")
+        with self._lock:
+            self.bytes_in += len(data)
+            self.bytes_out += len(out)
+            self._put(key, encoded)
+        return encoded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pillowInstalled": PIL_AVAILABLE,
+                "cachedImages": len(self._cache),
+                "cachedBytes": self._cache_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "bytesIn": self.bytes_in,
+                "bytesOut": self.bytes_out,
+            }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _put(self, key: str, encoded: str):
+        if len(encoded) > self.max_bytes:
+            return
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_bytes -= len(old)
+        self._cache[key] = encoded
+        self._cache_bytes += len(encoded)
+        while self._cache_bytes > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+
+def _read_all(file) -> bytes:
+    file.seek(0)
+    return file.read()
+
+
+# 整個程序共用的實例
+default_normalizer = ImageNormalizer()
@@ -6,23 +6,31 @@ Veo API Image-to-Video Generation 測試
 
 import os
 import json
-import base64
 import time
-import requests
 import subprocess
 from typing import Dict, Any, Optional
 
+import upstream
+from image_cache import EncodedImageCache, default_image_cache
+from poll_scheduler import default_scheduler as poll_scheduler
+from token_provider import STATIC_TOKEN
+
 
 class VeoImageToVideoClient:
     """Veo 圖片轉影片 API 客戶端"""
     
-    def __init__(self, project_id: str, location: str = "us-central1"):
+    def __init__(self, project_id: str, location: str = "us-central1",
+                 image_cache: Optional[EncodedImageCache] = None):
         self.project_id = project_id
         self.location = location
-        self.base_url = f"https://{location}-aiplatform.googleapis.com/v1"
+        self.base_url = upstream.vertex_base_url(location)
+        # 重複使用的風格/素材參考圖片只讀取與編碼一次
+        self.image_cache = image_cache or default_image_cache
     
     def get_access_token(self) -> str:
         """獲取 Google Cloud 存取權杖"""
+        if STATIC_TOKEN:
+            return STATIC_TOKEN
         try:
             result = subprocess.run(
                 ["gcloud", "auth", "print-access-token"],
@@ -35,9 +43,8 @@ class VeoImageToVideoClient:
             raise Exception(f"無法獲取存取權杖: {e}")
     
     def encode_image_to_base64(self, image_path: str) -> str:
-        """將圖片編碼為 Base64 字串"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        """將圖片編碼為 Base64 字串（檔案未變更時直接取快取）"""
+        return self.image_cache.get(image_path)
     
     def get_mime_type(self, image_path: str) -> str:
         """根據檔案副檔名獲取 MIME 類型"""
@@ -122,7 +129,7 @@ class VeoImageToVideoClient:
         print(f"提示: {prompt}")
         print(f"模型: {model_id}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = upstream.post(url, headers=headers, json=payload, retry=False)
         
         if response.status_code == 200:
             return response.json()
@@ -157,10 +164,10 @@ class VeoImageToVideoClient:
             "Content-Type": "application/json; charset=utf-8"
         }
         
-        # 處理參考圖片
+        # 處理參考圖片：未快取的圖片平行讀取與編碼
+        encoded_images = self.image_cache.get_many([ref_img["path"] for ref_img in reference_images])
         reference_images_data = []
-        for ref_img in reference_images:
-            base64_image = self.encode_image_to_base64(ref_img["path"])
+        for ref_img, base64_image in zip(reference_images, encoded_images):
             mime_type = self.get_mime_type(ref_img["path"])
             
             reference_images_data.append({
@@ -194,7 +201,7 @@ class VeoImageToVideoClient:
         print(f"提示: {prompt}")
         print(f"參考圖片數量: {len(reference_images)}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = upstream.post(url, headers=headers, json=payload, retry=False)
         
         if response.status_code == 200:
             return response.json()
@@ -211,27 +218,44 @@ class VeoImageToVideoClient:
         }
         
         payload = {"operationName": operation_name}
-        response = requests.post(url, headers=headers, json=payload)
+        # 查詢是冪等的：429/5xx 與網路錯誤會依退避自動重試
+        response = upstream.post(url, headers=headers, json=payload, idempotent=True)
         
         if response.status_code == 200:
             return response.json()
         else:
-            raise Exception(f"狀態檢查失敗: {response.status_code} - {response.text}")
+            raise upstream.UpstreamStatusError(f"狀態檢查失敗: {response.status_code} - {response.text}",
+                                               response.status_code)
     
     def wait_for_completion(self, operation_name: str, model_id: str, 
-                          max_wait_time: int = 300, check_interval: int = 10) -> Dict[str, Any]:
+                          max_wait_time: int = 300, check_interval: Optional[int] = None,
+                          resolution: Optional[str] = None, duration_seconds: Optional[int] = None) -> Dict[str, Any]:
         """等待操作完成"""
         start_time = time.time()
         
         while time.time() - start_time < max_wait_time:
-            status = self.check_operation_status(operation_name, model_id)
+            try:
+                status = self.check_operation_status(operation_name, model_id)
+            except Exception as e:
+                # 400/403/404 等永久錯誤（操作名稱錯誤、權限被撤銷）直接拋出，不空等到逾時
+                if not upstream.is_transient_error(e):
+                    raise
+                # 重試後仍失敗：生成仍在上游進行，稍後再查而不是放棄整個工作
+                status = {}
+                print(f"⚠️ 狀態檢查暫時失敗，稍後重試: {e}")
             
+            elapsed = time.time() - start_time
             if status.get("done", False):
                 print("✅ 影片生成完成!")
+                if resolution is not None and duration_seconds is not None:
+                    # 與 text_to_video 相同，只記錄參數完整的完成時間
+                    poll_scheduler.record_completion(model_id, resolution, duration_seconds, elapsed)
                 return status
             
-            print(f"⏳ 處理中... (已等待 {int(time.time() - start_time)} 秒)")
-            time.sleep(check_interval)
+            remaining = poll_scheduler.estimate_remaining(elapsed, model_id, resolution, duration_seconds)
+            print(f"⏳ 處理中... (已等待 {int(elapsed)} 秒，預估還需 {remaining} 秒)")
+            # 未指定 check_interval 時依歷史完成時間調整輪詢間隔
+            time.sleep(check_interval or poll_scheduler.next_interval(elapsed, model_id, resolution, duration_seconds))
         
         raise Exception(f"操作超時，已等待 {max_wait_time} 秒")
 
@@ -324,7 +348,10 @@ def test_image_to_video():
             final_result = client.wait_for_completion(
                 operation_name,
                 test_case["model"],
-                max_wait_time=300
+                max_wait_time=300,
+                # Veo 3 未指定解析度時為 720p；Veo 2 沒有解析度參數
+                resolution="720p" if "veo-3" in test_case["model"] else None,
+                duration_seconds=8
             )
             
             # 顯示結果
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+工作歷史紀錄與延遲分析
+- server.py 每個操作結束（完成或失敗）時附加一行 JSON：送出、第一次輪詢、完成時間、輪詢次數、
+  回應大小、解碼與寫檔時間，以及模型、解析度、長度、長寬比、區域
+- CLI 依這些欄位分組列出百分位數，或依時間區段列出趨勢，用來決定輪詢間隔、等待逾時與容量
+
+使用方式：
+    python job_history.py report --by model,resolution --metric timeToDone --since 7d
+    python job_history.py trend --bucket day --metric timeToDone
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+HISTORY_PATH = os.environ.get(
+    "VEO_JOB_HISTORY",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "veo_job_history.jsonl"),
+)
+
+GROUP_FIELDS = ("model", "resolution", "durationSeconds", "aspectRatio", "region")
+METRICS = ("timeToDone", "timeToFirstPoll", "pollCount", "responseBytes", "decodeSeconds")
+PERCENTILES = (50, 90, 95, 99)
+BUCKETS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+BUCKET_LABELS = {"hour": "小時", "day": "天", "week": "週"}
+
+
+class JobHistory:
+    """附加寫入的 JSON Lines 工作歷史"""
+
+    def __init__(self, path: Optional[str] = HISTORY_PATH):
+        """
+        Args:
+            path: 紀錄檔路徑；空字串或 None 表示不記錄
+        """
+        self.path = path or None
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict[str, Any]):
+        """附加一筆紀錄；由時間欄位推算 timeToDone 與 timeToFirstPoll"""
+        if self.path is None:
+            return
+        entry = dict(entry)
+        submitted = entry.get("submittedAt")
+        if submitted is not None:
+            if entry.get("doneAt") is not None:
+                entry["timeToDone"] = round(entry["doneAt"] - submitted, 3)
+            if entry.get("firstPollAt") is not None:
+                entry["timeToFirstPoll"] = round(entry["firstPollAt"] - submitted, 3)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def entries(self, since: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """讀取紀錄（since 之後送出的）；壞掉的行略過"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or (entry.get("submittedAt") or 0) >= since:
+                    yield entry
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """最近秩法的百分位數"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _stats(values: List[float]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {"count": len(values)}
+    for p in PERCENTILES:
+        row[f"p{p}"] = percentile(values, p)
+    row["max"] = max(values) if values else None
+    return row
+
+
+def summarize(entries: Iterable[Dict[str, Any]], group_by: Sequence[str], metric: str = "timeToDone",
+              state: Optional[str] = "done") -> List[Dict[str, Any]]:
+    """依 group_by 分組的 metric 百分位數（依筆數多到少排序）"""
+    groups: Dict[tuple, List[float]] = {}
+    for entry in entries:
+        if state and entry.get("state") != state:
+            continue
+        value = entry.get(metric)
+        if value is None:
+            continue
+        key = tuple(entry.get(field) for field in group_by)
+        groups.setdefault(key, []).append(value)
+    rows = [{"group": dict(zip(group_by, key)), **_stats(values)} for key, values in groups.items()]
+    rows.sort(key=lambda row: -row["count"])
+    return rows
+
+
+def trend(entries: Iterable[Dict[str, Any]], metric: str = "timeToDone", bucket_seconds: int = 86400,
+          state: Optional[str] = "done") -> List[Dict[str, Any]]:
+    """依送出時間分段的 metric 百分位數（時間由早到晚），另附每段的失敗比例"""
+    buckets: Dict[int, Dict[str, Any]] = {}
+    for entry in entries:
+        submitted = entry.get("submittedAt")
+        if submitted is None:
+            continue
+        bucket = buckets.setdefault(int(submitted // bucket_seconds), {"values": [], "jobs": 0, "failed": 0})
+        bucket["jobs"] += 1
+        if entry.get("state") == "failed":
+            bucket["failed"] += 1
+        if (not state or entry.get("state") == state) and entry.get(metric) is not None:
+            bucket["values"].append(entry[metric])
+    rows = []
+    for index in sorted(buckets):
+        bucket = buckets[index]
+        rows.append({"start": index * bucket_seconds, "jobs": bucket["jobs"],
+                     "failureRate": round(bucket["failed"] / bucket["jobs"], 3), **_stats(bucket["values"])})
+    return rows
+
+
+def parse_since(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """解析 7d、12h、30m 或 ISO 日期，回傳 epoch 秒"""
+    if not value:
+        return None
+    now = time.time() if now is None else now
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    if value[-1] in units and value[:-1].replace(".", "", 1).isdigit():
+        return now - float(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _format(value: Any) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}" if value >= 100 else f"{value:.2f}"
+    return str(value)
+
+
+def _print_table(rows: List[Dict[str, Any]], columns: List[str]):
+    table = [columns] + [[_format(row.get(c)) for c in columns] for row in rows]
+    widths = [max(len(str(line[i])) for line in table) for i in range(len(columns))]
+    for line in table:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(line, widths)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Veo 工作延遲分析")
+    parser.add_argument("--history", default=HISTORY_PATH, help="工作歷史檔案")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("report", "trend"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("--metric", default="timeToDone", choices=METRICS)
+        cmd.add_argument("--since", help="只看這之後送出的工作（例如 7d、12h、2025-01-01）")
+        cmd.add_argument("--state", default="done", help="只統計此狀態（空字串表示全部）")
+        cmd.add_argument("--json", action="store_true", help="輸出 JSON")
+        if name == "report":
+            cmd.add_argument("--by", default="model,resolution,durationSeconds",
+                             help=f"分組欄位（可用: {', '.join(GROUP_FIELDS)}）")
+        else:
+            cmd.add_argument("--bucket", default="day", choices=sorted(BUCKETS))
+    args = parser.parse_args(argv)
+
+    entries = list(JobHistory(args.history).entries(since=parse_since(args.since)))
+    if args.command == "report":
+        group_by = [field for field in args.by.split(",") if field]
+        unknown = set(group_by) - set(GROUP_FIELDS)
+        if unknown:
+            raise SystemExit(f"未知的分組欄位: {', '.join(sorted(unknown))}")
+        rows = summarize(entries, group_by, args.metric, args.state or None)
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+            return
+        print(f"{args.metric}（{len(entries)} 筆工作）")
+        _print_table([{**row["group"], **row} for row in rows],
+                     group_by + ["count"] + [f"p{p}" for p in PERCENTILES] + ["max"])
+    else:
+        rows = trend(entries, args.metric, BUCKETS[args.bucket], args.state or None)
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+            return
+        print(f"{args.metric}，每{BUCKET_LABELS[args.bucket]}（{len(entries)} 筆工作）")
+        for row in rows:
+            row["start"] = datetime.fromtimestamp(row["start"]).strftime("%Y-%m-%d %H:%M")
+        _print_table(rows, ["start", "jobs", "failureRate", "count"] + [f"p{p}" for p in PERCENTILES])
+
+
+# 整個程序共用的實例
+default_history = JobHistory()
+
+
+if __name__ == "__main__":
+    main()
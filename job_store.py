@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+持久化的生成工作表（SQLite，WAL 模式）
+- 每個送出的操作記錄工作 ID、操作名稱、模型、參數、狀態與時間
+- 寫入先放進記憶體佇列，由背景執行緒每隔一小段時間以單一交易批次寫入
+- 重新啟動（uvicorn --reload、kill -9）後，未完成的工作會重新交給輪詢器追蹤
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+DB_PATH = os.environ.get(
+    "VEO_JOB_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "veo_jobs.sqlite3"),
+)
+# 批次寫入的間隔（秒）
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("VEO_JOB_FLUSH_INTERVAL", "0.2"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    operation_name TEXT NOT NULL UNIQUE,
+    model_id TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+RUNNING, DONE, FAILED, EXPIRED = "running", "done", "failed", "expired"
+
+
+class JobStore:
+    """SQLite 工作表；寫入批次化，讀取直接查詢"""
+
+    def __init__(self, path: str = DB_PATH, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        """
+        Args:
+            path: 資料庫檔案路徑（":memory:" 可用於測試）
+            flush_interval: 背景批次寫入的間隔（秒）
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._pending: List[Tuple[str, tuple]] = []
+        self._pending_lock = threading.Lock()
+        # 已知操作的模型，避免每次輪詢都查資料庫
+        self._models: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+
+    # ---- 寫入（只進佇列） ----
+
+    def record_submitted(self, operation_name: str, model_id: str, params: Dict[str, Any],
+                         started_at: Optional[float] = None) -> str:
+        """記錄一個剛送出的操作，回傳工作 ID"""
+        job_id = uuid.uuid4().hex
+        now = started_at or time.time()
+        self._models[operation_name] = model_id
+        self._enqueue(
+            "INSERT OR IGNORE INTO jobs (job_id, operation_name, model_id, params, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, operation_name, model_id, json.dumps(params, ensure_ascii=False), RUNNING, now, now),
+        )
+        return job_id
+
+    def record_state(self, operation_name: str, state: str, error: Optional[str] = None):
+        """更新操作狀態（done / failed / expired）"""
+        now = time.time()
+        self._enqueue(
+            "UPDATE jobs SET state = ?, error = ?, updated_at = ?, finished_at = ? WHERE operation_name = ? AND state = ?",
+            (state, error, now, now, operation_name, RUNNING),
+        )
+
+    # ---- 讀取 ----
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """尚未完成的工作（啟動時用來恢復輪詢）"""
+        self.flush()
+        with self._db_lock:
+            rows = self._db().execute(
+                "SELECT job_id, operation_name, model_id, params, created_at FROM jobs WHERE state = ? ORDER BY created_at",
+                (RUNNING,),
+            ).fetchall()
+        jobs = []
+        for job_id, operation_name, model_id, params, created_at in rows:
+            self._models[operation_name] = model_id
+            jobs.append({"jobId": job_id, "operationName": operation_name, "modelId": model_id,
+                         "params": json.loads(params), "createdAt": created_at})
+        return jobs
+
+    def model_for(self, operation_name: str) -> Optional[str]:
+        """操作所屬的模型；不是本服務送出的操作回傳 None"""
+        model_id = self._models.get(operation_name)
+        if model_id is None:
+            self.flush()
+            with self._db_lock:
+                row = self._db().execute("SELECT model_id FROM jobs WHERE operation_name = ?", (operation_name,)).fetchone()
+            if row:
+                model_id = self._models[operation_name] = row[0]
+        return model_id
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush()
+        with self._db_lock:
+            counts = dict(self._db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {"jobs": counts, "pendingWrites": len(self._pending), "flushes": self.flushes}
+
+    # ---- 批次寫入 ----
+
+    def flush(self):
+        """把佇列中的寫入以單一交易寫入資料庫"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            with self._db_lock:
+                conn = self._db()
+                with conn:
+                    for sql, params in pending:
+                        conn.execute(sql, params)
+        except sqlite3.Error:
+            # 交易已回滾：放回佇列，下一次再寫
+            with self._pending_lock:
+                self._pending[:0] = pending
+            raise
+        self.flushes += 1
+
+    def close(self):
+        """停止背景執行緒並寫入剩餘資料"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._stop.clear()
+
+    def _enqueue(self, sql: str, params: tuple):
+        with self._pending_lock:
+            self._pending.append((sql, params))
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._pending_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._flush_loop, name="veo-job-store", daemon=True)
+                    self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 等一小段時間，讓同一時間附近的寫入合併成一個交易
+            self._stop.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+
+# 整個程序共用的實例
+default_job_store = JobStore()
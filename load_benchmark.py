@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+FastAPI 橋接服務的並行壓測
+- 啟動本機 Vertex AI 替身（fake_vertex.py）與單一 server:app 程序，完全離線、不耗用配額
+- 依序把並行客戶端數拉高（例如 10、50、100、200），每一階段持續固定秒數
+- 客戶端混合三種情境：/api/veo/generate/wait、/api/veo/generate/image-text/wait、
+  /api/veo/generate 之後以 /api/veo/operations 輪詢到完成
+- 每一階段記錄吞吐量、p50/p95/p99 延遲、錯誤數，以及 server 程序的 RSS、開啟的 socket 與執行緒數
+- 結果寫成 JSON；--compare 指定上一版的結果檔時，列出吞吐量與 p95 的差異
+
+使用方式：
+    python load_benchmark.py --steps 10,50,100 --duration 20
+    python load_benchmark.py --compare benchmark_results/load_<舊版>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from fake_vertex import parse_distribution
+from job_history import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "benchmark_results")
+SCENARIOS = ("wait", "image", "poll")
+# 1x1 的 PNG，圖片情境只需要格式正確的小圖
+TINY_PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_stats(pid: int) -> Dict[str, int]:
+    """從 /proc 讀取 RSS、執行緒數與開啟的 socket 數（僅限 Linux）"""
+    stats = {"rssBytes": 0, "threads": 0, "sockets": 0}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    stats["rssBytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    stats["threads"] = int(line.split()[1])
+        fd_dir = f"/proc/{pid}/fd"
+        for fd in os.listdir(fd_dir):
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)).startswith("socket:"):
+                    stats["sockets"] += 1
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return stats
+
+
+def expected_seconds(spec: str) -> float:
+    """替身完成時間分佈的中位數（抽樣估計，固定種子）"""
+    sample = parse_distribution(spec)
+    rng = random.Random(0)
+    return percentile([sample(rng) for _ in range(1001)], 50)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_uvicorn(app: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"服務沒有在 {timeout} 秒內啟動: {url}")
+
+
+class StepRecorder:
+    """一個階段內所有請求的延遲與結果"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in SCENARIOS + ("pollRequest",)}
+        self.errors: Dict[str, int] = {name: 0 for name in SCENARIOS + ("pollRequest",)}
+
+    def record(self, scenario: str, seconds: float, ok: bool):
+        if ok:
+            self.latencies[scenario].append(seconds)
+        else:
+            self.errors[scenario] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        out = {}
+        for name, values in self.latencies.items():
+            if not values and not self.errors[name]:
+                continue
+            out[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "p50": _round(percentile(values, 50)),
+                "p95": _round(percentile(values, 95)),
+                "p99": _round(percentile(values, 99)),
+                "max": _round(max(values) if values else None),
+            }
+        return out
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 4)
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, recorder: StepRecorder, poll_interval: float):
+    prompt = f"load test {uuid.uuid4().hex}"
+    started = time.perf_counter()
+    ok = False
+    try:
+        if scenario == "wait":
+            r = await client.post("/api/veo/generate/wait", json={"prompt": prompt, "cache": "bypass"})
+            ok = r.status_code == 200 and r.json().get("done") is True
+        elif scenario == "image":
+            r = await client.post("/api/veo/generate/image-text/wait", json={
+                "prompt": prompt, "imageBase64": TINY_PNG_BASE64, "imageMimeType": "image/png", "cache": "bypass"})
+            ok = r.status_code == 200 and r.json().get("done") is True
+        else:
+            submitted = (await client.post("/api/veo/generate", json={"prompt": prompt, "cache": "bypass"})).json()
+            name = submitted.get("operationName")
+            while name:
+                poll_started = time.perf_counter()
+                r = await client.get("/api/veo/operations", params={"name": name})
+                body = r.json() if r.status_code == 200 else {}
+                recorder.record("pollRequest", time.perf_counter() - poll_started, bool(body.get("ok")))
+                if not body.get("ok") or body.get("done"):
+                    ok = bool(body.get("ok") and body.get("done"))
+                    break
+                await asyncio.sleep(poll_interval)
+    except (httpx.HTTPError, ValueError):
+        ok = False
+    recorder.record(scenario, time.perf_counter() - started, ok)
+
+
+async def run_step(base_url: str, concurrency: int, duration: float, mix: List[str], poll_interval: float,
+                   server_pid: int) -> Dict[str, Any]:
+    recorder = StepRecorder()
+    samples: List[Dict[str, int]] = []
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=httpx.Timeout(600)) as client:
+        async def worker(i: int):
+            scenario = mix[i % len(mix)]
+            while time.monotonic() < deadline:
+                await run_scenario(client, scenario, recorder, poll_interval)
+
+        async def sampler():
+            while True:
+                samples.append(process_stats(server_pid))
+                await asyncio.sleep(0.5)
+
+        sampling = asyncio.create_task(sampler())
+        started = time.monotonic()
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+        elapsed = time.monotonic() - started
+        sampling.cancel()
+
+    latency = recorder.summary()
+    completed = sum(v["count"] for k, v in latency.items() if k in SCENARIOS)
+    return {
+        "concurrency": concurrency,
+        "durationSeconds": round(elapsed, 2),
+        "completed": completed,
+        "errors": sum(v["errors"] for k, v in latency.items() if k in SCENARIOS),
+        "throughputPerSecond": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latencySeconds": latency,
+        "server": {
+            "rssBytesMax": max((s["rssBytes"] for s in samples), default=0),
+            "threadsMax": max((s["threads"] for s in samples), default=0),
+            "socketsMax": max((s["sockets"] for s in samples), default=0),
+        },
+    }
+
+
+async def benchmark(args) -> Dict[str, Any]:
+    mix = [s for s in args.mix.split(",") if s]
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知的情境: {', '.join(sorted(unknown))}（可用: {', '.join(SCENARIOS)}）")
+    work_dir = tempfile.mkdtemp(prefix="veo-load-")
+    fake_port, server_port = free_port(), free_port()
+    fake_env = dict(os.environ,
+                    VEO_FAKE_COMPLETION_SECONDS=args.completion,
+                    VEO_FAKE_LATENCY_SECONDS=args.upstream_latency,
+                    VEO_FAKE_VIDEO_BYTES=str(args.video_bytes),
+                    VEO_FAKE_429_RATE=str(args.rate_429),
+                    VEO_FAKE_5XX_RATE=str(args.rate_5xx),
+                    VEO_FAKE_SEED="1")
+    server_env = dict(os.environ,
+                      VEO_BASE_URL=f"http://127.0.0.1:{fake_port}/v1",
+                      VEO_GCS_ENDPOINT=f"http://127.0.0.1:{fake_port}",
+                      VEO_STATIC_TOKEN="load-test",
+                      VEO_RESULTS_DIR=os.path.join(work_dir, "results"),
+                      VEO_JOB_DB=os.path.join(work_dir, "jobs.sqlite3"),
+                      VEO_POLL_HISTORY=os.path.join(work_dir, "poll_history.jsonl"),
+                      VEO_JOB_HISTORY=os.path.join(work_dir, "job_history.jsonl"),
+                      VEO_GENERATION_CACHE="0",
+                      VEO_RATE_LIMIT_UNITS_PER_MINUTE="1000000000",
+                      VEO_POLL_MIN_INTERVAL=str(args.server_poll_interval),
+                      # 沒有歷史紀錄時的預期完成時間；對齊替身的分佈，避免第一階段被冷啟動的預設值拖長
+                      VEO_POLL_DEFAULT_EXPECTED=str(expected_seconds(args.completion)))
+    fake = start_uvicorn("fake_vertex:app", fake_port, fake_env, os.path.join(work_dir, "fake.log"))
+    server = start_uvicorn("server:app", server_port, server_env, os.path.join(work_dir, "server.log"))
+    base_url = f"http://127.0.0.1:{server_port}"
+    try:
+        await wait_ready(f"http://127.0.0.1:{fake_port}/fake/stats")
+        await wait_ready(f"{base_url}/api/veo/poller/stats")
+        steps = []
+        for concurrency in args.steps:
+            print(f"▶ 並行 {concurrency} 個客戶端，{args.duration:.0f} 秒...")
+            step = await run_step(base_url, concurrency, args.duration, mix, args.client_poll_interval, server.pid)
+            steps.append(step)
+            p95 = {k: v["p95"] for k, v in step["latencySeconds"].items()}
+            print(f"  吞吐量 {step['throughputPerSecond']}/s，錯誤 {step['errors']}，p95 {p95}，"
+                  f"RSS {step['server']['rssBytesMax'] / 1024 ** 2:.0f} MB，"
+                  f"socket {step['server']['socketsMax']}，執行緒 {step['server']['threadsMax']}")
+    finally:
+        for proc in (server, fake):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return {
+        "version": {"gitCommit": git_commit(), "python": platform.python_version(), "platform": platform.platform()},
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "steps": args.steps, "durationSeconds": args.duration, "mix": mix,
+            "completion": args.completion, "upstreamLatency": args.upstream_latency, "videoBytes": args.video_bytes,
+            "rate429": args.rate_429, "rate5xx": args.rate_5xx,
+            "serverPollInterval": args.server_poll_interval, "clientPollInterval": args.client_poll_interval,
+        },
+        "steps": steps,
+        "logs": work_dir,
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]):
+    """依並行數對照兩次結果的吞吐量與各情境 p95"""
+    before = {s["concurrency"]: s for s in previous.get("steps", [])}
+    print(f"\n與 {previous.get('version', {}).get('gitCommit')} 比較：")
+    for step in current["steps"]:
+        old = before.get(step["concurrency"])
+        if old is None:
+            continue
+        line = [f"  並行 {step['concurrency']}: 吞吐量 {old['throughputPerSecond']} → {step['throughputPerSecond']}/s"]
+        for name, stats in step["latencySeconds"].items():
+            old_p95 = old["latencySeconds"].get(name, {}).get("p95")
+            if old_p95 and stats["p95"]:
+                line.append(f"{name} p95 {old_p95} → {stats['p95']} ({(stats['p95'] / old_p95 - 1) * 100:+.0f}%)")
+        print("，".join(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Veo FastAPI 橋接服務並行壓測（使用本機 Vertex AI 替身）")
+    parser.add_argument("--steps", default="10,50,100,200", help="依序測試的並行客戶端數")
+    parser.add_argument("--duration", type=float, default=30, help="每一階段的秒數")
+    parser.add_argument("--mix", default="wait,image,poll", help="客戶端情境（依序輪流分配）")
+    parser.add_argument("--completion", default="uniform:2:5", help="替身的完成時間分佈（秒）")
+    parser.add_argument("--upstream-latency", default="0.02", help="替身每個請求的延遲分佈（秒）")
+    parser.add_argument("--video-bytes", type=int, default=3 * 1024 * 1024, help="每個影片樣本的大小")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="替身回 429 的比例")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="替身回 503 的比例")
+    parser.add_argument("--server-poll-interval", type=float, default=0.5, help="server 對上游的最短輪詢間隔")
+    parser.add_argument("--client-poll-interval", type=float, default=1.0, help="poll 情境客戶端的輪詢間隔")
+    parser.add_argument("--output", help="結果 JSON 路徑（預設 benchmark_results/load_<commit>_<時間>.json）")
+    parser.add_argument("--compare", help="上一版的結果 JSON，列出差異")
+    args = parser.parse_args()
+    args.steps = [int(x) for x in args.steps.split(",") if x]
+
+    result = asyncio.run(benchmark(args))
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load_{result['version']['gitCommit'] or 'unknown'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 結果已寫入 {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+熱路徑的微基準測試（Base64 解碼存檔、圖片編碼、大型 JSON 回應的解析與重新序列化）
+- 以 480p、720p、1080p 的合成資料量測每個步驟的吞吐量（MB/s，以輸入大小計）與峰值記憶體
+- 結果與 benchmark_baselines.json 的基準比較；吞吐量下降或峰值記憶體增加超過門檻時以非零狀態結束
+- 吞吐量取多次執行的中位數；峰值記憶體另外在 tracemalloc 下執行一次量測（tracemalloc 會拖慢速度）
+
+使用方式：
+    python micro_benchmark.py                      # 全部案例，與基準比較
+    python micro_benchmark.py --cases save_base64_video --sizes 1080p
+    python micro_benchmark.py --update-baselines   # 以這次結果覆寫基準
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi.responses import JSONResponse
+
+from decode_previous_video import Base64VideoDecoder
+from image_cache import EncodedImageCache
+from image_to_video import VeoImageToVideoClient
+from save_video import VeoVideoSaver
+from stream_decode import CHUNK_SIZE, StreamingVideoExtractor, decode_base64_to_file
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINES_PATH = os.path.join(HERE, "benchmark_baselines.json")
+# 預設門檻：吞吐量下降或峰值記憶體增加超過 25% 視為退步
+DEFAULT_THRESHOLD = float(os.environ.get("VEO_BENCH_THRESHOLD", "0.25"))
+
+# 8 秒影片的典型大小與同解析度參考圖片的大小（位元組）
+SIZES: Dict[str, Dict[str, int]] = {
+    "480p": {"video": 5 * 1024 * 1024, "image": 854 * 480 // 2},
+    "720p": {"video": 12 * 1024 * 1024, "image": 1280 * 720 // 2},
+    "1080p": {"video": 22 * 1024 * 1024, "image": 1920 * 1080 // 2},
+}
+
+# 案例：(影片或圖片資料, 工作目錄) -> (要量測的函式, 輸入位元組數)
+Case = Callable[[Dict[str, Any], str], Tuple[Callable[[], Any], int]]
+
+
+def _silent(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """原有的 CLI 類別會印出進度，量測時把輸出丟掉"""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+
+def _operation(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": "projects/p/locations/us-central1/publishers/google/models/veo-3.0-generate-001/operations/bench",
+        "done": True,
+        "response": {
+            "@type": "type.googleapis.com/cloud.ai.large_models.vision.GenerateVideoResponse",
+            "raiMediaFilteredCount": 0,
+            "videos": [{"bytesBase64Encoded": data["videoBase64"], "mimeType": "video/mp4"}],
+        },
+    }
+
+
+def case_save_video_from_response(data: Dict[str, Any], work_dir: str):
+    # 不經過 __init__：建構子會建立寫死的輸出目錄
+    saver = VeoVideoSaver.__new__(VeoVideoSaver)
+    saver.output_dir = work_dir
+    result = _operation(data)
+    return _silent(lambda: saver.save_video_from_response(result, "bench", "bench")), len(data["videoBase64"])
+
+
+def case_save_base64_video(data: Dict[str, Any], work_dir: str):
+    decoder = Base64VideoDecoder.__new__(Base64VideoDecoder)
+    decoder.output_dir = work_dir
+    b64 = data["videoBase64"]
+    return _silent(lambda: decoder.save_base64_video(b64, "bench")), len(b64)
+
+
+def case_decode_base64_to_file(data: Dict[str, Any], work_dir: str):
+    b64 = data["videoBase64"]
+    path = os.path.join(work_dir, "chunked.mp4")
+    return lambda: decode_base64_to_file(b64, path), len(b64)
+
+
+def case_encode_image_to_base64(data: Dict[str, Any], work_dir: str):
+    path = os.path.join(work_dir, "reference.jpg")
+    with open(path, "wb") as f:
+        f.write(data["image"])
+
+    def run():
+        # 每次使用新的快取，量測未命中時的讀檔與編碼
+        client = VeoImageToVideoClient("bench", image_cache=EncodedImageCache())
+        return client.encode_image_to_base64(path)
+    return run, len(data["image"])
+
+
+def case_response_json(data: Dict[str, Any], work_dir: str):
+    # httpx 的 Response.json()：整個回應解碼成字串後 json.loads
+    body = data["responseBody"]
+    return lambda: httpx.Response(200, content=body).json(), len(body)
+
+
+def case_response_json_render(data: Dict[str, Any], work_dir: str):
+    # FastAPI 回傳 dict 時的重新序列化
+    result = _operation(data)
+    return lambda: JSONResponse(result).body, len(data["responseBody"])
+
+
+def case_stream_extract(data: Dict[str, Any], work_dir: str):
+    body = data["responseBody"]
+    path = os.path.join(work_dir, "streamed.mp4")
+
+    def run():
+        extractor = StreamingVideoExtractor(lambda i: open(path, "wb"))
+        for start in range(0, len(body), CHUNK_SIZE):
+            extractor.feed(body[start:start + CHUNK_SIZE])
+        return extractor.close()
+    return run, len(body)
+
+
+CASES: Dict[str, Case] = {
+    "save_video_from_response": case_save_video_from_response,
+    "save_base64_video": case_save_base64_video,
+    "decode_base64_to_file": case_decode_base64_to_file,
+    "encode_image_to_base64": case_encode_image_to_base64,
+    "response_json": case_response_json,
+    "response_json_render": case_response_json_render,
+    "stream_extract": case_stream_extract,
+}
+
+
+def synthetic_data(size: Dict[str, int]) -> Dict[str, Any]:
+    """固定種子的隨機位元組（接近壓縮後影片與 JPEG 的熵）"""
+    rng = random.Random(0)
+    video_b64 = base64.b64encode(rng.randbytes(size["video"])).decode("ascii")
+    data = {"videoBase64": video_b64, "image": rng.randbytes(size["image"])}
+    data["responseBody"] = json.dumps(_operation(data)).encode("utf-8")
+    return data
+
+
+def measure(run: Callable[[], Any], input_bytes: int, repeat: int) -> Dict[str, Any]:
+    run()  # 暖身：載入模組、建立檔案
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    median = statistics.median(timings)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return {
+        "inputBytes": input_bytes,
+        "medianSeconds": round(median, 5),
+        "mbPerSecond": round(input_bytes / (1024 * 1024) / median, 1) if median else None,
+        "peakMemoryBytes": peak,
+        "peakMemoryRatio": round(peak / input_bytes, 2) if input_bytes else None,
+    }
+
+
+def run_benchmarks(cases: List[str], sizes: List[str], repeat: int,
+                   size_table: Optional[Dict[str, Dict[str, int]]] = None) -> Dict[str, Dict[str, Any]]:
+    """回傳 {"案例/解析度": 結果}"""
+    size_table = size_table or SIZES
+    results: Dict[str, Dict[str, Any]] = {}
+    for size in sizes:
+        data = synthetic_data(size_table[size])
+        for name in cases:
+            work_dir = tempfile.mkdtemp(prefix="veo-bench-")
+            try:
+                run, input_bytes = CASES[name](data, work_dir)
+                results[f"{name}/{size}"] = measure(run, input_bytes, repeat)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        del data
+    return results
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baselines: Dict[str, Dict[str, Any]],
+                     threshold: float) -> List[str]:
+    """與基準比較，回傳退步的說明（沒有基準的案例略過）"""
+    regressions = []
+    for key, current in results.items():
+        base = baselines.get(key)
+        if not base:
+            continue
+        if base.get("mbPerSecond") and current["mbPerSecond"] < base["mbPerSecond"] * (1 - threshold):
+            regressions.append(f"{key}: 吞吐量 {base['mbPerSecond']} → {current['mbPerSecond']} MB/s")
+        if base.get("peakMemoryBytes") and current["peakMemoryBytes"] > base["peakMemoryBytes"] * (1 + threshold):
+            regressions.append(f"{key}: 峰值記憶體 {base['peakMemoryBytes'] / 1024 ** 2:.1f} → "
+                               f"{current['peakMemoryBytes'] / 1024 ** 2:.1f} MB")
+    return regressions
+
+
+def load_baselines(path: str = BASELINES_PATH) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Veo 熱路徑微基準測試")
+    parser.add_argument("--cases", default=",".join(CASES), help="要執行的案例")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="解析度")
+    parser.add_argument("--repeat", type=int, default=5, help="每個案例的執行次數（取中位數）")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="退步門檻（比例）")
+    parser.add_argument("--baselines", default=BASELINES_PATH, help="基準檔案")
+    parser.add_argument("--update-baselines", action="store_true", help="以這次結果覆寫基準")
+    parser.add_argument("--output", help="另外把結果寫成 JSON")
+    args = parser.parse_args()
+    cases = [c for c in args.cases.split(",") if c]
+    sizes = [s for s in args.sizes.split(",") if s]
+    unknown = (set(cases) - set(CASES)) | (set(sizes) - set(SIZES))
+    if unknown:
+        raise SystemExit(f"未知的案例或解析度: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(cases, sizes, args.repeat)
+    print(f"{'案例':<36}{'MB/s':>10}{'峰值記憶體 MB':>16}{'峰值/輸入':>10}")
+    for key, r in results.items():
+        print(f"{key:<36}{r['mbPerSecond']:>10}{r['peakMemoryBytes'] / 1024 ** 2:>16.1f}{r['peakMemoryRatio']:>10}")
+
+    environment = {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine()}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment, "results": results}, f, ensure_ascii=False, indent=2)
+
+    stored = load_baselines(args.baselines)
+    if args.update_baselines:
+        merged = {**stored.get("results", {}), **results}
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment, "results": merged}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n📄 基準已更新: {args.baselines}")
+        return
+
+    regressions = find_regressions(results, stored.get("results", {}), args.threshold)
+    if regressions:
+        print(f"\n❌ 超過 {args.threshold:.0%} 門檻的退步：")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\n✅ 沒有超過 {args.threshold:.0%} 門檻的退步")
+
+
+if __name__ == "__main__":
+    main()
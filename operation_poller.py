@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+集中式操作輪詢器
+- 一個背景 task 擁有所有進行中的操作，以最小堆積排定下一次檢查時間
+- 每個操作每個週期只呼叫一次上游 fetchPredictOperation，結果分送給所有等待者與輪詢端點
+- 上游 QPS 只跟操作數量有關，與同時觀看的用戶端數量無關
+- 可搭配 AdaptivePollScheduler，依歷史完成時間決定每個操作的下一次檢查時間
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# fetch(model_id, operation_name) -> {"ok", "done", "response", "status", "error"}
+FetchFn = Callable[[str, str], Awaitable[Dict[str, Any]]]
+
+# 上游回這些狀態碼表示操作不存在或無效，不會再有結果
+TERMINAL_STATUSES = (400, 404)
+
+
+class OperationState:
+    """單一操作的輪詢狀態"""
+
+    __slots__ = (
+        "name", "model_id", "started_at", "poll_count", "next_due", "last_result",
+        "last_polled_at", "last_interest", "waiters", "subscribers", "in_flight",
+        "next_result", "final", "context", "errors",
+    )
+
+    def __init__(self, name: str, model_id: str, started_at: float, context: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.model_id = model_id
+        self.started_at = started_at
+        self.poll_count = 0
+        self.next_due = 0.0
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_polled_at = 0.0
+        self.last_interest = time.monotonic()
+        self.waiters = 0
+        self.subscribers: List[asyncio.Queue] = []
+        self.in_flight = False
+        # 下一次輪詢結果與最終結果（完成或錯誤）
+        self.next_result: Optional[asyncio.Future] = None
+        self.final: Optional[asyncio.Future] = None
+        self.context = context or {}
+        # 連續失敗的輪詢次數（follow 操作的退避用）
+        self.errors = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.final is not None and self.final.done()
+
+
+class OperationPoller:
+    """以堆積排程的操作輪詢多工器"""
+
+    def __init__(
+        self,
+        fetch: FetchFn,
+        interval: float = 3.0,
+        concurrency: int = 64,
+        idle_seconds: float = 30.0,
+        retain_seconds: float = 30.0,
+        scheduler: Any = None,
+        follow_seconds: float = 6 * 3600,
+    ):
+        """
+        Args:
+            fetch: 實際呼叫上游的非同步函式
+            interval: 同一個操作兩次上游查詢的最短間隔（秒）
+            concurrency: 同時進行中的上游查詢上限
+            idle_seconds: 沒有等待者時，最後一次被輪詢端點查詢後還要繼續追蹤多久
+            retain_seconds: 完成後保留最終結果多久，讓晚到的輪詢不必再打上游
+            scheduler: AdaptivePollScheduler；None 時固定每 interval 秒查詢一次
+            follow_seconds: context 帶 follow=True 的操作，即使沒有等待者也追蹤到完成，最多這麼久
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.concurrency = concurrency
+        self.idle_seconds = idle_seconds
+        self.retain_seconds = retain_seconds
+        self.scheduler = scheduler
+        self.follow_seconds = follow_seconds
+        self._ops: Dict[str, OperationState] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # 事件迴圈只保留 task 的弱參照，這裡持有強參照避免執行中被回收
+        self._poll_tasks: set = set()
+        self.upstream_calls = 0
+
+    # ---- 對外介面 ----
+
+    def track(self, name: str, model_id: str, started_at: Optional[float] = None,
+              context: Optional[Dict[str, Any]] = None) -> OperationState:
+        """
+        開始追蹤一個操作（已追蹤則直接回傳既有狀態）。
+        context 可帶 resolution / durationSeconds；submitted=True 表示剛由本服務送出，
+        第一次檢查會依排程器延後，且完成時間會寫入歷史；follow=True 表示沒有等待者也要追蹤到完成。
+        """
+        self._ensure_running()
+        st = self._ops.get(name)
+        if st is None:
+            st = OperationState(name, model_id, started_at or time.time(), context)
+            st.final = self._loop.create_future()
+            self._ops[name] = st
+            delay = self._next_delay(st) if st.context.get("submitted") else 0.0
+            self._schedule(st, time.monotonic() + delay)
+        return st
+
+    async def wait(self, name: str, model_id: str, timeout: float, started_at: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """等到操作完成或出錯；逾時回傳 None"""
+        st = self.track(name, model_id, started_at)
+        st.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(st.final), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            st.waiters -= 1
+            st.last_interest = time.monotonic()
+
+    async def poll(self, name: str, model_id: str) -> Dict[str, Any]:
+        """
+        取得最新狀態：還沒到下一次排定的檢查時間就直接回傳快取，
+        否則與其他呼叫端共用下一次上游查詢。
+        剛送出的操作第一次檢查會延後，在那之前直接回傳「進行中」，不讓請求等到排定時間。
+        """
+        st = self.track(name, model_id)
+        now = time.monotonic()
+        st.last_interest = now
+        if st.last_result is None and now < st.next_due:
+            return self._pending_result(st)
+        if st.last_result is not None and (st.finished or now < st.next_due or now - st.last_polled_at < self.interval):
+            return st.last_result
+        if st.next_result is None:
+            st.next_result = self._loop.create_future()
+        return await asyncio.shield(st.next_result)
+
+    def _pending_result(self, st: OperationState) -> Dict[str, Any]:
+        result = {"ok": True, "done": False, "pollCount": 0, "elapsedSeconds": int(time.time() - st.started_at)}
+        if self.scheduler is not None:
+            result["estimatedSecondsRemaining"] = self.estimate_remaining(st)
+        return result
+
+    def subscribe(self, name: str, model_id: str, started_at: Optional[float] = None) -> asyncio.Queue:
+        """訂閱每一次輪詢結果（用於串流進度）"""
+        st = self.track(name, model_id, started_at)
+        queue: asyncio.Queue = asyncio.Queue()
+        st.subscribers.append(queue)
+        if st.last_result is not None:
+            queue.put_nowait(st.last_result)
+        return queue
+
+    def unsubscribe(self, name: str, queue: asyncio.Queue):
+        st = self._ops.get(name)
+        if st is not None and queue in st.subscribers:
+            st.subscribers.remove(queue)
+            st.last_interest = time.monotonic()
+
+    def get(self, name: str) -> Optional[OperationState]:
+        return self._ops.get(name)
+
+    def estimate_remaining(self, st: OperationState) -> Optional[int]:
+        """依排程器預估剩餘秒數；沒有排程器時回傳 None"""
+        if self.scheduler is None:
+            return None
+        return self.scheduler.estimate_remaining(
+            time.time() - st.started_at, st.model_id, st.context.get("resolution"), st.context.get("durationSeconds")
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "trackedOperations": len(self._ops),
+            "waitingClients": sum(st.waiters + len(st.subscribers) for st in self._ops.values()),
+            "scheduled": len(self._heap),
+            "upstreamCalls": self.upstream_calls,
+        }
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ---- 內部排程 ----
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        if self._loop is not loop:
+            # 換了事件迴圈（例如測試時重建 app），舊狀態的 future 已無法使用
+            self._ops.clear()
+            self._heap.clear()
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = loop.create_task(self._run())
+
+    def _schedule(self, st: OperationState, due: float):
+        st.next_due = due
+        heapq.heappush(self._heap, (due, next(self._seq), st.name))
+        if self._heap[0][2] == st.name:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, name = heapq.heappop(self._heap)
+                st = self._ops.get(name)
+                # 堆積採延遲刪除：狀態已移除或已重新排程的舊項目直接略過
+                if st is None or st.next_due != due or st.in_flight:
+                    continue
+                if st.finished:
+                    del self._ops[name]
+                    continue
+                if not self._interested(st, now):
+                    self._drop(st)
+                    continue
+                await self._slots.acquire()
+                st.in_flight = True
+                task = self._loop.create_task(self._poll_one(st))
+                self._poll_tasks.add(task)
+                task.add_done_callback(self._poll_tasks.discard)
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _interested(self, st: OperationState, now: float) -> bool:
+        if st.context.get("follow") and time.time() - st.started_at < self.follow_seconds:
+            return True
+        return st.waiters > 0 or bool(st.subscribers) or now - st.last_interest < self.idle_seconds
+
+    async def _poll_one(self, st: OperationState):
+        try:
+            self.upstream_calls += 1
+            try:
+                result = await self.fetch(st.model_id, st.name)
+            except Exception as e:
+                result = {"ok": False, "status": 502, "error": f"上游請求失敗: {e}"}
+            st.poll_count += 1
+            result = dict(result, pollCount=st.poll_count, elapsedSeconds=int(time.time() - st.started_at))
+            if result.get("ok") and not result.get("done") and self.scheduler is not None:
+                result["estimatedSecondsRemaining"] = self.estimate_remaining(st)
+            st.last_result = result
+            st.last_polled_at = time.monotonic()
+        finally:
+            st.in_flight = False
+            self._slots.release()
+
+        if st.next_result is not None:
+            if not st.next_result.done():
+                st.next_result.set_result(result)
+            st.next_result = None
+        for queue in st.subscribers:
+            queue.put_nowait(result)
+
+        if result.get("ok"):
+            st.errors = 0
+        if result.get("done"):
+            if not st.final.done():
+                st.final.set_result(result)
+            # 保留最終結果一段時間，之後由排程迴圈移除
+            self._schedule(st, time.monotonic() + self.retain_seconds)
+            if self.scheduler is not None and st.context.get("submitted"):
+                # 寫歷史檔是阻塞的檔案 I/O，不在事件迴圈上執行
+                await asyncio.to_thread(
+                    self.scheduler.record_completion,
+                    st.model_id, st.context.get("resolution"), st.context.get("durationSeconds"),
+                    time.time() - st.started_at,
+                )
+        elif not result.get("ok"):
+            st.errors += 1
+            if self._keep_following(st, result):
+                # 暫時性錯誤（熔斷、429/5xx 重試用盡）：生成仍在上游進行，退避後繼續追蹤，
+                # 等待者繼續等到完成或逾時，而不是把已付費的工作丟掉
+                self._schedule(st, time.monotonic() + self._next_delay(st) * 2 ** min(st.errors - 1, 4))
+                return
+            if not st.final.done():
+                st.final.set_result(result)
+            # 錯誤不快取，下一個呼叫端會重新向上游查詢
+            self._ops.pop(st.name, None)
+        else:
+            self._schedule(st, time.monotonic() + self._next_delay(st))
+
+    def _keep_following(self, st: OperationState, result: Dict[str, Any]) -> bool:
+        """follow 操作在追蹤期限內遇到非終止性錯誤時繼續追蹤；400/404 表示操作無效，不再查詢"""
+        if not st.context.get("follow") or time.time() - st.started_at >= self.follow_seconds:
+            return False
+        return result.get("status") not in TERMINAL_STATUSES
+
+    def _next_delay(self, st: OperationState) -> float:
+        if self.scheduler is None:
+            return self.interval
+        return self.scheduler.next_interval(
+            time.time() - st.started_at, st.model_id, st.context.get("resolution"), st.context.get("durationSeconds")
+        )
+
+    def _drop(self, st: OperationState):
+        self._ops.pop(st.name, None)
+        if not st.final.done():
+            st.final.cancel()
+        if st.next_result is not None and not st.next_result.done():
+            st.next_result.cancel()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+依歷史完成時間調整輪詢間隔的共用排程器
+- 依 (模型, 解析度, 影片長度) 記錄每次生成實際花費的秒數
+- 預期完成前稀疏輪詢，接近預期完成時間時密集輪詢，超過後再逐步放寬
+- 同時提供剩餘時間預估（estimatedSecondsRemaining）
+server.py 與各個 CLI 工具共用同一份歷史檔：每次完成只附加一行 JSON（不覆寫整個檔案），
+各程序定期讀入其他程序新附加的行，所以彼此記錄的樣本都會保留
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+HISTORY_PATH = os.environ.get(
+    "VEO_POLL_HISTORY",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "veo_poll_history.jsonl"),
+)
+MIN_INTERVAL_SECONDS = float(os.environ.get("VEO_POLL_MIN_INTERVAL", "3"))
+MAX_INTERVAL_SECONDS = float(os.environ.get("VEO_POLL_MAX_INTERVAL", "30"))
+# 沒有任何歷史時假設的完成時間
+DEFAULT_EXPECTED_SECONDS = float(os.environ.get("VEO_POLL_DEFAULT_EXPECTED", "60"))
+# 每個組合保留的最近樣本數（記憶體中；檔案只附加）
+HISTORY_SIZE = 50
+# 最多每隔這麼久檢查一次其他程序附加的樣本
+REFRESH_SECONDS = 5.0
+
+
+def _quantile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class AdaptivePollScheduler:
+    """依完成時間分佈決定下一次輪詢間隔"""
+
+    def __init__(
+        self,
+        path: Optional[str] = HISTORY_PATH,
+        min_interval: float = MIN_INTERVAL_SECONDS,
+        max_interval: float = MAX_INTERVAL_SECONDS,
+        default_expected: float = DEFAULT_EXPECTED_SECONDS,
+        refresh_seconds: float = REFRESH_SECONDS,
+    ):
+        """
+        Args:
+            path: 歷史檔路徑（JSON Lines）；None 表示只保存在記憶體
+            min_interval: 最短輪詢間隔（秒）
+            max_interval: 最長輪詢間隔（秒）
+            default_expected: 沒有歷史時假設的完成秒數
+            refresh_seconds: 讀入其他程序新樣本的最短間隔（秒）
+        """
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_expected = default_expected
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._history: Dict[str, List[float]] = {}
+        # 已讀到的檔案位置與上次檢查時間
+        self._offset = 0
+        self._checked_at: Optional[float] = None
+
+    @staticmethod
+    def key(model_id: str, resolution: Optional[str] = None, duration: Optional[int] = None) -> str:
+        return f"{model_id}|{resolution or '*'}|{duration or '*'}"
+
+    def record_completion(self, model_id: str, resolution: Optional[str], duration: Optional[int], seconds: float):
+        """記錄一次完成所花的秒數並附加到歷史檔"""
+        key = self.key(model_id, resolution, duration)
+        seconds = round(float(seconds), 1)
+        with self._lock:
+            if self._append({"key": key, "seconds": seconds}):
+                # 連同其他程序新附加的樣本一起讀回，自己的這一行也在其中
+                self._refresh(force=True)
+            else:
+                self._add(key, seconds)
+
+    def samples(self, model_id: str, resolution: Optional[str] = None, duration: Optional[int] = None) -> List[float]:
+        """取得最接近的歷史樣本：完全相同的組合優先，其次同模型的所有樣本"""
+        with self._lock:
+            self._refresh()
+            history = self._history
+            exact = history.get(self.key(model_id, resolution, duration))
+            if exact:
+                return list(exact)
+            prefix = f"{model_id}|"
+            return [v for k, values in history.items() if k.startswith(prefix) for v in values]
+
+    def expected_range(self, model_id: str, resolution: Optional[str] = None, duration: Optional[int] = None):
+        """回傳 (最早可能完成, 中位數, 晚完成) 秒數"""
+        values = self.samples(model_id, resolution, duration)
+        if len(values) >= 3:
+            return _quantile(values, 0.1), _quantile(values, 0.5), _quantile(values, 0.9)
+        expected = sum(values) / len(values) if values else self.default_expected
+        return expected * 0.8, expected, expected * 1.5
+
+    def next_interval(self, elapsed: float, model_id: str, resolution: Optional[str] = None,
+                      duration: Optional[int] = None) -> float:
+        """下一次輪詢前要等待的秒數"""
+        early, _, late = self.expected_range(model_id, resolution, duration)
+        if elapsed < early:
+            # 每次只走剩餘距離的一半，越接近最早完成時間間隔越短
+            interval = (early - elapsed) / 2
+        elif elapsed <= late:
+            interval = self.min_interval
+        else:
+            # 比平常慢的工作逐步放寬輪詢
+            interval = self.min_interval * (1 + (elapsed - late) / max(late, 1))
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def estimate_remaining(self, elapsed: float, model_id: str, resolution: Optional[str] = None,
+                           duration: Optional[int] = None) -> int:
+        """預估還要幾秒完成"""
+        _, median, late = self.expected_range(model_id, resolution, duration)
+        if elapsed < median:
+            return int(round(median - elapsed))
+        if elapsed < late:
+            return int(round(late - elapsed))
+        return 0
+
+    def _add(self, key: str, seconds: float):
+        samples = self._history.setdefault(key, [])
+        samples.append(seconds)
+        del samples[:-HISTORY_SIZE]
+
+    def _refresh(self, force: bool = False):
+        """讀入檔案中上次之後新附加的行（距上次檢查未滿 refresh_seconds 時略過）"""
+        if not self.path:
+            return
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        try:
+            if os.path.getsize(self.path) < self._offset:
+                # 檔案被截斷或替換：從頭讀起
+                self._history, self._offset = {}, 0
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        # 只處理完整的行；另一個程序寫到一半的行留到下次
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and "key" in entry:
+                self._add(entry["key"], entry["seconds"])
+
+    def _append(self, entry: Dict[str, object]) -> bool:
+        """附加一行；沒有檔案或寫入失敗時回傳 False"""
+        if not self.path:
+            return False
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            # O_APPEND 單次寫入：多個程序同時附加也不會互相覆蓋
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            return False
+        return True
+
+
+# 整個程序共用的實例
+default_scheduler = AdaptivePollScheduler()
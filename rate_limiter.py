@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+predictLongRunning 送出前的配額感知限流器
+- 每個（上游目標, 模型）一個權杖桶，權杖以「720p 影片秒數」為單位補充
+- 每個工作的成本 = durationSeconds × 解析度係數 × sampleCount
+- 容量不足時依序排隊等待，不直接回傳 429
+- 上游仍回 429 時清空權杖桶，讓後續送出自動放慢到配額上限
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+# 每分鐘補充的成本單位（1 單位 = 1 秒 720p 影片），可依模型覆寫：
+# VEO_RATE_LIMITS='{"veo-3.0-generate-001": 60}'
+UNITS_PER_MINUTE = float(os.environ.get("VEO_RATE_LIMIT_UNITS_PER_MINUTE", "120"))
+MODEL_UNITS_PER_MINUTE: Dict[str, float] = json.loads(os.environ.get("VEO_RATE_LIMITS", "{}"))
+# 權杖桶容量：允許的瞬間突發量
+BURST_UNITS = float(os.environ.get("VEO_RATE_LIMIT_BURST", str(UNITS_PER_MINUTE)))
+
+# 依像素數相對 720p 的比例
+RESOLUTION_FACTORS = {"480p": 0.5, "720p": 1.0, "1080p": 2.25}
+
+
+def job_cost(parameters: Dict[str, Any]) -> float:
+    """一個 predictLongRunning 請求的成本單位"""
+    duration = parameters.get("durationSeconds") or 8
+    factor = RESOLUTION_FACTORS.get(parameters.get("resolution") or "720p", 1.0)
+    samples = parameters.get("sampleCount") or 1
+    return float(duration) * factor * samples
+
+
+class CostBucket:
+    """以成本計價的非同步權杖桶；等待者依到達順序取得權杖"""
+
+    def __init__(self, units_per_minute: float, burst: float):
+        self.rate = units_per_minute / 60.0
+        self.capacity = max(burst, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.waiting = 0
+        self.granted = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, cost: float) -> float:
+        """等到有足夠權杖後扣除，回傳等待秒數"""
+        # 超過容量的工作最多只需等到桶滿，否則永遠無法送出
+        cost = min(cost, self.capacity)
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            # 換了事件迴圈（例如測試時重建 app）就重建鎖
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self.tokens >= cost:
+                        self.tokens -= cost
+                        break
+                    await asyncio.sleep((cost - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.granted += 1
+        self.waited_seconds += waited
+        return waited
+
+    def has_capacity(self, cost: float) -> bool:
+        """現在送出是否不必等待"""
+        self._refill()
+        return self.waiting == 0 and self.tokens >= min(cost, self.capacity)
+
+    def drain(self):
+        """上游回 429：清空權杖，之後的送出要重新累積"""
+        self._refill()
+        self.tokens = 0.0
+        self.throttled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "unitsPerMinute": self.rate * 60,
+            "capacity": self.capacity,
+            "tokens": round(self.tokens, 1),
+            "waiting": self.waiting,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "waitedSeconds": round(self.waited_seconds, 1),
+        }
+
+
+class RateLimiter:
+    """各模型（以及各上游目標）獨立的權杖桶；配額以專案與區域為單位，所以 scope 通常是目標"""
+
+    def __init__(
+        self,
+        units_per_minute: float = UNITS_PER_MINUTE,
+        burst: float = BURST_UNITS,
+        per_model: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Args:
+            units_per_minute: 預設每分鐘補充的成本單位
+            burst: 權杖桶容量
+            per_model: 個別模型的每分鐘成本單位
+        """
+        self.units_per_minute = units_per_minute
+        self.burst = burst
+        self.per_model = MODEL_UNITS_PER_MINUTE if per_model is None else per_model
+        self._buckets: Dict[str, CostBucket] = {}
+
+    def bucket(self, model_id: str, scope: Optional[str] = None) -> CostBucket:
+        key = f"{scope}|{model_id}" if scope else model_id
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate = float(self.per_model.get(model_id, self.units_per_minute))
+            # 突發量不超過一分鐘的配額
+            bucket = self._buckets[key] = CostBucket(rate, min(self.burst, rate))
+        return bucket
+
+    async def acquire(self, model_id: str, parameters: Dict[str, Any], scope: Optional[str] = None) -> float:
+        """依工作成本等待該模型的權杖，回傳等待秒數"""
+        return await self.bucket(model_id, scope).acquire(job_cost(parameters))
+
+    def has_capacity(self, model_id: str, parameters: Dict[str, Any], scope: Optional[str] = None) -> bool:
+        return self.bucket(model_id, scope).has_capacity(job_cost(parameters))
+
+    def throttled(self, model_id: str, scope: Optional[str] = None):
+        self.bucket(model_id, scope).drain()
+
+    def stats(self) -> Dict[str, Any]:
+        return {model_id: bucket.stats() for model_id, bucket in self._buckets.items()}
+
+
+# 整個程序共用的實例
+default_limiter = RateLimiter()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+完成操作的影片結果儲存
+- 每個樣本的 bytesBase64Encoded 只解碼一次，分段寫成 MP4 檔案
+- 可搭配 StreamingVideoExtractor 直接從上游串流寫入，不需先把整個回應讀進記憶體
+- 回傳去掉 Base64 的精簡 response，供 API 以網址方式提供影片
+- ETag 使用影片內容的 SHA-256，重新整理頁面時可以直接用快取
+- 只有 gcsUri 的樣本（設定 storageUri 時）在 commit 時以平行分段下載寫入同一個目錄
+- server.py 與 CLI 工具共用同一個目錄當作本機結果封存：查過的舊操作直接讀磁碟，
+  總大小超過上限時依最近使用時間（result.json 的 mtime）淘汰最舊的結果
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from gcs_download import GCSDownloader, default_downloader
+from stream_decode import StreamingVideoExtractor, decode_base64_to_file
+
+RESULTS_DIR = os.environ.get(
+    "VEO_RESULTS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "veo_results"),
+)
+# 封存總大小上限（位元組），超過時淘汰最久未使用的結果
+MAX_BYTES = int(os.environ.get("VEO_RESULTS_MAX_BYTES", str(10 * 1024 ** 3)))
+
+
+class ResultStore:
+    """以操作名稱為鍵的影片結果目錄"""
+
+    def __init__(self, root: str = RESULTS_DIR, max_bytes: int = MAX_BYTES,
+                 downloader: Optional[GCSDownloader] = None):
+        """
+        Args:
+            root: 封存目錄
+            max_bytes: 總大小上限；0 表示不限制
+            downloader: 下載 gcsUri 樣本；None 使用共用的 default_downloader
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.downloader = downloader or default_downloader
+        self._evict_lock = threading.Lock()
+
+    def _op_dir(self, operation_name: str) -> str:
+        # 操作名稱含有斜線，改用雜湊當目錄名稱
+        digest = hashlib.sha256(operation_name.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.root, digest)
+
+    def _meta_path(self, operation_name: str) -> str:
+        return os.path.join(self._op_dir(operation_name), "result.json")
+
+    def sample_path(self, operation_name: str, sample_index: int) -> str:
+        return os.path.join(self._op_dir(operation_name), f"sample_{sample_index}.mp4")
+
+    def load(self, operation_name: str) -> Optional[Dict[str, Any]]:
+        """讀取已儲存的精簡 response 並更新最近使用時間；沒有則回傳 None"""
+        meta_path = self._meta_path(operation_name)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                response = json.load(f)["response"]
+        except (OSError, ValueError, KeyError):
+            return None
+        _touch(meta_path)
+        return response
+
+    def latest(self) -> Optional[str]:
+        """最近儲存或讀取過的操作名稱；封存是空的則回傳 None"""
+        entries = self._entries()
+        if not entries:
+            return None
+        _, _, op_dir = max(entries)
+        try:
+            with open(os.path.join(op_dir, "result.json"), "r", encoding="utf-8") as f:
+                return json.load(f)["operationName"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """淘汰最久未使用的結果直到總大小低於上限，回傳移除的數量"""
+        if not self.max_bytes:
+            return 0
+        keep_dir = self._op_dir(keep) if keep else None
+        removed = 0
+        with self._evict_lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, op_dir in entries:
+                if total <= self.max_bytes:
+                    break
+                if op_dir == keep_dir:
+                    continue
+                shutil.rmtree(op_dir, ignore_errors=True)
+                total -= size
+                removed += 1
+        return removed
+
+    def _entries(self) -> List[tuple]:
+        """(最近使用時間, 大小, 目錄) 列表；暫存目錄與不完整的結果不列入"""
+        entries = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return entries
+        for name in names:
+            if name.startswith("."):
+                continue
+            op_dir = os.path.join(self.root, name)
+            try:
+                used_at = os.stat(os.path.join(op_dir, "result.json")).st_mtime
+                size = sum(entry.stat().st_size for entry in os.scandir(op_dir) if entry.is_file())
+            except OSError:
+                continue
+            entries.append((used_at, size, op_dir))
+        return entries
+
+    def store(self, operation_name: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        解碼 response 中每個影片樣本並寫入磁碟，回傳精簡後的 response。
+        同一操作重複呼叫時直接回傳第一次的結果；檔案以原子方式寫入，可同時處理多個操作。
+        """
+        existing = self.load(operation_name)
+        if existing is not None:
+            return existing
+
+        incoming = self.begin()
+        try:
+            # 與串流解析相同：每個 Base64 字串（包含空字串）依出現順序取得下一個序號
+            for video in response.get("videos", []):
+                b64 = video.get("bytesBase64Encoded")
+                if isinstance(b64, str):
+                    i = len(incoming.samples)
+                    decoder = decode_base64_to_file(b64, incoming.sample_path(i))
+                    incoming.samples.append({"sampleIndex": i, "bytes": decoder.size, "etag": decoder.etag})
+            return incoming.commit(operation_name, response)
+        except Exception:
+            incoming.discard()
+            raise
+
+    def begin(self) -> "IncomingResult":
+        """開始接收一個串流回應；樣本先寫入暫存目錄，commit 時才搬到正式位置"""
+        return IncomingResult(self)
+
+    def _finalize(self, operation_name: str, response: Dict[str, Any], incoming_dir: str,
+                  samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+        existing = self.load(operation_name)
+        if existing is not None:
+            return existing
+
+        op_dir = self._op_dir(operation_name)
+        os.makedirs(op_dir, exist_ok=True)
+        slim = {k: v for k, v in response.items() if k != "videos"}
+        # 第 k 個 Base64 字串對應第 k 個解碼樣本；gcsUri 樣本的序號接在後面，兩者不會重複
+        decoded = iter([s for s in samples if "gcsUri" not in s])
+        downloaded = {s["gcsUri"]: s for s in samples if "gcsUri" in s}
+        videos = []
+        for video in response.get("videos", []):
+            if isinstance(video.get("bytesBase64Encoded"), str):
+                sample = next(decoded, None)
+            elif video.get("gcsUri") in downloaded:
+                sample = downloaded[video["gcsUri"]]
+            else:
+                videos.append(video)
+                continue
+            if sample is None or not sample["bytes"]:
+                # 空的影片內容：不建立樣本檔，只保留其他欄位
+                videos.append({k: v for k, v in video.items() if k != "bytesBase64Encoded"})
+                continue
+            i = sample["sampleIndex"]
+            os.replace(os.path.join(incoming_dir, f"sample_{i}.mp4"), self.sample_path(operation_name, i))
+            entry = {k: v for k, v in video.items() if k != "bytesBase64Encoded"}
+            entry.update({
+                "sampleIndex": i,
+                "mimeType": video.get("mimeType", "video/mp4"),
+                "bytes": sample["bytes"],
+                "etag": sample["etag"],
+            })
+            videos.append(entry)
+        if "videos" in response:
+            slim["videos"] = videos
+
+        meta = json.dumps({"operationName": operation_name, "response": slim}, ensure_ascii=False)
+        _atomic_write(self._meta_path(operation_name), meta.encode("utf-8"))
+        self.evict(keep=operation_name)
+        return slim
+
+    def get_sample(self, operation_name: str, sample_index: int) -> Optional[Dict[str, Any]]:
+        """取得單一樣本的檔案路徑與中繼資料"""
+        response = self.load(operation_name)
+        if response is None:
+            return None
+        for video in response.get("videos", []):
+            if video.get("sampleIndex") == sample_index:
+                path = self.sample_path(operation_name, sample_index)
+                if os.path.exists(path):
+                    return dict(video, path=path)
+        return None
+
+
+class IncomingResult:
+    """串流寫入中的結果；feed 完上游回應後呼叫 commit 或 discard"""
+
+    def __init__(self, store: ResultStore):
+        self.store = store
+        # 暫存目錄在第一個樣本出現時才建立，未完成的輪詢不會碰到磁碟
+        self.incoming_dir: Optional[str] = None
+        self.extractor = StreamingVideoExtractor(lambda i: open(self.sample_path(i), "wb"))
+
+    @property
+    def samples(self) -> List[Dict[str, Any]]:
+        return self.extractor.samples
+
+    def sample_path(self, sample_index: int) -> str:
+        if self.incoming_dir is None:
+            os.makedirs(self.store.root, exist_ok=True)
+            self.incoming_dir = tempfile.mkdtemp(prefix=".incoming-", dir=self.store.root)
+        return os.path.join(self.incoming_dir, f"sample_{sample_index}.mp4")
+
+    def commit(self, operation_name: str, response: Dict[str, Any]) -> Dict[str, Any]:
+        """下載只有 gcsUri 的樣本，再把所有樣本搬到正式位置並寫入精簡 response"""
+        try:
+            if self.store.load(operation_name) is None:
+                self.download(response)
+            return self.store._finalize(operation_name, response, self.incoming_dir, self.samples)
+        finally:
+            self.discard()
+
+    def download(self, response: Dict[str, Any]):
+        """把 response 中只有 gcsUri 的影片下載到暫存目錄，序號接在 Base64 樣本之後"""
+        for video in response.get("videos", []):
+            uri = video.get("gcsUri")
+            if not uri or isinstance(video.get("bytesBase64Encoded"), str):
+                continue
+            i = len(self.samples)
+            fetched = self.store.downloader.download(uri, self.sample_path(i))
+            self.samples.append({"sampleIndex": i, "gcsUri": uri, **fetched})
+
+    def discard(self):
+        self.extractor.abort()
+        if self.incoming_dir is not None:
+            shutil.rmtree(self.incoming_dir, ignore_errors=True)
+
+
+def _touch(path: str):
+    try:
+        os.utime(path, (time.time(), time.time()))
+    except OSError:
+        pass
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# 整個程序共用的實例
+default_store = ResultStore()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+上游呼叫共用的重試策略與熔斷器
+- 只重試安全的情況：429、冪等請求（輪詢）的 5xx 與網路錯誤、送出請求的 503 與連線失敗
+- 退避使用 decorrelated jitter，上游有 Retry-After 時至少等待該秒數
+- 每個區域端點（主機）一個熔斷器：連續失敗時直接快速失敗，冷卻後再放行試探請求
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+import httpx
+
+MAX_ATTEMPTS = int(os.environ.get("VEO_RETRY_MAX_ATTEMPTS", "4"))
+BASE_DELAY_SECONDS = float(os.environ.get("VEO_RETRY_BASE_DELAY", "0.5"))
+MAX_DELAY_SECONDS = float(os.environ.get("VEO_RETRY_MAX_DELAY", "20"))
+# 連續失敗幾次後熔斷，以及熔斷後多久放行試探請求
+BREAKER_FAILURES = int(os.environ.get("VEO_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("VEO_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    """熔斷中：上游目前不健康，請求沒有送出"""
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """解析 Retry-After（秒數或 HTTP 日期）"""
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """決定哪些失敗要重試，以及每次重試前等待多久"""
+
+    def __init__(
+        self,
+        max_attempts: int = MAX_ATTEMPTS,
+        base_delay: float = BASE_DELAY_SECONDS,
+        max_delay: float = MAX_DELAY_SECONDS,
+    ):
+        """
+        Args:
+            max_attempts: 含第一次在內的最多嘗試次數
+            base_delay: 最短退避秒數
+            max_delay: 最長退避秒數
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def should_retry_status(status: int, idempotent: bool) -> bool:
+        if status == 429:
+            return True
+        if idempotent:
+            return status >= 500
+        # 送出請求只在上游明確表示沒有處理時重試，避免重複生成
+        return status == 503
+
+    @staticmethod
+    def should_retry_error(error: Exception, idempotent: bool) -> bool:
+        if idempotent:
+            return isinstance(error, httpx.TransportError)
+        # 連線沒建立成功代表請求沒有送出
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+    def delays(self) -> Iterator[float]:
+        """decorrelated jitter：每次在 [base, 上次 × 3] 之間隨機取值"""
+        delay = self.base_delay
+        for _ in range(self.max_attempts - 1):
+            delay = min(self.max_delay, random.uniform(self.base_delay, delay * 3))
+            yield delay
+
+    def wait_time(self, delay: float, headers: Optional[Mapping[str, str]] = None) -> float:
+        """合併退避與 Retry-After，不超過最長退避"""
+        retry_after = retry_after_seconds(headers)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return min(delay, self.max_delay)
+
+
+class CircuitBreaker:
+    """單一區域端點的熔斷器（同步與非同步呼叫共用，以鎖保護）"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.rejected = 0
+        # 半開時只放行一個試探請求；試探被取消而沒回報結果時，冷卻時間過後再放行下一個
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half-open"
+
+    def check(self):
+        """熔斷中就拋出 CircuitOpenError；冷卻後只放行一個試探請求，其餘在結果出來前同樣拒絕"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            now = time.monotonic()
+            if state == "half-open":
+                if not self._probe_in_flight or now - self._probe_started_at >= self.reset_seconds:
+                    self._probe_in_flight = True
+                    self._probe_started_at = now
+                    return
+                self.rejected += 1
+                raise CircuitOpenError("上游暫時不可用，正在試探是否恢復")
+            self.rejected += 1
+            remaining = self.reset_seconds - (now - self.opened_at)
+            raise CircuitOpenError(f"上游暫時不可用，約 {int(remaining) + 1} 秒後重試")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            # 試探請求失敗或連續失敗達門檻：重新開始冷卻
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutiveFailures": self.failures, "rejected": self.rejected}
+
+
+class BreakerRegistry:
+    """以主機（區域端點）為鍵的熔斷器集合"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(host, CircuitBreaker(self.failure_threshold, self.reset_seconds))
+        return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        return {host: breaker.stats() for host, breaker in self._breakers.items()}
+
+
+# 整個程序共用的實例
+default_policy = RetryPolicy()
+default_breakers = BreakerRegistry()
@@ -8,8 +8,15 @@ import os
 import subprocess
 import json
 import time
-import requests
+import shutil
 from datetime import datetime
+from typing import Optional
+
+import upstream
+from generation_cache import default_cache as generation_cache
+from poll_scheduler import default_scheduler as poll_scheduler
+from result_store import default_store as result_store
+from token_provider import STATIC_TOKEN
 
 
 class VeoVideoSaver:
@@ -26,6 +33,8 @@ class VeoVideoSaver:
     
     def get_access_token(self) -> str:
         """獲取存取權杖"""
+        if STATIC_TOKEN:
+            return STATIC_TOKEN
         result = subprocess.run(
             ["gcloud", "auth", "print-access-token"],
             capture_output=True,
@@ -48,12 +57,7 @@ class VeoVideoSaver:
         print(f"🤖 模型: {model_id}")
         
         # API 端點
-        url = f"https://{self.location}-aiplatform.googleapis.com/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/{model_id}:predictLongRunning"
-        
-        headers = {
-            "Authorization": f"Bearer {self.get_access_token()}",
-            "Content-Type": "application/json"
-        }
+        url = f"{upstream.vertex_base_url(self.location)}/projects/{self.project_id}/locations/{self.location}/publishers/google/models/{model_id}:predictLongRunning"
         
         payload = {
             "instances": [{"prompt": prompt}],
@@ -66,8 +70,23 @@ class VeoVideoSaver:
             }
         }
         
+        # 相同的提示詞與參數已生成過（需設定 VEO_GENERATION_CACHE=1）：直接使用封存的結果
+        cache_key = generation_cache.key(model_id, payload)
+        cached_op = generation_cache.get(cache_key)
+        if cached_op:
+            archived = result_store.load(cached_op)
+            if archived is not None:
+                print("⚡ 生成快取命中，直接使用之前的結果")
+                return self.save_video_from_response({"name": cached_op, "done": True, "response": archived}, filename_prefix, prompt)
+            generation_cache.forget(cache_key)
+        
+        headers = {
+            "Authorization": f"Bearer {self.get_access_token()}",
+            "Content-Type": "application/json"
+        }
+        
         # 發送請求
-        response = requests.post(url, headers=headers, json=payload)
+        response = upstream.post(url, headers=headers, json=payload, retry=False)
         
         if response.status_code != 200:
             raise Exception(f"API 請求失敗: {response.status_code} - {response.text}")
@@ -78,15 +97,27 @@ class VeoVideoSaver:
         print(f"✅ 請求已提交，等待生成完成...")
         
         # 等待完成
-        final_result = self.wait_for_completion(operation_name, model_id)
+        final_result = self.wait_for_completion(operation_name, model_id, resolution="720p", duration=duration)
+        videos = final_result.get("response", {}).get("videos", [])
+        if videos:
+            generation_cache.put(cache_key, operation_name, sum(v.get("bytes", 0) for v in videos))
         
         # 儲存影片
         return self.save_video_from_response(final_result, filename_prefix, prompt)
     
-    def wait_for_completion(self, operation_name: str, model_id: str, max_wait: int = 300) -> dict:
-        """等待操作完成"""
+    def wait_for_completion(self, operation_name: str, model_id: str, max_wait: int = 300,
+                            resolution: Optional[str] = None, duration: Optional[int] = None) -> dict:
+        """
+        等待操作完成（輪詢間隔依同樣模型/解析度/長度的歷史完成時間調整）。
+        完成的結果會解碼一次存入本機封存，已封存的操作直接讀磁碟。
+        """
         
-        poll_url = f"https://{self.location}-aiplatform.googleapis.com/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/{model_id}:fetchPredictOperation"
+        archived = result_store.load(operation_name)
+        if archived is not None:
+            print("📦 從本機封存讀取結果")
+            return {"name": operation_name, "done": True, "response": archived}
+        
+        poll_url = f"{upstream.vertex_base_url(self.location)}/projects/{self.project_id}/locations/{self.location}/publishers/google/models/{model_id}:fetchPredictOperation"
         
         headers = {
             "Authorization": f"Bearer {self.get_access_token()}",
@@ -102,18 +133,33 @@ class VeoVideoSaver:
             check_count += 1
             elapsed = int(time.time() - start_time)
             
-            response = requests.post(poll_url, headers=headers, json=poll_payload)
+            try:
+                # 查詢是冪等的：429/5xx 與網路錯誤會依退避自動重試
+                response = upstream.post(poll_url, headers=headers, json=poll_payload, idempotent=True)
+            except Exception as e:
+                # 重試後仍失敗：生成仍在上游進行，稍後再查而不是放棄整個工作
+                print(f"   ⚠️ 檢查 {check_count}: 狀態檢查暫時失敗 ({e})")
+                response = None
             
-            if response.status_code == 200:
+            if response is not None and response.status_code != 200 and not upstream.is_transient_status(response.status_code):
+                # 400/403/404 等永久錯誤：再查也不會成功
+                raise Exception(f"狀態檢查失敗: {response.status_code} - {response.text}")
+            if response is not None and response.status_code == 200:
                 status = response.json()
                 
                 if status.get("done", False):
                     print(f"\n🎉 影片生成完成！(總時間: {elapsed} 秒)")
+                    if resolution is not None and duration is not None:
+                        poll_scheduler.record_completion(model_id, resolution, duration, time.time() - start_time)
+                    if status.get("response"):
+                        status["response"] = result_store.store(operation_name, status["response"])
                     return status
                 else:
-                    print(f"   檢查 {check_count}: 處理中... (已等待 {elapsed} 秒)")
+                    remaining = poll_scheduler.estimate_remaining(elapsed, model_id, resolution, duration)
+                    print(f"   檢查 {check_count}: 處理中... (已等待 {elapsed} 秒，預估還需 {remaining} 秒)")
             
-            time.sleep(15)
+            # 依歷史完成時間決定下一次檢查時間：預期完成前稀疏、接近時密集
+            time.sleep(poll_scheduler.next_interval(time.time() - start_time, model_id, resolution, duration))
         
         raise Exception(f"等待超時 ({max_wait} 秒)")
     
@@ -131,23 +177,25 @@ class VeoVideoSaver:
         
         video = videos[0]  # 取第一個影片
         
-        if "bytesBase64Encoded" not in video:
-            raise Exception("影片不是 Base64 格式")
-        
-        # 解碼 Base64 資料
-        base64_data = video["bytesBase64Encoded"]
-        video_bytes = base64.b64decode(base64_data)
-        
         # 生成檔名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{filename_prefix}_{timestamp}.mp4"
         filepath = os.path.join(self.output_dir, filename)
         
-        # 寫入檔案
-        with open(filepath, "wb") as f:
-            f.write(video_bytes)
+        if "sampleIndex" in video:
+            # 已解碼並封存：直接複製檔案
+            sample = result_store.get_sample(result.get("name", ""), video["sampleIndex"])
+            if sample is None:
+                raise Exception("封存中找不到影片檔案")
+            shutil.copyfile(sample["path"], filepath)
+        elif "bytesBase64Encoded" in video:
+            # 解碼 Base64 資料並寫入檔案
+            with open(filepath, "wb") as f:
+                f.write(base64.b64decode(video["bytesBase64Encoded"]))
+        else:
+            raise Exception("影片不是 Base64 格式")
         
-        file_size = len(video_bytes) / (1024 * 1024)  # MB
+        file_size = os.path.getsize(filepath) / (1024 * 1024)  # MB
         
         print(f"\n🎥 影片已儲存！")
         print(f"📁 檔案位置: {filepath}")
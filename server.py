@@ -4,26 +4,98 @@ Minimal FastAPI bridge to safely call Veo from a frontend.
 Endpoints:
 - POST /api/veo/generate -> returns { ok, operationName }
 - GET  /api/veo/operations/{operationName} -> returns { ok, done, response }
+- POST /api/veo/generate/image-text -> returns { ok, operationName }
+  (JSON with imageBase64, or multipart/form-data with the raw image file in the "image" part)
+- GET  /api/veo/operations/{operationName}/events -> Server-Sent Events progress stream
+- GET  /api/veo/results/{operationName}/{sampleIndex} -> raw video/mp4 (Range + ETag)
+- POST /api/veo/generate/wait, /api/veo/generate/image-text/wait
+  -> async; waits server-side without pinning a worker thread
+- POST /api/veo/batch -> returns { ok, batchId }; GET /api/veo/batch/{batchId} -> NDJSON results
+- GET  /metrics -> Prometheus text format (latencies, payload sizes, in-flight operations, upstream statuses)
+Identical generate requests can be answered from generation_cache (VEO_GENERATION_CACHE=1);
+send "cache": "bypass" to force a new generation.
+With VEO_OUTPUT_STORAGE_URI (or a per-request storageUri) results are written to gs:// and fetched
+with parallel ranged GETs (gcs_download, VEO_GCS_ENDPOINT for a fake GCS server).
+Input images are letterboxed to the requested aspectRatio/resolution and re-encoded as JPEG
+before submission when Pillow is installed (image_preprocess, VEO_IMAGE_NORMALIZE=0 to disable).
 
 Auth uses ADC (gcloud auth application-default login) or active gcloud user token.
 """
 
+import asyncio
+import json
 import os
 import time
-import requests
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import Optional
-import google.auth
-from google.auth.transport.requests import Request as GARequest
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.datastructures import UploadFile
+from typing import Annotated, List, Optional, Union
+
+import httpx
+
+import upstream
+from batch_runner import DEFAULT_CONCURRENCY as BATCH_CONCURRENCY, BatchRunner
+from generation_cache import default_cache as generation_cache
+from image_preprocess import default_normalizer as image_normalizer
+from image_upload import MULTIPART_AVAILABLE, UploadedImage, request_body
+import metrics
+from job_history import default_history as job_history
+from job_store import DONE as JOB_DONE, EXPIRED as JOB_EXPIRED, FAILED as JOB_FAILED, default_job_store as job_store
+from operation_poller import OperationPoller
+from poll_scheduler import default_scheduler as poll_scheduler
+from rate_limiter import default_limiter as rate_limiter
+from retry_policy import CircuitOpenError, default_breakers as circuit_breakers, default_policy as retry_policy
+from result_store import default_store as result_store
+from stream_decode import CHUNK_SIZE as STREAM_CHUNK_SIZE
+from token_provider import default_provider as token_provider
+from upstream_router import UpstreamRouter, parse_targets
 
 PROJECT_ID = os.environ.get("VEO_PROJECT_ID", "gen-lang-client-0510365442")
 LOCATION = os.environ.get("VEO_LOCATION", "us-central1")
 MODEL_ID = os.environ.get("VEO_MODEL_ID", "veo-3.0-fast-generate-001")
-BASE_URL = f"https://{LOCATION}-aiplatform.googleapis.com/v1"
-
-app = FastAPI(title="Veo Frontend Bridge", version="1.0")
+# 多個上游目標（"project:location,..."）；未設定時只用 PROJECT_ID / LOCATION
+router = UpstreamRouter(parse_targets(os.environ.get("VEO_TARGETS"), PROJECT_ID, LOCATION))
+# 圖片轉影片模型
+IMAGE_MODEL_ID = "veo-3.0-generate-001"
+# 設定時（gs://bucket/prefix）請求未指定 storageUri 也讓 Veo 把影片寫到 Cloud Storage，
+# 完成後由 result_store 以平行分段下載取回，不經過 Base64 與大型 JSON 回應
+OUTPUT_STORAGE_URI = os.environ.get("VEO_OUTPUT_STORAGE_URI") or None
+
+# 最長等待 5 分鐘（可依 job_history.py 報表的完成時間分佈調整）；實際輪詢間隔由 poll_scheduler
+# 依歷史完成時間決定，POLL_INTERVAL_SECONDS 是同一操作兩次上游查詢的最短間隔
+MAX_WAIT_SECONDS = float(os.environ.get("VEO_MAX_WAIT_SECONDS", "300"))
+POLL_INTERVAL_SECONDS = poll_scheduler.min_interval
+# 單一 worker 同時等待中的請求上限（每個等待者只佔用一個 coroutine）
+MAX_CONCURRENT_WAITS = int(os.environ.get("VEO_MAX_CONCURRENT_WAITS", "5000"))
+_active_waiters = 0
+# SSE 連線閒置時送出心跳的間隔
+SSE_HEARTBEAT_SECONDS = 15
+# 單一批次的項目上限
+BATCH_MAX_ITEMS = int(os.environ.get("VEO_BATCH_MAX_ITEMS", "500"))
+# 限流後上游仍回 429/503 時，退避後重新排隊送出的次數
+SUBMIT_THROTTLE_RETRIES = int(os.environ.get("VEO_SUBMIT_THROTTLE_RETRIES", "3"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 重新啟動（--reload、kill -9）前還在進行的生成繼續追蹤
+    await _resume_jobs()
+    yield
+    await batch_runner.stop()
+    await poller.stop()
+    await asyncio.to_thread(job_store.close)
+    image_normalizer.close()
+    result_store.downloader.close()
+    # 關閉共用的上游連線池
+    await upstream.aclose()
+    upstream.close()
+
+
+app = FastAPI(title="Veo Frontend Bridge", version="1.0", lifespan=lifespan)
 
 # Enable permissive CORS for development (adjust in production)
 app.add_middleware(
@@ -36,48 +108,98 @@ app.add_middleware(
 
 
 def get_bearer():
-    # Prefer ADC; fallback to gcloud user token
-    try:
-        creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        if not creds.valid:
-            creds.refresh(GARequest())
-        return creds.token
-    except Exception:
-        # Fallback to gcloud auth print-access-token
-        import subprocess
-        token = subprocess.run(["gcloud", "auth", "print-access-token"], capture_output=True, text=True, check=True).stdout.strip()
-        return token
+    # Prefer ADC; fallback to gcloud user token (cached and refreshed in the background)
+    return token_provider.get_token()
+
+
+def auth_headers():
+    return token_provider.auth_headers()
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of the job lifecycle metrics."""
+    return Response(metrics.default_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/veo/poller/stats")
+def poller_stats():
+    """In-flight operations tracked by the shared poller and upstream call count."""
+    return {"ok": True, **poller.stats()}
+
+
+@app.get("/api/veo/auth/stats")
+def auth_stats():
+    """Token cache hit counts and refresh latency."""
+    return {"ok": True, **token_provider.stats()}
+
+
+@app.get("/api/veo/jobs/stats")
+def jobs_stats():
+    """Durable job table: job counts by state and pending batched writes."""
+    return {"ok": True, **job_store.stats()}
+
+
+@app.get("/api/veo/upstream/stats")
+def upstream_stats():
+    """Circuit breaker state per regional endpoint and routing score per (project, region) target."""
+    return {"ok": True, "breakers": circuit_breakers.stats(), "targets": router.stats()}
+
+
+@app.get("/api/veo/ratelimit/stats")
+def ratelimit_stats():
+    """Per-model token buckets: available units, queued submissions and 429 count."""
+    return {"ok": True, "models": rate_limiter.stats()}
+
+
+@app.get("/api/veo/images/stats")
+def images_stats():
+    """Input image normalization: cache hits and bytes before/after re-encoding."""
+    return {"ok": True, **image_normalizer.stats()}
+
+
+@app.get("/api/veo/cache/stats")
+def cache_stats():
+    """Generation cache entries, referenced bytes and hit counts."""
+    return {"ok": True, **generation_cache.stats()}
 
 
 class GenerateReq(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=2000)
     durationSeconds: int = Field(6, ge=1, le=60)
-    # Basic pattern like "16:9" (two integers separated by colon)
-    aspectRatio: str = Field("16:9", pattern=r"^\d+:\d+$")
+    # Basic pattern like "16:9" (two positive integers separated by colon)
+    aspectRatio: str = Field("16:9", pattern=r"^[1-9]\d*:[1-9]\d*$")
     sampleCount: int = Field(1, ge=1, le=2)
     generateAudio: bool = True
     # Limit to known-good values supported by the backend
     resolution: str = Field("720p", pattern=r"^(480p|720p|1080p)$")
     # Optional gs:// path if provided
     storageUri: Optional[str] = Field(None, pattern=r"^gs://.+")
+    # Fixed seed for reproducible output; part of the generation cache key
+    seed: Optional[int] = Field(None, ge=0, le=4294967295)
+    # "bypass" skips the generation cache lookup
+    cache: str = Field("use", pattern=r"^(use|bypass)$")
 
 
-class ImageTextGenerateReq(BaseModel):
+class ImageTextParams(BaseModel):
+    """圖片+文字生成的參數（multipart 上傳時圖片另外以檔案傳入）"""
     prompt: str = Field("", min_length=0, max_length=2000)  # 可選的提示詞
-    imageBase64: str = Field(..., min_length=1)  # Base64 編碼的圖片數據
     imageMimeType: str = Field(..., pattern=r"^image/(jpeg|png)$")  # 圖片 MIME 類型
     durationSeconds: int = Field(8, ge=1, le=60)
-    aspectRatio: str = Field("16:9", pattern=r"^\d+:\d+$")
+    aspectRatio: str = Field("16:9", pattern=r"^[1-9]\d*:[1-9]\d*$")
     sampleCount: int = Field(1, ge=1, le=2)
     generateAudio: bool = True
     resolution: str = Field("720p", pattern=r"^(480p|720p|1080p)$")
     storageUri: Optional[str] = Field(None, pattern=r"^gs://.+")
+    seed: Optional[int] = Field(None, ge=0, le=4294967295)
+    cache: str = Field("use", pattern=r"^(use|bypass)$")
 
 
-@app.post("/api/veo/generate")
-def generate(req: GenerateReq):
-    url = f"{BASE_URL}/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{MODEL_ID}:predictLongRunning"
-    headers = {"Authorization": f"Bearer {get_bearer()}", "Content-Type": "application/json"}
+class ImageTextGenerateReq(ImageTextParams):
+    imageBase64: str = Field(..., min_length=1)  # Base64 編碼的圖片數據
+
+
+def _text_payload(req: GenerateReq) -> dict:
     payload = {
         "instances": [{"prompt": req.prompt}],
         "parameters": {
@@ -88,31 +210,313 @@ def generate(req: GenerateReq):
             "resolution": req.resolution,
         },
     }
-    if req.storageUri:
-        payload["parameters"]["storageUri"] = req.storageUri
+    if req.storageUri or OUTPUT_STORAGE_URI:
+        payload["parameters"]["storageUri"] = req.storageUri or OUTPUT_STORAGE_URI
+    if req.seed is not None:
+        payload["parameters"]["seed"] = req.seed
+    return payload
 
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
+
+def _image_text_payload(req: ImageTextParams, image: Optional[UploadedImage] = None) -> dict:
+    # 構建請求 payload - 參考 image_to_video.py 的結構
+    # multipart 上傳的圖片以 UploadedImage 佔位，送往上游時才分段編碼
+    instances = [{
+        "prompt": req.prompt or "讓圖片中的場景動畫化，加入自然的動態效果",
+        "image": {
+            "bytesBase64Encoded": image if image is not None else req.imageBase64,
+            "mimeType": req.imageMimeType
+        }
+    }]
+
+    parameters = {
+        "aspectRatio": req.aspectRatio,
+        "durationSeconds": req.durationSeconds,
+        "sampleCount": req.sampleCount,
+        "generateAudio": req.generateAudio,
+        "resolution": req.resolution,
+    }
+
+    # Veo 3 模型的特殊參數處理
+    if "veo-3" in IMAGE_MODEL_ID:
+        parameters.setdefault("generateAudio", True)
+        parameters.setdefault("resolution", "720p")
+
+    if req.storageUri or OUTPUT_STORAGE_URI:
+        parameters["storageUri"] = req.storageUri or OUTPUT_STORAGE_URI
+    if req.seed is not None:
+        parameters["seed"] = req.seed
+
+    return {
+        "instances": instances,
+        "parameters": parameters
+    }
+
+
+def _model_for_operation(operation_name: str) -> str:
+    """
+    本服務送出的操作以工作表記錄的模型為準；
+    其他操作從名稱解析：.../publishers/google/models/{model}/operations/{id}
+    會查詢 SQLite，非同步端點以 asyncio.to_thread 呼叫
+    """
+    model_id = job_store.model_for(operation_name)
+    if model_id:
+        return model_id
+    parts = operation_name.split("/")
+    if "models" in parts:
+        idx = parts.index("models")
+        if idx + 1 < len(parts):
+            return parts[idx + 1]
+    return MODEL_ID
+
+
+async def _cached_result(key: str) -> Optional[dict]:
+    """快取命中且封存中仍有影片時回傳結果"""
+    op = await asyncio.to_thread(generation_cache.get, key)
+    if op is None:
+        return None
+    archived = await asyncio.to_thread(result_store.load, op)
+    if archived is None:
+        # 影片已被封存淘汰
+        await asyncio.to_thread(generation_cache.forget, key)
+        return None
+    return {"ok": True, "operationName": op, "startTime": time.time(), "cached": True,
+            "response": _with_result_urls(op, archived)}
+
+
+async def _submit(model_id: str, payload: dict, cache: str = "use") -> dict:
+    """
+    送出 predictLongRunning，成功時開始由 poller 追蹤該操作。
+    相同的請求若已在生成快取中，直接回傳之前的操作（cached=True）。
+    輸入圖片先依 aspectRatio / resolution 正規化成較小的 JPEG。
+    """
+    payload = await image_normalizer.normalize_payload(payload)
+    key = generation_cache.key(model_id, payload) if generation_cache.enabled else None
+    if key and cache != "bypass":
+        cached = await _cached_result(key)
+        if cached is not None:
+            return cached
+    params = payload.get("parameters", {})
+    queued_at = time.time()
+    delays = retry_policy.delays()
+    for attempt in range(SUBMIT_THROTTLE_RETRIES + 1):
+        # 選分數最好且有配額的目標；都沒有配額時在最好的目標排隊，而不是把 429 直接丟回前端
+        target = router.choose(lambda t: rate_limiter.has_capacity(model_id, params, t.key))
+        await rate_limiter.acquire(model_id, params, target.key)
+        start_time = time.time()
+        try:
+            # 送出不是冪等的：只有 429/503（上游沒有受理）才重新排隊
+            body = request_body(payload)
+            headers = {**await token_provider.aauth_headers(), **body.pop("headers", {})}
+            r = await upstream.apost(target.model_url(model_id, "predictLongRunning"),
+                                     headers=headers, retry=False, **body)
+        except CircuitOpenError as e:
+            return {"ok": False, "status": 503, "error": str(e), "elapsedSeconds": int(time.time() - queued_at)}
+        except Exception as e:
+            metrics.SUBMIT_SECONDS.observe(time.time() - start_time, model=model_id, status="error")
+            router.record(target, time.time() - start_time, None)
+            return {"ok": False, "status": 502, "error": f"上游請求失敗: {e}", "elapsedSeconds": int(time.time() - queued_at)}
+        metrics.SUBMIT_SECONDS.observe(time.time() - start_time, model=model_id, status=r.status_code)
+        router.record(target, time.time() - start_time, r.status_code)
+        if not retry_policy.should_retry_status(r.status_code, idempotent=False) or attempt == SUBMIT_THROTTLE_RETRIES:
+            break
+        if r.status_code == 429:
+            rate_limiter.throttled(model_id, target.key)
+        await asyncio.sleep(retry_policy.wait_time(next(delays, retry_policy.max_delay), r.headers))
     if r.status_code != 200:
-        return {"ok": False, "status": r.status_code, "error": r.text}
+        return {"ok": False, "status": r.status_code, "error": r.text, "elapsedSeconds": int(time.time() - queued_at)}
     op = r.json().get("name")
-    return {"ok": True, "operationName": op}
+    if not op:
+        return {"ok": False, "error": "無法獲取操作名稱", "elapsedSeconds": int(time.time() - queued_at)}
+    # 先寫入工作表，重新啟動後仍能繼續追蹤這個已付費的生成
+    job_store.record_submitted(op, model_id, {"parameters": params, "cacheKey": key, "target": target.key},
+                               started_at=start_time)
+    # 之後的輪詢送回同一個專案與區域
+    router.remember(op, target.key)
+    poller.track(op, model_id, started_at=start_time, context={
+        "submitted": True,
+        "follow": True,
+        "resolution": params.get("resolution"),
+        "durationSeconds": params.get("durationSeconds"),
+        "aspectRatio": params.get("aspectRatio"),
+        "sampleCount": params.get("sampleCount"),
+        "region": target.location,
+        "cacheKey": key,
+    })
+    return {"ok": True, "operationName": op, "startTime": start_time}
+
+
+async def _resume_jobs():
+    """啟動時把工作表中未完成的操作交回輪詢器，沒有等待者也追蹤到完成並封存結果"""
+    now = time.time()
+    for job in await asyncio.to_thread(job_store.unfinished):
+        op = job["operationName"]
+        if now - job["createdAt"] > poller.follow_seconds:
+            job_store.record_state(op, JOB_EXPIRED)
+            continue
+        params = job["params"].get("parameters", {})
+        router.remember(op, job["params"].get("target"))
+        poller.track(op, job["modelId"], started_at=job["createdAt"], context={
+            "follow": True,
+            "resolution": params.get("resolution"),
+            "durationSeconds": params.get("durationSeconds"),
+            "aspectRatio": params.get("aspectRatio"),
+            "sampleCount": params.get("sampleCount"),
+            "cacheKey": job["params"].get("cacheKey"),
+        })
+
+
+@app.post("/api/veo/generate")
+async def generate(req: GenerateReq):
+    result = await _submit(MODEL_ID, _text_payload(req), req.cache)
+    if not result["ok"]:
+        return {"ok": False, "status": result.get("status"), "error": result.get("error")}
+    return {"ok": True, "operationName": result["operationName"], "cached": result.get("cached", False)}
+
+
+def _validate(model, data):
+    """手動解析的本文也回傳與 FastAPI 相同格式的 422"""
+    try:
+        return model.model_validate(data)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+
+
+_IMAGE_TEXT_OPENAPI = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": ImageTextGenerateReq.model_json_schema()},
+    "multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["image"],
+        "properties": {"image": {"type": "string", "format": "binary"},
+                       **ImageTextParams.model_json_schema()["properties"]},
+    }},
+}}}
+
+
+@app.post("/api/veo/generate/image-text", openapi_extra=_IMAGE_TEXT_OPENAPI)
+async def generate_image_text(request: Request):
+    """
+    Start an image+text generation; follow it with /api/veo/operations/{name}/events.
+    Accepts the JSON body (imageBase64) or multipart/form-data with the raw JPEG/PNG in the "image" part
+    and the other fields as form fields; imageMimeType defaults to the part's content type.
+    Uploaded bytes are spooled to a temp file and Base64-encoded in chunks only while streaming the upstream request.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        if not MULTIPART_AVAILABLE:
+            return JSONResponse({"ok": False, "error": "伺服器未安裝 python-multipart，請改用 JSON 上傳"}, status_code=415)
+        async with request.form(max_files=1) as form:
+            upload = form.get("image")
+            if not isinstance(upload, UploadFile):
+                raise RequestValidationError([{"type": "missing", "loc": ("body", "image"), "msg": "Field required", "input": None}])
+            fields = {k: v for k, v in form.items() if k != "image"}
+            fields.setdefault("imageMimeType", upload.content_type)
+            req = _validate(ImageTextParams, fields)
+            image = await UploadedImage.from_file(upload.file, req.imageMimeType)
+            # 暫存檔在送出完成後才關閉
+            result = await _submit(IMAGE_MODEL_ID, _image_text_payload(req, image), req.cache)
+    else:
+        try:
+            data = await request.json()
+        except ValueError:
+            raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": "JSON decode error", "input": None}])
+        req = _validate(ImageTextGenerateReq, data)
+        result = await _submit(IMAGE_MODEL_ID, _image_text_payload(req), req.cache)
+    if not result["ok"]:
+        return {"ok": False, "status": result.get("status"), "error": result.get("error")}
+    return {"ok": True, "operationName": result["operationName"], "cached": result.get("cached", False)}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _operation_events(operation_name: str):
+    """把 poller 的每次輪詢結果轉成 SSE 事件；完成或出錯後結束串流"""
+    model_id = await asyncio.to_thread(_model_for_operation, operation_name)
+    queue = poller.subscribe(operation_name, model_id)
+    st = poller.get(operation_name)
+    try:
+        yield _sse("submitted", {
+            "operationName": operation_name,
+            "elapsedSeconds": int(time.time() - st.started_at),
+            "pollCount": st.poll_count,
+            "estimatedSecondsRemaining": poller.estimate_remaining(st),
+        })
+        while True:
+            try:
+                result = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # 保持連線，避免代理伺服器切斷閒置連線
+                yield ": keep-alive\n\n"
+                continue
+            progress = {"operationName": operation_name, "elapsedSeconds": result["elapsedSeconds"], "pollCount": result["pollCount"]}
+            if not result["ok"]:
+                yield _sse("error", {**progress, "status": result.get("status"), "error": result.get("error")})
+                return
+            if result.get("done"):
+                if _has_video(result.get("response") or {}):
+                    # 最終結果不放進事件本身，改給查詢網址與影片網址
+                    videos = result["response"].get("videos", [])
+                    yield _sse("done", {
+                        **progress,
+                        "resultUrl": f"/api/veo/operations/{operation_name}",
+                        "videoUrls": [v["url"] for v in videos if v.get("url")],
+                    })
+                else:
+                    yield _sse("error", {**progress, "error": "生成完成但未找到影片資料"})
+                return
+            yield _sse("running", {**progress, "estimatedSecondsRemaining": result.get("estimatedSecondsRemaining")})
+    finally:
+        poller.unsubscribe(operation_name, queue)
+
+
+@app.get("/api/veo/operations/{operation_name:path}/events")
+async def operation_events(operation_name: str):
+    """
+    Server-Sent Events: submitted / running / done / error with elapsedSeconds and pollCount.
+    The stream closes after done (with resultUrl) or error, so clients never run their own polling loop.
+    """
+    return StreamingResponse(
+        _operation_events(operation_name),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/veo/results/{operation_name:path}/{sample_index}")
+async def get_result(operation_name: str, sample_index: int, request: Request):
+    """
+    Raw video/mp4 for one decoded sample, with Content-Length, Range and ETag support.
+    """
+    sample = await asyncio.to_thread(result_store.get_sample, operation_name, sample_index)
+    if sample is None:
+        return JSONResponse({"ok": False, "error": "找不到影片結果"}, status_code=404)
+    etag = f'"{sample["etag"]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return FileResponse(
+        sample["path"],
+        media_type=sample.get("mimeType", "video/mp4"),
+        headers={"ETag": etag, "Cache-Control": "private, max-age=86400"},
+    )
 
 
 @app.get("/api/veo/operations/{operation_name:path}")
-def poll(operation_name: str):
-    poll_url = f"{BASE_URL}/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{MODEL_ID}:fetchPredictOperation"
-    headers = {"Authorization": f"Bearer {get_bearer()}", "Content-Type": "application/json"}
-    r = requests.post(poll_url, headers=headers, json={"operationName": operation_name}, timeout=60)
-    if r.status_code != 200:
-        return {"ok": False, "status": r.status_code, "error": r.text}
-    data = r.json()
-    return {"ok": True, "done": data.get("done", False), "response": data.get("response")}
+async def poll(operation_name: str):
+    # 同一操作的多個輪詢者共用 poller 的同一次上游查詢
+    model_id = await asyncio.to_thread(_model_for_operation, operation_name)
+    result = await poller.poll(operation_name, model_id)
+    if not result["ok"]:
+        return {"ok": False, "status": result.get("status"), "error": result.get("error")}
+    body = {"ok": True, "done": result.get("done", False), "response": result.get("response")}
+    if not body["done"]:
+        body["estimatedSecondsRemaining"] = result.get("estimatedSecondsRemaining")
+    return body
 
 
 @app.get("/api/veo/operations")
-def poll_query(name: str):
+async def poll_query(name: str):
     """Poll using a query string: /api/veo/operations?name=..."""
-    return poll(name)
+    return await poll(name)
 
 
 class PollBody(BaseModel):
@@ -120,172 +524,281 @@ class PollBody(BaseModel):
 
 
 @app.post("/api/veo/operations")
-def poll_body(body: PollBody):
+async def poll_body(body: PollBody):
     """Poll using a JSON body to avoid URL-encoding issues."""
-    return poll(body.operationName)
+    return await poll(body.operationName)
 
 
-@app.post("/api/veo/generate/wait")
-def generate_and_wait(req: GenerateReq):
+def _has_video(response: dict) -> bool:
+    """檢查完成的回應中是否有影片資料 - 支持多種可能的結構"""
+    if not response:
+        return False
+    # 檢查 videos 結構 (從 decode_previous_video.py 看到的實際結構；解碼後改為 url)
+    videos = response.get("videos", [])
+    if videos and (videos[0].get("url") or videos[0].get("bytesBase64Encoded")):
+        return True
+    # 檢查 predictions 結構 (假設的結構)
+    predictions = response.get("predictions", [])
+    if predictions and (predictions[0].get("video") or predictions[0].get("content")):
+        return True
+    return False
+
+
+async def _fetch_operation(model_id: str, op: str) -> dict:
     """
-    Start a generation and wait (poll server-side) until it's done or timeout.
-    Returns { ok, done, response, operationName, elapsedSeconds }.
-    後端會自動輪詢，生成完成後影片會以 Base64 格式返回，可在前端直接播放或下載。
+    向上游查詢一次操作狀態（只由 poller 呼叫）。
+    回應以串流方式解析：影片 Base64 分段解碼直接寫入 result_store，
+    每個完成的工作只需約一個區塊大小的記憶體。
+    已封存的操作直接從磁碟回傳，不再呼叫上游。
     """
-    url = f"{BASE_URL}/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{MODEL_ID}:predictLongRunning"
-    headers = {"Authorization": f"Bearer {get_bearer()}", "Content-Type": "application/json"}
-    payload = {
-        "instances": [{"prompt": req.prompt}],
-        "parameters": {
-            "durationSeconds": req.durationSeconds,
-            "sampleCount": req.sampleCount,
-            "aspectRatio": req.aspectRatio,
-            "generateAudio": req.generateAudio,
-            "resolution": req.resolution,
-        },
+    archived = await asyncio.to_thread(result_store.load, op)
+    if archived is not None:
+        _finish_job(op, JOB_DONE)
+        return {"ok": True, "done": True, "response": _with_result_urls(op, archived)}
+    # 操作只能在送出它的專案與區域查詢
+    target = router.target_for(op)
+    started = time.time()
+    st = poller.get(op)
+    if st is not None:
+        st.context.setdefault("firstPollAt", started)
+    # 每次輪詢都重新取權杖，避免長時間等待中權杖過期
+    # 查詢是冪等的：429/5xx 與網路錯誤由 upstream 依退避重試
+    try:
+        async with upstream.astream_post(target.model_url(model_id, "fetchPredictOperation"),
+                                         headers=await token_provider.aauth_headers(), json={"operationName": op},
+                                         idempotent=True) as pr:
+            router.record(target, time.time() - started, pr.status_code)
+            if pr.status_code != 200:
+                body = await pr.aread()
+                metrics.POLL_SECONDS.observe(time.time() - started, model=model_id, status=pr.status_code)
+                error = body.decode("utf-8", errors="replace")
+                if pr.status_code in (400, 404):
+                    # 操作不存在或無效，不會再有結果
+                    _finish_job(op, JOB_FAILED, error)
+                return {"ok": False, "status": pr.status_code, "error": error}
+            # 建立暫存目錄、Base64 解碼、雜湊與寫檔都是阻塞工作，不在事件迴圈上執行，
+            # 否則大型回應會卡住其他請求與 SSE 串流
+            incoming = await asyncio.to_thread(result_store.begin)
+            received = 0
+            # 解碼與寫入的時間（不含等待網路）
+            decode_seconds = 0.0
+            try:
+                async for chunk in pr.aiter_bytes(STREAM_CHUNK_SIZE):
+                    received += len(chunk)
+                    fed = time.perf_counter()
+                    await asyncio.to_thread(incoming.extractor.feed, chunk)
+                    decode_seconds += time.perf_counter() - fed
+                data = await asyncio.to_thread(incoming.extractor.close)
+            except BaseException:
+                await asyncio.to_thread(incoming.discard)
+                raise
+    except CircuitOpenError as e:
+        return {"ok": False, "status": 503, "error": str(e)}
+    except httpx.TransportError:
+        metrics.POLL_SECONDS.observe(time.time() - started, model=model_id, status="error")
+        router.record(target, time.time() - started, None)
+        raise
+    metrics.POLL_SECONDS.observe(time.time() - started, model=model_id, status=200)
+    metrics.RESPONSE_BYTES.observe(received, model=model_id, done="true" if data.get("done") else "false")
+
+    response = data.get("response")
+    if data.get("done") and response:
+        # 每個操作只解碼一次：之後所有回應只帶網址
+        committed = time.perf_counter()
+        response = _with_result_urls(op, await asyncio.to_thread(incoming.commit, op, response))
+        decode_seconds += time.perf_counter() - committed
+        metrics.DECODE_SECONDS.observe(decode_seconds, model=model_id)
+        if st is not None:
+            metrics.TIME_TO_DONE_SECONDS.observe(
+                time.time() - st.started_at, model=model_id,
+                resolution=st.context.get("resolution") or "", duration=st.context.get("durationSeconds") or "")
+        key = st.context.get("cacheKey") if st else None
+        if key and _has_video(response):
+            size = sum(v.get("bytes", 0) for v in response.get("videos", []))
+            await asyncio.to_thread(generation_cache.put, key, op, size)
+        _finish_job(op, JOB_DONE)
+        await _record_history(op, model_id, st, JOB_DONE, received, decode_seconds, response)
+    else:
+        await asyncio.to_thread(incoming.discard)
+        if data.get("done"):
+            _finish_job(op, JOB_FAILED, json.dumps(data.get("error"), ensure_ascii=False))
+            await _record_history(op, model_id, st, JOB_FAILED, received, decode_seconds, data.get("error"))
+    return {"ok": True, "done": data.get("done", False), "response": response}
+
+
+async def _record_history(op: str, model_id: str, st, state: str, response_bytes: int, decode_seconds: float,
+                          detail: Optional[dict]):
+    """把結束的操作寫進工作歷史（只記錄由本服務追蹤的操作）"""
+    if st is None:
+        return
+    context = st.context
+    entry = {
+        "operationName": op,
+        "state": state,
+        "model": model_id,
+        "resolution": context.get("resolution"),
+        "durationSeconds": context.get("durationSeconds"),
+        "aspectRatio": context.get("aspectRatio"),
+        "sampleCount": context.get("sampleCount"),
+        "region": context.get("region") or router.target_for(op).location,
+        "submittedAt": st.started_at,
+        "firstPollAt": context.get("firstPollAt"),
+        "doneAt": time.time(),
+        # 這次輪詢尚未計入 poll_count
+        "pollCount": st.poll_count + 1,
+        "responseBytes": response_bytes,
+        "decodeSeconds": round(decode_seconds, 4),
+        "resumed": not context.get("submitted", False),
     }
-    if req.storageUri:
-        payload["parameters"]["storageUri"] = req.storageUri
+    if state == JOB_DONE:
+        entry["videoBytes"] = sum(v.get("bytes", 0) for v in (detail or {}).get("videos", []))
+    else:
+        entry["error"] = detail
+    await asyncio.to_thread(job_history.record, entry)
 
-    start_time = time.time()
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
-    if r.status_code != 200:
-        return {"ok": False, "status": r.status_code, "error": r.text, "elapsedSeconds": int(time.time() - start_time)}
-    op = r.json().get("name")
 
-    poll_url = f"{BASE_URL}/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{MODEL_ID}:fetchPredictOperation"
-    # 最長等待 5 分鐘，每 3 秒輪詢一次（減少頻率以避免過度請求）
-    max_wait_seconds = 300  # 5分鐘
-    interval = 3
-    waited = 0
-    poll_count = 0
-    
-    while waited <= max_wait_seconds:
-        poll_count += 1
-        pr = requests.post(poll_url, headers=headers, json={"operationName": op}, timeout=60)
-        if pr.status_code != 200:
-            return {"ok": False, "status": pr.status_code, "error": pr.text, "operationName": op, "elapsedSeconds": int(time.time() - start_time), "pollCount": poll_count}
-        data = pr.json()
-        if data.get("done"):
-            elapsed = int(time.time() - start_time)
-            response = data.get("response", {})
-            # 檢查是否有影片資料 - 支持多種可能的結構
-            if response:
-                # 檢查 videos 結構 (從 decode_previous_video.py 看到的實際結構)
-                videos = response.get("videos", [])
-                if videos and len(videos) > 0:
-                    video = videos[0]
-                    if video.get("bytesBase64Encoded"):
-                        return {"ok": True, "done": True, "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
-                
-                # 檢查 predictions 結構 (假設的結構)
-                predictions = response.get("predictions", [])
-                if predictions and len(predictions) > 0:
-                    pred = predictions[0]
-                    if pred.get("video") or pred.get("content"):
-                        return {"ok": True, "done": True, "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
-            
-            # 如果沒有影片資料，返回錯誤
-            return {"ok": False, "error": "生成完成但未找到影片資料", "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
-        time.sleep(interval)
-        waited += interval
-
-    # 超時：回前端 operationName 讓前端看要不要繼續查
+def _finish_job(op: str, state: str, error: Optional[str] = None):
+    job_store.record_state(op, state, error)
+    router.forget(op)
+
+
+def _result_url(operation_name: str, sample_index: int) -> str:
+    return f"/api/veo/results/{operation_name}/{sample_index}"
+
+
+def _with_result_urls(operation_name: str, response: dict) -> dict:
+    for video in response.get("videos", []):
+        if "sampleIndex" in video:
+            video["url"] = _result_url(operation_name, video["sampleIndex"])
+    return response
+
+
+# 所有等待者與輪詢端點共用的上游輪詢器：每個操作每個週期只查詢一次
+poller = OperationPoller(
+    _fetch_operation,
+    interval=POLL_INTERVAL_SECONDS,
+    concurrency=int(os.environ.get("VEO_POLL_CONCURRENCY", "64")),
+    scheduler=poll_scheduler,
+)
+
+# 抓取 /metrics 時才讀取的即時數量
+metrics.default_registry.gauge(
+    "veo_inflight_operations", "Operations tracked by the shared poller", lambda: poller.stats()["trackedOperations"])
+metrics.default_registry.gauge(
+    "veo_waiting_clients", "Clients waiting on or subscribed to an operation", lambda: poller.stats()["waitingClients"])
+metrics.default_registry.gauge(
+    "veo_active_waits", "In-flight /wait requests on this worker", lambda: _active_waiters)
+
+
+async def _wait_for_operation(model_id: str, op: str, start_time: float) -> dict:
+    """
+    等待 poller 回報完成或逾時；等待期間不佔用執行緒，
+    每個等待者只保留一個 future。
+    """
+    result = await poller.wait(op, model_id, timeout=MAX_WAIT_SECONDS, started_at=start_time)
     elapsed = int(time.time() - start_time)
-    return {"ok": True, "done": False, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count, "timeout": True}
+    st = poller.get(op)
+    poll_count = result["pollCount"] if result else (st.poll_count if st else 0)
+
+    if result is None:
+        # 超時：回前端 operationName 讓前端看要不要繼續查
+        return {"ok": True, "done": False, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count, "timeout": True,
+                "estimatedSecondsRemaining": poller.estimate_remaining(st) if st else None}
+    if not result["ok"]:
+        return {"ok": False, "status": result.get("status"), "error": result.get("error"), "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
+    response = result.get("response") or {}
+    if _has_video(response):
+        return {"ok": True, "done": True, "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
+    # 如果沒有影片資料，返回錯誤
+    return {"ok": False, "error": "生成完成但未找到影片資料", "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
+
+
+async def _submit_and_wait(model_id: str, payload: dict, cache: str = "use") -> dict:
+    global _active_waiters
+    if _active_waiters >= MAX_CONCURRENT_WAITS:
+        return {"ok": False, "status": 503, "error": "等待中的請求過多，請稍後再試"}
+    _active_waiters += 1
+    try:
+        submitted = await _submit(model_id, payload, cache)
+        if not submitted["ok"]:
+            return submitted
+        return await _wait_for_submitted(model_id, submitted)
+    finally:
+        _active_waiters -= 1
+
+
+async def _wait_for_submitted(model_id: str, submitted: dict) -> dict:
+    if submitted.get("cached"):
+        return {"ok": True, "done": True, "response": submitted["response"], "operationName": submitted["operationName"],
+                "elapsedSeconds": 0, "pollCount": 0, "cached": True}
+    return await _wait_for_operation(model_id, submitted["operationName"], submitted["startTime"])
+
+
+@app.post("/api/veo/generate/wait")
+async def generate_and_wait(req: GenerateReq):
+    """
+    Start a generation and wait (poll server-side) until it's done or timeout.
+    Returns { ok, done, response, operationName, elapsedSeconds, pollCount } (plus cached=true on a cache hit).
+    後端會自動輪詢，生成完成後 response.videos[i].url 指向 /api/veo/results/...，可在前端直接播放或下載。
+    """
+    return await _submit_and_wait(MODEL_ID, _text_payload(req), req.cache)
 
 
 @app.post("/api/veo/generate/image-text/wait")
-def generate_image_text_and_wait(req: ImageTextGenerateReq):
+async def generate_image_text_and_wait(req: ImageTextGenerateReq):
     """
     從圖片和文字提示生成影片，等待完成後返回結果。
-    Returns { ok, done, response, operationName, elapsedSeconds }.
-    圖片以 Base64 格式傳入，生成完成後影片會以 Base64 格式返回。
+    Returns { ok, done, response, operationName, elapsedSeconds, pollCount }.
+    圖片以 Base64 格式傳入，生成完成後影片以 /api/veo/results/... 網址返回。
     """
-    # 使用圖片轉影片的模型
-    image_model_id = "veo-3.0-generate-001"  # 圖片轉影片模型
+    return await _submit_and_wait(IMAGE_MODEL_ID, _image_text_payload(req), req.cache)
 
-    url = f"{BASE_URL}/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{image_model_id}:predictLongRunning"
-    headers = {"Authorization": f"Bearer {get_bearer()}", "Content-Type": "application/json"}
 
-    # 構建請求 payload - 參考 image_to_video.py 的結構
-    instances = [{
-        "prompt": req.prompt or "讓圖片中的場景動畫化，加入自然的動態效果",
-        "image": {
-            "bytesBase64Encoded": req.imageBase64,
-            "mimeType": req.imageMimeType
-        }
-    }]
+def _item_request(item) -> tuple:
+    """批次項目 -> (模型, payload, 快取模式)"""
+    if isinstance(item, ImageTextGenerateReq):
+        return IMAGE_MODEL_ID, _image_text_payload(item), item.cache
+    return MODEL_ID, _text_payload(item), item.cache
 
-    parameters = {
-        "aspectRatio": req.aspectRatio,
-        "durationSeconds": req.durationSeconds,
-        "sampleCount": req.sampleCount,
-        "generateAudio": req.generateAudio,
-        "resolution": req.resolution,
-    }
 
-    # Veo 3 模型的特殊參數處理
-    if "veo-3" in image_model_id:
-        parameters.setdefault("generateAudio", True)
-        parameters.setdefault("resolution", "720p")
+async def _batch_submit(item) -> dict:
+    model_id, payload, cache = _item_request(item)
+    return await _submit(model_id, payload, cache)
 
-    if req.storageUri:
-        parameters["storageUri"] = req.storageUri
 
-    payload = {
-        "instances": instances,
-        "parameters": parameters
-    }
+async def _batch_wait(item, submitted: dict) -> dict:
+    return await _wait_for_submitted(_item_request(item)[0], submitted)
 
-    start_time = time.time()
-    r = requests.post(url, headers=headers, json=payload, timeout=60)
-    if r.status_code != 200:
-        return {"ok": False, "status": r.status_code, "error": r.text, "elapsedSeconds": int(time.time() - start_time)}
 
-    op = r.json().get("name")
-    if not op:
-        return {"ok": False, "error": "無法獲取操作名稱", "elapsedSeconds": int(time.time() - start_time)}
-
-    # 輪詢等待完成
-    poll_url = f"{BASE_URL}/projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{image_model_id}:fetchPredictOperation"
-    max_wait_seconds = 300  # 5分鐘
-    interval = 3
-    waited = 0
-    poll_count = 0
-
-    while waited <= max_wait_seconds:
-        poll_count += 1
-        pr = requests.post(poll_url, headers=headers, json={"operationName": op}, timeout=60)
-        if pr.status_code != 200:
-            return {"ok": False, "status": pr.status_code, "error": pr.text, "operationName": op, "elapsedSeconds": int(time.time() - start_time), "pollCount": poll_count}
-
-        data = pr.json()
-        if data.get("done"):
-            elapsed = int(time.time() - start_time)
-            response = data.get("response", {})
-
-            # 檢查是否有影片資料
-            if response:
-                videos = response.get("videos", [])
-                if videos and len(videos) > 0:
-                    video = videos[0]
-                    if video.get("bytesBase64Encoded"):
-                        return {"ok": True, "done": True, "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
-
-                # 檢查 predictions 結構 (備用)
-                predictions = response.get("predictions", [])
-                if predictions and len(predictions) > 0:
-                    pred = predictions[0]
-                    if pred.get("video") or pred.get("content"):
-                        return {"ok": True, "done": True, "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
-
-            # 如果沒有影片資料，返回錯誤
-            return {"ok": False, "error": "生成完成但未找到影片資料", "response": response, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count}
-
-        time.sleep(interval)
-        waited += interval
-
-    # 超時
-    elapsed = int(time.time() - start_time)
-    return {"ok": True, "done": False, "operationName": op, "elapsedSeconds": elapsed, "pollCount": poll_count, "timeout": True}
+batch_runner = BatchRunner(_batch_submit, _batch_wait)
+
+# 有 imageBase64 的項目是圖片轉影片，否則是文字轉影片
+BatchItem = Annotated[Union[ImageTextGenerateReq, GenerateReq], Field(union_mode="left_to_right")]
+
+
+class BatchReq(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    # 同時送出的項目數；送出後的等待不受此限制
+    concurrency: int = Field(BATCH_CONCURRENCY, ge=1, le=64)
+
+
+@app.post("/api/veo/batch")
+async def create_batch(req: BatchReq):
+    """
+    Submit many generations at once; returns { ok, batchId, total }.
+    Items go through the same rate limiter, connection pool and poller as single requests.
+    """
+    batch = batch_runner.create(req.items, req.concurrency)
+    return {"ok": True, "batchId": batch.id, "total": batch.total}
+
+
+@app.get("/api/veo/batch/{batch_id}")
+async def batch_results(batch_id: str):
+    """
+    NDJSON stream: one line per finished item ({ index, ok, done, operationName, response, ... })
+    in completion order, then a final { summary } line. Reconnecting replays from the first line.
+    """
+    batch = batch_runner.get(batch_id)
+    if batch is None:
+        return JSONResponse({"ok": False, "error": "找不到批次"}, status_code=404)
+    return StreamingResponse(batch.stream(), media_type="application/x-ndjson")
@@ -23,10 +23,10 @@ source venv/bin/activate
 
 # 檢查依賴包
 echo "📦 檢查依賴包..."
-python -c "import fastapi, uvicorn, google.auth, google.cloud.aiplatform" 2>/dev/null
+python -c "import fastapi, uvicorn, httpx, python_multipart, google.auth, google.cloud.aiplatform" 2>/dev/null
 if [ $? -ne 0 ]; then
     echo "❌ 缺少依賴包，正在安裝..."
-    pip install fastapi uvicorn google-auth google-cloud-aiplatform
+    pip install fastapi uvicorn "httpx[http2]" python-multipart google-auth google-cloud-aiplatform
 fi
 
 # 清理舊進程
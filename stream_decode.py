@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+fetchPredictOperation 回應的串流解析與分段 Base64 解碼
+- 逐塊讀取上游回應，遇到 "bytesBase64Encoded" 的值時直接分段解碼寫入檔案
+- 其餘很小的 JSON 骨架才保留在記憶體中解析（影片欄位替換成空字串）
+- 每個完成的工作，峰值記憶體約為一個區塊大小，而不是影片大小的 4 倍
+"""
+
+import base64
+import hashlib
+import json
+import os
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+
+# 上游回應的讀取區塊大小（位元組）
+CHUNK_SIZE = int(os.environ.get("VEO_STREAM_CHUNK_SIZE", str(256 * 1024)))
+
+VIDEO_KEY = b"bytesBase64Encoded"
+
+
+class ChunkedBase64Decoder:
+    """把分段到達的 Base64 文字解碼後寫入檔案，並計算大小與 SHA-256"""
+
+    def __init__(self, sink: BinaryIO):
+        self.sink = sink
+        self.size = 0
+        self._carry = b""
+        self._sha256 = hashlib.sha256()
+
+    def feed(self, data: bytes):
+        data = self._carry + data
+        usable = len(data) - len(data) % 4
+        self._carry = data[usable:]
+        if usable:
+            self._write(base64.b64decode(data[:usable]))
+
+    def close(self):
+        if self._carry:
+            # 補齊缺少的 padding
+            self._write(base64.b64decode(self._carry + b"=" * (-len(self._carry) % 4)))
+            self._carry = b""
+        self.sink.close()
+
+    @property
+    def etag(self) -> str:
+        return self._sha256.hexdigest()[:32]
+
+    def _write(self, chunk: bytes):
+        self.sink.write(chunk)
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+
+
+def decode_base64_to_file(b64: str, path: str, chunk_chars: int = CHUNK_SIZE) -> ChunkedBase64Decoder:
+    """把已在記憶體中的 Base64 字串分段解碼寫入檔案，避免再多一份完整的 bytes 複本"""
+    decoder = ChunkedBase64Decoder(open(path, "wb"))
+    try:
+        for start in range(0, len(b64), chunk_chars):
+            decoder.feed(b64[start:start + chunk_chars].encode("ascii"))
+    finally:
+        decoder.close()
+    return decoder
+
+
+class StreamingVideoExtractor:
+    """
+    逐塊餵入上游 JSON 回應：
+    - 一般內容累積為骨架 JSON
+    - "bytesBase64Encoded" 的字串值直接串流解碼到 open_sink(i) 回傳的檔案
+    """
+
+    # 掃描狀態
+    _OUT, _STR, _VIDEO = range(3)
+
+    def __init__(self, open_sink: Callable[[int], BinaryIO]):
+        """
+        Args:
+            open_sink: 依樣本序號開啟寫入目標（二進位檔案物件）
+        """
+        self.open_sink = open_sink
+        self.samples: List[Dict[str, Any]] = []
+        self._skeleton = bytearray()
+        self._state = self._OUT
+        self._string = bytearray()
+        self._escape = False
+        self._expect_video = False
+        self._decoder: Optional[ChunkedBase64Decoder] = None
+
+    def feed(self, chunk: bytes):
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._state == self._VIDEO:
+                i = self._feed_video(chunk, i)
+                continue
+            b = chunk[i]
+            if self._state == self._STR:
+                self._string.append(b)
+                if self._escape:
+                    self._escape = False
+                elif b == 0x5C:  # 反斜線
+                    self._escape = True
+                elif b == 0x22:  # 字串結束
+                    self._state = self._OUT
+                    self._skeleton += self._string
+                    self._expect_video = self._string == b'"' + VIDEO_KEY + b'"'
+                i += 1
+                continue
+            # _OUT：字串以外的 JSON 結構
+            if b == 0x22:
+                if self._expect_video and self._skeleton.rstrip().endswith(b":"):
+                    self._start_video()
+                else:
+                    self._state = self._STR
+                    self._string = bytearray(b'"')
+                i += 1
+                continue
+            if b not in b" \t\r\n:":
+                self._expect_video = False
+            self._skeleton.append(b)
+            i += 1
+
+    def close(self) -> Dict[str, Any]:
+        """結束串流，回傳骨架 JSON（影片欄位為空字串，內容見 self.samples）"""
+        if self._state != self._OUT:
+            raise ValueError("上游回應在字串中途結束")
+        return json.loads(bytes(self._skeleton))
+
+    def abort(self):
+        """發生錯誤時關閉尚未完成的寫入目標"""
+        if self._decoder is not None:
+            self._decoder.sink.close()
+            self._decoder = None
+
+    def _start_video(self):
+        self._state = self._VIDEO
+        self._escape = False
+        self._expect_video = False
+        self._decoder = ChunkedBase64Decoder(self.open_sink(len(self.samples)))
+
+    def _feed_video(self, chunk: bytes, i: int) -> int:
+        end = chunk.find(b'"', i)
+        segment = chunk[i:] if end < 0 else chunk[i:end]
+        if self._escape:
+            # 上一塊以反斜線結尾：這個字元是跳脫後的內容（例如 \/）
+            segment = segment[:1].replace(b"n", b"").replace(b"r", b"") + segment[1:]
+            self._escape = False
+        if b"\\" in segment:
+            if segment.endswith(b"\\"):
+                segment = segment[:-1]
+                self._escape = True
+            segment = segment.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        self._decoder.feed(segment)
+        if end < 0:
+            return len(chunk)
+        # 影片字串結束：骨架中以空字串佔位
+        self._decoder.close()
+        self.samples.append({"sampleIndex": len(self.samples), "bytes": self._decoder.size, "etag": self._decoder.etag})
+        self._decoder = None
+        self._skeleton += b'""'
+        self._state = self._OUT
+        return end + 1
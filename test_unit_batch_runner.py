@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 BatchRunner 限制同時送出的數量，並依完成順序串流 NDJSON 結果
+- 使用假的 submit / wait，不會呼叫真正的 Vertex AI
+"""
+
+import asyncio
+import json
+
+from batch_runner import BatchRunner
+
+
+def test_bounded_submission_and_streamed_results():
+    active = {"now": 0, "max": 0}
+
+    async def fake_submit(item):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        if item == "bad":
+            return {"ok": False, "status": 400, "error": "bad request"}
+        return {"ok": True, "operationName": f"ops/{item}"}
+
+    async def fake_wait(item, submitted):
+        # 後面的項目先完成
+        await asyncio.sleep(0.05 / (int(item) + 1))
+        return {"ok": True, "done": True, "operationName": submitted["operationName"]}
+
+    async def scenario():
+        runner = BatchRunner(fake_submit, fake_wait)
+        batch = runner.create(["0", "1", "2", "bad", "4"], concurrency=2)
+        lines = [json.loads(line) async for line in batch.stream()]
+        # 完成後重新連線會從第一行重播
+        replay = [json.loads(line) async for line in runner.get(batch.id).stream()]
+        await runner.stop()
+        return lines, replay
+
+    lines, replay = asyncio.run(scenario())
+    assert active["max"] == 2
+    assert lines == replay
+    assert sorted(line["index"] for line in lines[:-1]) == [0, 1, 2, 3, 4]
+    assert lines[0]["index"] == 3 and lines[0]["ok"] is False
+    assert lines[-1]["summary"]["succeeded"] == 4 and lines[-1]["summary"]["failed"] == 1
+
+
+if __name__ == "__main__":
+    test_bounded_submission_and_streamed_results()
+    print("✅ 單元測試通過：批次送出與串流結果正常")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 cassette 的錄製（不含權杖、長字串只留雜湊）與依時間重播輪詢狀態
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from cassette import Cassette
+
+BASE = "https://us-central1-aiplatform.googleapis.com/v1/projects/p/locations/us-central1/publishers/google/models/veo"
+OP = "projects/p/locations/us-central1/publishers/google/models/veo/operations/1"
+
+
+def _upstream():
+    polls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith(":predictLongRunning"):
+            return httpx.Response(200, json={"name": OP})
+        polls.append(request)
+        if len(polls) == 1:
+            return httpx.Response(200, json={"name": OP})
+        return httpx.Response(200, json={"name": OP, "done": True, "response": {"videos": []}})
+    return httpx.MockTransport(handler)
+
+
+def _record(path: str):
+    cassette = Cassette(path, "record")
+    with httpx.Client(transport=cassette.transport(_upstream())) as client:
+        headers = {"Authorization": "Bearer secret-token"}
+        client.post(f"{BASE}:predictLongRunning", headers=headers, json={"instances": [{"prompt": "x" * 1000}]})
+        client.post(f"{BASE}:fetchPredictOperation", headers=headers, json={"operationName": OP})
+        client.post(f"{BASE}:fetchPredictOperation", headers=headers, json={"operationName": OP})
+    # 固定錄製時間：送出後 10 秒仍在執行，30 秒完成
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    for entry, at in zip(entries, (100.0, 110.0, 130.0)):
+        entry["at"] = at
+    with open(path, "w") as f:
+        f.writelines(json.dumps(e) + "\n" for e in entries)
+    return entries
+
+
+def test_record_redacts_and_replay_follows_recorded_timing():
+    path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+    entries = _record(path)
+    raw = open(path).read()
+    assert "secret-token" not in raw and "x" * 300 not in raw
+    assert entries[0]["request"]["body"]["instances"][0]["prompt"].startswith("<1000 chars sha256:")
+
+    cassette = Cassette(path, "replay", speed=1000)
+    with httpx.Client(base_url="http://replay.local/v1", transport=cassette.transport(httpx.HTTPTransport())) as client:
+        target = BASE.split("/v1", 1)[1]
+        assert client.post(f"{target}:predictLongRunning", json={"instances": [{"prompt": "y"}]}).json() == {"name": OP}
+        assert "done" not in client.post(f"{target}:fetchPredictOperation", json={"operationName": OP}).json()
+        time.sleep(0.05)  # 1000 倍速下相當於 50 秒
+        assert client.post(f"{target}:fetchPredictOperation", json={"operationName": OP}).json()["done"] is True
+        missing = client.get("/storage/v1/b/x/o/y")
+        assert missing.status_code == 404 and cassette.misses == 1
+
+
+def test_async_replay_without_waiting():
+    path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+    _record(path)
+    cassette = Cassette(path, "replay", speed=0)
+
+    async def run():
+        async with httpx.AsyncClient(transport=cassette.async_transport(httpx.AsyncHTTPTransport())) as client:
+            r = await client.post(f"{BASE}:fetchPredictOperation", json={"operationName": OP})
+            return r.json()
+    assert asyncio.run(run())["done"] is True
+
+
+if __name__ == "__main__":
+    test_record_redacts_and_replay_follows_recorded_timing()
+    test_async_replay_without_waiting()
+    print("✅ 單元測試通過：cassette 錄製與重播正常")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證本機 Vertex AI 替身的回應格式、gs:// 物件下載與故障注入
+"""
+
+import base64
+
+from fastapi.testclient import TestClient
+
+from fake_vertex import FakeVertex, create_app, parse_distribution
+
+MODEL_URL = "/v1/projects/p/locations/us-central1/publishers/google/models/veo-3.0-fast-generate-001"
+
+
+def test_submit_then_fetch_inline_and_gcs_results():
+    fake = FakeVertex(completion="0", video_bytes=3000, seed=1)
+    with TestClient(create_app(fake)) as client:
+        name = client.post(f"{MODEL_URL}:predictLongRunning",
+                           json={"instances": [{"prompt": "x"}], "parameters": {"sampleCount": 2}}).json()["name"]
+        assert name.startswith("projects/p/locations/us-central1/publishers/google/models/veo-3.0-fast-generate-001/operations/")
+        done = client.post(f"{MODEL_URL}:fetchPredictOperation", json={"operationName": name}).json()
+        assert done["done"] is True and done["response"]["raiMediaFilteredCount"] == 0
+        videos = done["response"]["videos"]
+        assert len(videos) == 2 and base64.b64decode(videos[0]["bytesBase64Encoded"]) == fake.video
+
+        name = client.post(f"{MODEL_URL}:predictLongRunning", json={
+            "instances": [{"prompt": "x"}], "parameters": {"storageUri": "gs://out/runs"}}).json()["name"]
+        uri = client.post(f"{MODEL_URL}:fetchPredictOperation", json={"operationName": name}).json()["response"]["videos"][0]["gcsUri"]
+        path = "/storage/v1/b/out/o/" + uri[len("gs://out/"):].replace("/", "%2F")
+        assert client.get(path).json()["size"] == "3000"
+        part = client.get(path, params={"alt": "media"}, headers={"Range": "bytes=100-199"})
+        assert part.status_code == 206 and part.content == fake.video[100:200]
+
+        missing = client.post(f"{MODEL_URL}:fetchPredictOperation", json={"operationName": "nope"})
+        assert missing.status_code == 404
+
+
+def test_running_operation_and_error_injection():
+    with TestClient(create_app(FakeVertex(completion="3600"))) as client:
+        name = client.post(f"{MODEL_URL}:predictLongRunning", json={"instances": [{"prompt": "x"}]}).json()["name"]
+        assert client.post(f"{MODEL_URL}:fetchPredictOperation", json={"operationName": name}).json() == {"name": name}
+
+    fake = FakeVertex(rate_429=1.0)
+    with TestClient(create_app(fake)) as client:
+        r = client.post(f"{MODEL_URL}:predictLongRunning", json={"instances": [{"prompt": "x"}]})
+        assert r.status_code == 429 and r.json()["error"]["status"] == "RESOURCE_EXHAUSTED"
+    assert fake.stats()["injected429"] == 1 and fake.stats()["submitted"] == 0
+    assert 20 <= parse_distribution("uniform:20:60")(fake.rng) <= 60
+
+
+if __name__ == "__main__":
+    test_submit_then_fetch_inline_and_gcs_results()
+    test_running_operation_and_error_injection()
+    print("✅ 單元測試通過：Vertex AI 替身正常")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 GenerationCache 的鍵正規化、TTL 與位元組預算淘汰
+- 只使用記憶體索引（path=None）或暫存目錄，不會寫入專案目錄
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from generation_cache import GenerationCache
+
+
+def _payload(prompt: str, image: str = None, seed: int = None) -> dict:
+    instance = {"prompt": prompt}
+    if image:
+        instance["image"] = {"bytesBase64Encoded": image, "mimeType": "image/png"}
+    parameters = {"durationSeconds": 6, "resolution": "720p"}
+    if seed is not None:
+        parameters["seed"] = seed
+    return {"instances": [instance], "parameters": parameters}
+
+
+def test_key_normalizes_prompt_and_hashes_image():
+    key = GenerationCache.key
+    assert key("m", _payload("小貓  在草地上 ")) == key("m", _payload("小貓 在草地上"))
+    assert key("m", _payload("a", image="QUJD\nREVG")) == key("m", _payload("a", image="QUJDREVG"))
+    assert key("m", _payload("a", image="QUJD")) != key("m", _payload("a", image="REVG"))
+    assert key("m", _payload("a", seed=1)) != key("m", _payload("a", seed=2))
+    assert key("m", _payload("a")) != key("other", _payload("a"))
+
+
+def test_ttl_and_byte_budget():
+    cache = GenerationCache(path=None, enabled=True, ttl_seconds=60, max_bytes=250)
+    cache.put("k1", "ops/1", 100)
+    cache.put("k2", "ops/2", 100)
+    assert cache.get("k1") == "ops/1"  # k1 變成最近使用
+    cache.put("k3", "ops/3", 100)
+    assert cache.get("k2") is None
+    assert cache.get("k1") == "ops/1" and cache.get("k3") == "ops/3"
+
+    cache._index["k1"]["storedAt"] = time.time() - 61
+    assert cache.get("k1") is None
+    assert GenerationCache(path=None, enabled=False).get("k3") is None
+
+
+def test_hit_persists_used_at_at_most_once_per_window():
+    path = os.path.join(tempfile.mkdtemp(), "cache.json")
+    cache = GenerationCache(path=path, enabled=True)
+    cache.put("k1", "ops/1", 100)
+
+    def used_at():
+        with open(path) as f:
+            return json.load(f)["k1"]["usedAt"]
+
+    stored = used_at()
+    cache._saved_at -= 3600
+    time.sleep(0.01)
+    assert cache.get("k1") == "ops/1"
+    touched = used_at()
+    assert touched > stored
+    # 寫檔窗口內的命中只更新記憶體
+    assert cache.get("k1") == "ops/1" and used_at() == touched
+    assert GenerationCache(path=path, enabled=True)._load()["k1"]["usedAt"] == touched
+
+
+def test_processes_sharing_index_keep_each_others_entries():
+    path = os.path.join(tempfile.mkdtemp(), "cache.json")
+    # 兩個實例模擬執行中的 server.py 與 save_video.py CLI
+    server = GenerationCache(path=path, enabled=True)
+    cli = GenerationCache(path=path, enabled=True)
+    assert server.get("k1") is None
+
+    cli.put("k1", "ops/1", 100)
+    assert server.get("k1") == "ops/1"  # 不必重新啟動就看得到 CLI 的項目
+    server.put("k2", "ops/2", 100)
+    server._saved_at -= 3600
+    assert server.get("k2") == "ops/2"  # 命中寫回也不會蓋掉其他程序的項目
+    cli.put("k3", "ops/3", 100)
+
+    with open(path) as f:
+        assert sorted(json.load(f)) == ["k1", "k2", "k3"]
+    cli.forget("k2")
+    assert server.get("k2") is None and server.stats()["entries"] == 2
+    assert GenerationCache(path=path, enabled=True).get("k1") == "ops/1"
+
+
+if __name__ == "__main__":
+    test_key_normalizes_prompt_and_hashes_image()
+    test_ttl_and_byte_budget()
+    test_hit_persists_used_at_at_most_once_per_window()
+    test_processes_sharing_index_keep_each_others_entries()
+    print("✅ 單元測試通過：生成快取鍵與淘汰正常")
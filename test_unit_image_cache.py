@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證已編碼圖片快取依 mtime/大小失效、依位元組預算淘汰，並平行載入多張圖片
+"""
+
+import base64
+import os
+import tempfile
+
+from image_cache import EncodedImageCache
+from image_to_video import VeoImageToVideoClient
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_cache_hits_until_file_changes():
+    with tempfile.TemporaryDirectory() as d:
+        paths = [os.path.join(d, f"ref{i}.png") for i in range(3)]
+        for i, path in enumerate(paths):
+            _write(path, bytes([i]) * 300)
+        cache = EncodedImageCache(max_bytes=10_000, workers=3)
+        client = VeoImageToVideoClient("p", image_cache=cache)
+
+        encoded = cache.get_many(paths + [paths[0]])
+        assert encoded == [base64.b64encode(bytes([i]) * 300).decode() for i in (0, 1, 2, 0)]
+        assert (cache.hits, cache.misses) == (0, 3)
+        assert client.encode_image_to_base64(paths[1]) == encoded[1]
+        assert cache.hits == 1
+
+        # 修改檔案（大小改變）後重新讀取
+        _write(paths[1], b"new")
+        assert client.encode_image_to_base64(paths[1]) == base64.b64encode(b"new").decode()
+        assert cache.misses == 4
+
+
+def test_lru_eviction_respects_byte_budget():
+    with tempfile.TemporaryDirectory() as d:
+        paths = [os.path.join(d, f"ref{i}.jpg") for i in range(3)]
+        for path in paths:
+            _write(path, os.urandom(300))  # Base64 後 400 位元組
+        cache = EncodedImageCache(max_bytes=900)
+        cache.get(paths[0])
+        cache.get(paths[1])
+        cache.get(paths[0])  # paths[0] 變成最近使用
+        cache.get(paths[2])  # 超過預算：淘汰最久未用的 paths[1]
+        assert cache.stats()["images"] == 2 and cache.stats()["bytes"] == 800
+        cache.get(paths[0])
+        assert cache.hits == 2
+        cache.get(paths[1])
+        assert cache.misses == 4
+
+
+if __name__ == "__main__":
+    test_cache_hits_until_file_changes()
+    test_lru_eviction_respects_byte_budget()
+    print("✅ 單元測試通過：已編碼圖片快取正常")
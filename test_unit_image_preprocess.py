@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證目標尺寸計算，以及圖片縮放補邊、EXIF 轉正、重新壓縮與快取
+- 圖片相關的案例需要 Pillow（測試依賴）；未安裝時以 pytest 的 skip 明確標示
+"""
+
+import asyncio
+import base64
+import io
+
+import pytest
+
+from image_preprocess import ImageNormalizer, target_size
+
+
+def test_target_size_follows_aspect_ratio_and_resolution():
+    assert target_size("16:9", "720p") == (1280, 720)
+    assert target_size("9:16", "720p") == (720, 1280)
+    assert target_size("16:9", "1080p") == (1920, 1080)
+    assert target_size("16:9", "480p") == (854, 480)
+    assert target_size("1:1", "720p") == (720, 720)
+    for bad in ("16:0", "0:9"):
+        with pytest.raises(ValueError):
+            target_size(bad, "720p")
+
+
+def test_payload_without_image_ignores_aspect_ratio():
+    # 沒有圖片時不計算目標尺寸（也就不會因奇怪的 aspectRatio 失敗）
+    payload = {"instances": [{"prompt": "x"}], "parameters": {"aspectRatio": "16:0"}}
+    normalizer = ImageNormalizer()
+    normalizer.enabled = True  # 不論是否安裝 Pillow 都走正規化的流程
+    assert asyncio.run(normalizer.normalize_payload(payload)) is payload
+    disabled = {"instances": [{"image": {"bytesBase64Encoded": "aGk=", "mimeType": "image/png"}}]}
+    assert asyncio.run(ImageNormalizer(enabled=False).normalize_payload(disabled)) is disabled
+
+
+def test_large_png_is_letterboxed_to_small_jpeg():
+    Image = pytest.importorskip("PIL.Image")
+
+    src = io.BytesIO()
+    Image.effect_noise((3000, 3000), 64).convert("RGB").save(src, "PNG")
+    encoded = base64.b64encode(src.getvalue()).decode("ascii")
+    payload = {"instances": [{"image": {"bytesBase64Encoded": encoded, "mimeType": "image/png"}}],
+               "parameters": {"aspectRatio": "16:9", "resolution": "720p"}}
+
+    normalizer = ImageNormalizer(enabled=True, workers=1)
+    try:
+        out = asyncio.run(normalizer.normalize_payload(payload))["instances"][0]["image"]
+        again = asyncio.run(normalizer.normalize(encoded, 1280, 720))
+    finally:
+        normalizer.close()
+    assert out["mimeType"] == "image/jpeg"
+    assert len(out["bytesBase64Encoded"]) < len(encoded) / 5
+    with Image.open(io.BytesIO(base64.b64decode(out["bytesBase64Encoded"]))) as result:
+        assert result.size == (1280, 720)
+        # 正方形圖片放進 16:9：左右補黑邊
+        assert result.getpixel((5, 360)) == (0, 0, 0)
+    assert again == out["bytesBase64Encoded"]
+    assert normalizer.hits == 1 and normalizer.misses == 1
+
+
+def test_exif_orientation_is_applied_before_letterboxing():
+    Image = pytest.importorskip("PIL.Image")
+    from image_preprocess import _normalize_image
+
+    # 感光元件方向 400x300，EXIF 標示需旋轉 90 度（直拍照片），轉正後應為 300x400
+    src = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new("RGB", (400, 300), (255, 255, 255)).save(src, "JPEG", exif=exif)
+    out = _normalize_image(src.getvalue(), 720, 1280, 90)
+    with Image.open(io.BytesIO(out)) as result:
+        assert result.size == (720, 1280)
+        # 轉正後填滿寬度、高 960：上下各補 160 的黑邊；沒轉正時高只有 540，y=300 會是黑邊
+        assert result.getpixel((360, 5))[0] < 30
+        assert result.getpixel((360, 300))[0] > 220 and result.getpixel((5, 640))[0] > 220
+
+
+if __name__ == "__main__":
+    test_target_size_follows_aspect_ratio_and_resolution()
+    test_payload_without_image_ignores_aspect_ratio()
+    test_large_png_is_letterboxed_to_small_jpeg()
+    test_exif_orientation_is_applied_before_letterboxing()
+    print("✅ 單元測試通過：圖片正規化正常")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 multipart 上傳的圖片串流成與 JSON 上傳相同的上游本文，且生成快取鍵一致
+"""
+
+import asyncio
+import base64
+import io
+import json
+
+import image_upload
+from generation_cache import GenerationCache
+from image_upload import UploadedImage, request_body
+
+
+def _payload(image):
+    return {"instances": [{"prompt": "貓", "image": {"bytesBase64Encoded": image, "mimeType": "image/png"}}],
+            "parameters": {"durationSeconds": 8}}
+
+
+async def _read(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+def test_streamed_body_matches_json_upload():
+    raw = bytes(range(256)) * 41 + b"x"  # 長度不是 3 的倍數，測試最後一段的 padding
+    saved = image_upload.ENCODE_CHUNK_SIZE
+    image_upload.ENCODE_CHUNK_SIZE = 99
+    try:
+        image = asyncio.run(UploadedImage.from_file(io.BytesIO(raw), "image/png"))
+        body = request_body(_payload(image))
+        sent = asyncio.run(_read(body["content"]))
+        # 重新排隊送出時可以再產生一次相同的本文
+        again = asyncio.run(_read(request_body(_payload(image))["content"]))
+    finally:
+        image_upload.ENCODE_CHUNK_SIZE = saved
+
+    encoded = base64.b64encode(raw).decode("ascii")
+    assert json.loads(sent) == _payload(encoded)
+    assert sent == again
+    assert int(body["headers"]["Content-Length"]) == len(sent)
+    assert image.size == len(raw)
+    assert GenerationCache.key("m", _payload(image)) == GenerationCache.key("m", _payload(encoded))
+    assert request_body(_payload(encoded)) == {"json": _payload(encoded)}
+
+
+if __name__ == "__main__":
+    test_streamed_body_matches_json_upload()
+    print("✅ 單元測試通過：multipart 圖片串流編碼正常")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證工作歷史的寫入、推算欄位、分組百分位數與時間趨勢
+"""
+
+import os
+import tempfile
+
+from job_history import JobHistory, parse_since, summarize, trend
+
+
+def _history(entries):
+    history = JobHistory(os.path.join(tempfile.mkdtemp(), "history.jsonl"))
+    for entry in entries:
+        history.record(entry)
+    return history
+
+
+def test_record_derives_durations_and_groups_percentiles():
+    entries = []
+    for i in range(10):
+        entries.append({"state": "done", "model": "fast", "resolution": "720p", "submittedAt": 1000.0 + i,
+                        "firstPollAt": 1010.0 + i, "doneAt": 1040.0 + i + i, "pollCount": 3})
+    entries.append({"state": "done", "model": "quality", "resolution": "1080p", "submittedAt": 1000.0, "doneAt": 1100.0})
+    entries.append({"state": "failed", "model": "fast", "resolution": "720p", "submittedAt": 1000.0, "doneAt": 1005.0})
+    history = _history(entries)
+    recorded = list(history.entries())
+    assert recorded[0]["timeToDone"] == 40.0 and recorded[0]["timeToFirstPoll"] == 10.0
+    assert "timeToFirstPoll" not in recorded[10]
+
+    rows = summarize(recorded, ["model", "resolution"])
+    assert rows[0]["group"] == {"model": "fast", "resolution": "720p"} and rows[0]["count"] == 10
+    assert rows[0]["p50"] == 44.0 and rows[0]["p99"] == 49.0 and rows[0]["max"] == 49.0
+    assert rows[1]["count"] == 1 and rows[1]["p95"] == 100.0
+    assert summarize(recorded, ["model"], state=None)[0]["count"] == 11
+
+
+def test_trend_and_since():
+    history = _history([
+        {"state": "done", "submittedAt": 0.0, "doneAt": 30.0},
+        {"state": "failed", "submittedAt": 10.0, "doneAt": 20.0},
+        {"state": "done", "submittedAt": 86400.0 + 5, "doneAt": 86400.0 + 65},
+    ])
+    rows = trend(history.entries(), bucket_seconds=86400)
+    assert [(r["start"], r["jobs"], r["failureRate"], r["p50"]) for r in rows] == [(0, 2, 0.5, 30.0), (86400, 1, 0.0, 60.0)]
+    assert len(list(history.entries(since=86400))) == 1
+    assert parse_since("2d", now=200000.0) == 200000.0 - 2 * 86400
+
+
+if __name__ == "__main__":
+    test_record_derives_durations_and_groups_percentiles()
+    test_trend_and_since()
+    print("✅ 單元測試通過：工作歷史與延遲分析正常")
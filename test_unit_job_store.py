@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 JobStore 批次寫入後，重新開啟資料庫仍能找回未完成的工作與模型
+- 使用暫存目錄中的 SQLite 檔案
+"""
+
+import os
+import tempfile
+
+from job_store import DONE, JobStore
+
+
+def test_unfinished_jobs_survive_reopen():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "jobs.sqlite3")
+        store = JobStore(path, flush_interval=0.01)
+        store.record_submitted("ops/text", "veo-3.0-fast-generate-001", {"parameters": {"durationSeconds": 6}})
+        store.record_submitted("ops/image", "veo-3.0-generate-001", {"parameters": {"durationSeconds": 8}})
+        store.record_state("ops/text", DONE)
+        store.close()
+
+        reopened = JobStore(path)
+        jobs = reopened.unfinished()
+        assert [j["operationName"] for j in jobs] == ["ops/image"]
+        assert jobs[0]["params"]["parameters"]["durationSeconds"] == 8
+        assert reopened.model_for("ops/text") == "veo-3.0-fast-generate-001"
+        assert reopened.model_for("ops/unknown") is None
+        assert reopened.stats()["jobs"] == {"done": 1, "running": 1}
+        reopened.close()
+
+
+def test_writes_are_batched_into_few_transactions():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JobStore(os.path.join(tmp, "jobs.sqlite3"), flush_interval=0.05)
+        for i in range(100):
+            store.record_submitted(f"ops/{i}", "model", {})
+        store.close()
+        assert store.flushes <= 3
+
+
+if __name__ == "__main__":
+    test_unfinished_jobs_survive_reopen()
+    test_writes_are_batched_into_few_transactions()
+    print("✅ 單元測試通過：工作表持久化與批次寫入正常")
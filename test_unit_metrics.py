@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證指標以 Prometheus 文字格式輸出，且上游回應狀態碼會被計數
+- 以 httpx.MockTransport 模擬 Vertex AI 回應，不會連線到外部
+"""
+
+import httpx
+
+import upstream
+from metrics import UPSTREAM_RESPONSES, Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("test_seconds", "Test latency", ("model",), buckets=(0.1, 1))
+    latency.observe(0.05, model="m")
+    latency.observe(0.5, model="m")
+    latency.observe(5, model="m")
+    registry.gauge("test_inflight", "Test gauge", lambda: 3)
+    calls = registry.counter("test_total", "Test counter", ("status",))
+    calls.inc(status=200)
+    calls.inc(2, status=200)
+
+    text = registry.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{model="m",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{model="m",le="1"} 2' in text
+    assert 'test_seconds_bucket{model="m",le="+Inf"} 3' in text
+    assert 'test_seconds_sum{model="m"} 5.55' in text
+    assert 'test_seconds_count{model="m"} 3' in text
+    assert "test_inflight 3" in text
+    assert 'test_total{status="200"} 3' in text
+
+
+def test_upstream_status_codes_are_counted():
+    host = "metrics-test.example"
+    statuses = iter([503, 200])
+    saved = upstream._client
+    upstream._client = httpx.Client(transport=httpx.MockTransport(lambda req: httpx.Response(next(statuses))))
+    try:
+        upstream.post(f"https://{host}/v1/op", headers={}, retry=False)
+        upstream.post(f"https://{host}/v1/op", headers={}, retry=False)
+    finally:
+        upstream._client.close()
+        upstream._client = saved
+    assert UPSTREAM_RESPONSES.value(host=host, status=503) == 1
+    assert UPSTREAM_RESPONSES.value(host=host, status=200) == 1
+
+
+if __name__ == "__main__":
+    test_histogram_buckets_are_cumulative()
+    test_upstream_status_codes_are_counted()
+    print("✅ 單元測試通過：指標輸出與上游狀態碼計數正常")
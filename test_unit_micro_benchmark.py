@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證微基準測試能以極小的合成資料跑完所有案例，且退步判定正確
+"""
+
+from micro_benchmark import CASES, find_regressions, run_benchmarks
+
+TINY = {"tiny": {"video": 3000, "image": 500}}
+
+
+def test_all_cases_run_on_tiny_payloads():
+    results = run_benchmarks(list(CASES), ["tiny"], repeat=1, size_table=TINY)
+    assert set(results) == {f"{name}/tiny" for name in CASES}
+    for r in results.values():
+        assert r["inputBytes"] > 0 and r["mbPerSecond"] > 0 and r["peakMemoryBytes"] >= 0
+
+
+def test_find_regressions_uses_threshold():
+    baselines = {"a/480p": {"mbPerSecond": 100, "peakMemoryBytes": 1000}}
+    ok = {"a/480p": {"mbPerSecond": 80, "peakMemoryBytes": 1200}, "new/480p": {"mbPerSecond": 1, "peakMemoryBytes": 1}}
+    assert find_regressions(ok, baselines, 0.25) == []
+    slow = {"a/480p": {"mbPerSecond": 70, "peakMemoryBytes": 1300}}
+    regressions = find_regressions(slow, baselines, 0.25)
+    assert len(regressions) == 2 and regressions[0].startswith("a/480p: 吞吐量")
+
+
+if __name__ == "__main__":
+    test_all_cases_run_on_tiny_payloads()
+    test_find_regressions_uses_threshold()
+    print("✅ 單元測試通過：微基準測試案例與退步判定正常")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 OperationPoller 對同一操作只發出一份上游查詢，並分送給所有等待者
+- 使用假的 fetch 函式，不會呼叫真正的 Vertex AI
+"""
+
+import asyncio
+import threading
+
+from operation_poller import OperationPoller
+from poll_scheduler import AdaptivePollScheduler
+
+
+def test_waiters_share_one_upstream_poll_per_tick():
+    calls = []
+
+    async def fake_fetch(model_id, name):
+        calls.append(name)
+        return {"ok": True, "done": calls.count(name) >= 3, "response": {"name": name}}
+
+    async def scenario():
+        poller = OperationPoller(fake_fetch, interval=0.01)
+        try:
+            results = await asyncio.gather(
+                *[poller.wait("ops/a", "model", timeout=5) for _ in range(20)],
+                *[poller.wait("ops/b", "model", timeout=5) for _ in range(5)],
+                poller.poll("ops/a", "model"),
+            )
+        finally:
+            await poller.stop()
+        return results
+
+    results = asyncio.run(scenario())
+
+    # 20 個等待者 + 1 個輪詢端點，但每個操作只查詢到完成為止
+    assert calls.count("ops/a") == 3
+    assert calls.count("ops/b") == 3
+    assert all(r["done"] and r["pollCount"] == 3 for r in results[:25])
+
+
+def test_wait_returns_none_on_timeout_and_error_is_not_cached():
+    calls = []
+
+    async def fake_fetch(model_id, name):
+        calls.append(name)
+        if name == "ops/broken":
+            return {"ok": False, "status": 500, "error": "boom"}
+        return {"ok": True, "done": False}
+
+    async def scenario():
+        poller = OperationPoller(fake_fetch, interval=0.01)
+        try:
+            pending = await poller.wait("ops/slow", "model", timeout=0.05)
+            first = await poller.poll("ops/broken", "model")
+            second = await poller.poll("ops/broken", "model")
+        finally:
+            await poller.stop()
+        return pending, first, second
+
+    pending, first, second = asyncio.run(scenario())
+    assert pending is None
+    assert first["status"] == 500 and second["status"] == 500
+    assert calls.count("ops/broken") == 2
+
+
+def test_follow_operation_survives_transient_errors():
+    calls = []
+
+    async def fake_fetch(model_id, name):
+        calls.append(name)
+        if name == "ops/gone":
+            return {"ok": False, "status": 404, "error": "not found"}
+        if calls.count(name) <= 2:
+            return {"ok": False, "status": 503, "error": "熔斷中"}
+        return {"ok": True, "done": True, "response": {"name": name}}
+
+    async def scenario():
+        poller = OperationPoller(fake_fetch, interval=0.005, idle_seconds=0)
+        try:
+            # 沒有等待者的 follow 操作（例如 /generate、/batch 送出的工作）
+            st = poller.track("ops/job", "model", context={"follow": True})
+            gone = poller.track("ops/gone", "model", context={"follow": True})
+            await asyncio.sleep(0.2)
+            return st, gone, poller.get("ops/job"), poller.get("ops/gone")
+        finally:
+            await poller.stop()
+
+    st, gone, tracked, dropped = asyncio.run(scenario())
+    assert calls.count("ops/job") == 3 and st.final.result()["done"] is True
+    assert tracked is st and st.errors == 0
+    # 404 是終止性錯誤：只查一次就放棄
+    assert calls.count("ops/gone") == 1 and dropped is None and gone.final.result()["status"] == 404
+
+
+def test_poll_does_not_wait_for_deferred_first_check():
+    calls = []
+
+    async def fake_fetch(model_id, name):
+        calls.append(name)
+        return {"ok": True, "done": False}
+
+    async def scenario():
+        poller = OperationPoller(fake_fetch, interval=60)
+        try:
+            # 剛送出的操作：第一次檢查排在 60 秒後
+            poller.track("ops/new", "model", context={"submitted": True})
+            return await asyncio.wait_for(poller.poll("ops/new", "model"), 1)
+        finally:
+            await poller.stop()
+
+    result = asyncio.run(scenario())
+    assert result["ok"] and result["done"] is False and result["pollCount"] == 0
+    assert calls == []
+
+
+def test_completion_history_is_written_off_the_event_loop():
+    recorded = []
+
+    class RecordingScheduler(AdaptivePollScheduler):
+        def record_completion(self, model_id, resolution, duration, seconds):
+            recorded.append((threading.current_thread() is threading.main_thread(), resolution, duration))
+            super().record_completion(model_id, resolution, duration, seconds)
+
+    async def fake_fetch(model_id, name):
+        return {"ok": True, "done": True, "response": {}}
+
+    async def scenario():
+        scheduler = RecordingScheduler(path=None, min_interval=0.001, default_expected=0)
+        poller = OperationPoller(fake_fetch, scheduler=scheduler)
+        try:
+            poller.track("ops/done", "model", context={"submitted": True, "resolution": "1080p", "durationSeconds": 8})
+            result = await poller.wait("ops/done", "model", timeout=1)
+            await asyncio.sleep(0.05)
+            return result, scheduler.samples("model", "1080p", 8)
+        finally:
+            await poller.stop()
+
+    result, samples = asyncio.run(scenario())
+    assert result["done"] and len(samples) == 1
+    assert recorded == [(False, "1080p", 8)]
+
+
+if __name__ == "__main__":
+    test_waiters_share_one_upstream_poll_per_tick()
+    test_wait_returns_none_on_timeout_and_error_is_not_cached()
+    test_follow_operation_survives_transient_errors()
+    test_poll_does_not_wait_for_deferred_first_check()
+    test_completion_history_is_written_off_the_event_loop()
+    print("✅ 單元測試通過：輪詢多工器去重與分送正常")
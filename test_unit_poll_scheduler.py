@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 AdaptivePollScheduler 依歷史完成時間調整輪詢間隔與剩餘時間預估
+- 歷史只保存在記憶體（path=None）或暫存目錄，不會寫入專案目錄
+"""
+
+import os
+import tempfile
+
+from poll_scheduler import AdaptivePollScheduler
+
+
+def test_sparse_early_dense_near_expected_finish():
+    scheduler = AdaptivePollScheduler(path=None, min_interval=2, max_interval=30)
+    for seconds in [58, 60, 61, 62, 63, 64, 65, 66, 70, 80]:
+        scheduler.record_completion("veo-3.0-fast-generate-001", "720p", 6, seconds)
+
+    early = scheduler.next_interval(0, "veo-3.0-fast-generate-001", "720p", 6)
+    near = scheduler.next_interval(62, "veo-3.0-fast-generate-001", "720p", 6)
+    overdue = scheduler.next_interval(200, "veo-3.0-fast-generate-001", "720p", 6)
+
+    assert early == 30  # 第 10 百分位 60 秒，先等一半
+    assert near == 2
+    assert 2 < overdue <= 30
+
+    assert scheduler.estimate_remaining(0, "veo-3.0-fast-generate-001", "720p", 6) == 63  # 中位數
+    assert scheduler.estimate_remaining(500, "veo-3.0-fast-generate-001", "720p", 6) == 0
+
+
+def test_falls_back_to_model_history_then_default():
+    scheduler = AdaptivePollScheduler(path=None, min_interval=3, max_interval=30, default_expected=60)
+    # 沒有任何歷史：使用預設值
+    assert scheduler.estimate_remaining(0, "veo-3.0-generate-001", "1080p", 8) == 60
+
+    scheduler.record_completion("veo-3.0-generate-001", "720p", 8, 120)
+    # 不同解析度沒有樣本時改用同模型的樣本
+    assert scheduler.estimate_remaining(0, "veo-3.0-generate-001", "1080p", 8) == 120
+
+
+def test_processes_sharing_history_keep_each_others_samples():
+    path = os.path.join(tempfile.mkdtemp(), "history.jsonl")
+    # 兩個實例模擬 server.py 與 CLI 兩個程序；都先載入過（空的）歷史
+    server = AdaptivePollScheduler(path=path, refresh_seconds=0)
+    cli = AdaptivePollScheduler(path=path, refresh_seconds=0)
+    assert server.samples("veo") == [] and cli.samples("veo") == []
+
+    server.record_completion("veo", "720p", 6, 60)
+    cli.record_completion("veo", "720p", 6, 90)
+    server.record_completion("veo", "1080p", 8, 120)
+
+    assert server.samples("veo", "720p", 6) == [60.0, 90.0]
+    assert cli.samples("veo", "720p", 6) == [60.0, 90.0]
+    assert cli.samples("veo", "1080p", 8) == [120.0]
+    # 新程序從檔案讀到全部樣本
+    assert sorted(AdaptivePollScheduler(path=path).samples("veo")) == [60.0, 90.0, 120.0]
+
+
+if __name__ == "__main__":
+    test_sparse_early_dense_near_expected_finish()
+    test_falls_back_to_model_history_then_default()
+    test_processes_sharing_history_keep_each_others_samples()
+    print("✅ 單元測試通過：輪詢排程與剩餘時間預估正常")
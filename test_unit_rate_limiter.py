@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 RateLimiter 依成本排隊等待，且各模型的權杖桶互不影響
+- 使用很高的補充速率，讓測試在數十毫秒內完成
+"""
+
+import asyncio
+import time
+
+from rate_limiter import RateLimiter, job_cost
+
+
+def test_job_cost_weights_duration_resolution_and_samples():
+    assert job_cost({"durationSeconds": 8, "resolution": "720p", "sampleCount": 1}) == 8
+    assert job_cost({"durationSeconds": 8, "resolution": "1080p", "sampleCount": 2}) == 36
+    assert job_cost({"durationSeconds": 6, "resolution": "480p"}) == 3
+
+
+def test_queued_jobs_wait_for_capacity_per_model():
+    # 每秒補充 100 單位，容量 10 單位
+    limiter = RateLimiter(units_per_minute=6000, burst=10)
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*[limiter.acquire("a", {"durationSeconds": 10}) for _ in range(4)])
+        elapsed_a = time.monotonic() - started
+        started = time.monotonic()
+        await limiter.acquire("b", {"durationSeconds": 10})
+        return elapsed_a, time.monotonic() - started
+
+    elapsed_a, elapsed_b = asyncio.run(scenario())
+    # 第一個工作用掉突發容量，其餘 3 個各等 0.1 秒
+    assert 0.25 < elapsed_a < 1.0
+    assert elapsed_b < 0.05
+    stats = limiter.stats()
+    assert stats["a"]["granted"] == 4 and stats["b"]["granted"] == 1
+
+    limiter.throttled("b")
+    assert limiter.stats()["b"]["throttled"] == 1
+
+
+if __name__ == "__main__":
+    test_job_cost_weights_duration_resolution_and_samples()
+    test_queued_jobs_wait_for_capacity_per_model()
+    print("✅ 單元測試通過：成本加權限流正常")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 ResultStore 封存的大小上限與最近使用淘汰
+- 使用暫存目錄與隨機位元組，不會動到專案內的 veo_results
+"""
+
+import base64
+import os
+import tempfile
+import time
+
+from result_store import ResultStore
+
+
+def _response(size: int) -> dict:
+    return {"videos": [{"bytesBase64Encoded": base64.b64encode(os.urandom(size)).decode(), "mimeType": "video/mp4"}]}
+
+
+def test_evicts_least_recently_used_over_size_limit():
+    with tempfile.TemporaryDirectory() as root:
+        store = ResultStore(root, max_bytes=2500)
+        first = store.store("ops/1", _response(1000))
+        assert first["videos"][0]["bytes"] == 1000 and "bytesBase64Encoded" not in first["videos"][0]
+        time.sleep(0.02)
+        store.store("ops/2", _response(1000))
+        time.sleep(0.02)
+        # 讀取 ops/1 使它變成最近使用
+        assert store.get_sample("ops/1", 0) is not None
+        time.sleep(0.02)
+        store.store("ops/3", _response(1000))
+
+        assert store.load("ops/2") is None
+        assert store.load("ops/1") is not None
+        assert store.latest() == "ops/1"
+        sample = store.get_sample("ops/3", 0)
+        assert os.path.getsize(sample["path"]) == 1000
+
+
+def test_store_is_idempotent_and_empty_archive_has_no_latest():
+    with tempfile.TemporaryDirectory() as root:
+        store = ResultStore(root, max_bytes=0)
+        assert store.latest() is None
+        first = store.store("ops/1", _response(10))
+        again = store.store("ops/1", _response(20))
+        assert again == first
+
+
+class _FakeDownloader:
+    """把 gcsUri 寫成固定內容的檔案，不會連線到 GCS"""
+
+    def download(self, uri, path):
+        data = uri.encode()
+        with open(path, "wb") as f:
+            f.write(data)
+        return {"bytes": len(data), "etag": uri}
+
+
+def test_mixed_base64_and_gcs_samples_get_distinct_files():
+    with tempfile.TemporaryDirectory() as root:
+        store = ResultStore(root, max_bytes=0, downloader=_FakeDownloader())
+        response = {"videos": [
+            {"gcsUri": "gs://bucket/a.mp4"},
+            {"bytesBase64Encoded": base64.b64encode(b"inline video").decode()},
+            {"gcsUri": "gs://bucket/b.mp4"},
+        ]}
+        videos = store.store("ops/mixed", response)["videos"]
+        assert sorted(v["sampleIndex"] for v in videos) == [0, 1, 2]
+        contents = {v["sampleIndex"]: open(store.get_sample("ops/mixed", v["sampleIndex"])["path"], "rb").read()
+                    for v in videos}
+        assert contents[videos[0]["sampleIndex"]] == b"gs://bucket/a.mp4"
+        assert contents[videos[1]["sampleIndex"]] == b"inline video"
+        assert contents[videos[2]["sampleIndex"]] == b"gs://bucket/b.mp4"
+
+
+def test_empty_base64_payload_is_skipped():
+    with tempfile.TemporaryDirectory() as root:
+        store = ResultStore(root, max_bytes=0)
+        response = {"videos": [
+            {"bytesBase64Encoded": "", "mimeType": "video/mp4"},
+            {"bytesBase64Encoded": base64.b64encode(b"video").decode(), "mimeType": "video/mp4"},
+        ]}
+        empty, video = store.store("ops/empty", response)["videos"]
+        assert empty == {"mimeType": "video/mp4"}
+        assert video["bytes"] == 5 and store.get_sample("ops/empty", video["sampleIndex"]) is not None
+
+
+if __name__ == "__main__":
+    test_evicts_least_recently_used_over_size_limit()
+    test_store_is_idempotent_and_empty_archive_has_no_latest()
+    test_mixed_base64_and_gcs_samples_get_distinct_files()
+    test_empty_base64_payload_is_skipped()
+    print("✅ 單元測試通過：結果封存淘汰與讀取正常")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證上游重試只發生在安全的情況，且熔斷器在連續失敗後快速失敗
+- 以 httpx.MockTransport 模擬 Vertex AI 回應，不會連線到外部
+"""
+
+import time
+
+import httpx
+
+import upstream
+from text_to_video import VeoAPIClient
+from retry_policy import CircuitBreaker, CircuitOpenError, default_breakers, default_policy, retry_after_seconds
+
+
+def _with_transport(handler, fn):
+    saved = (upstream._client, default_policy.base_delay, default_policy.max_delay)
+    upstream._client = httpx.Client(transport=httpx.MockTransport(handler))
+    default_policy.base_delay, default_policy.max_delay = 0.001, 0.01
+    try:
+        return fn()
+    finally:
+        upstream._client.close()
+        upstream._client, default_policy.base_delay, default_policy.max_delay = saved
+
+
+def test_poll_retries_5xx_but_submit_does_not():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) < 3:
+            return httpx.Response(500, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"done": False})
+
+    url = "https://retry-test.example/v1/op:fetchPredictOperation"
+    r = _with_transport(handler, lambda: upstream.post(url, headers={}, json={}, idempotent=True))
+    assert r.status_code == 200 and len(calls) == 3
+
+    calls.clear()
+    r = _with_transport(handler, lambda: upstream.post(url, headers={}, json={}))
+    assert r.status_code == 500 and len(calls) == 1
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    try:
+        breaker.check()
+        assert False, "熔斷中應該拋出 CircuitOpenError"
+    except CircuitOpenError:
+        pass
+    assert breaker.stats()["state"] == "open"
+
+    breaker.reset_seconds = 0
+    assert breaker.state == "half-open"
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_half_open_breaker_admits_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - 61
+    breaker.check()
+    try:
+        breaker.check()
+        assert False, "試探請求結果出來前應該拒絕其他請求"
+    except CircuitOpenError:
+        pass
+
+    # 試探失敗：重新冷卻
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.opened_at = time.monotonic() - 61
+    breaker.check()
+    breaker.record_success()
+    breaker.check()
+    breaker.check()
+    assert breaker.state == "closed" and breaker.rejected == 1
+
+
+def test_open_breaker_fails_fast_without_request():
+    calls = []
+    url = "https://breaker-test.example/v1/op"
+    breaker = default_breakers.get("breaker-test.example")
+    breaker.opened_at, breaker.failures = time.monotonic(), breaker.failure_threshold
+    try:
+        _with_transport(lambda req: calls.append(req) or httpx.Response(200), lambda: upstream.post(url, headers={}))
+        assert False, "熔斷中應該拋出 CircuitOpenError"
+    except CircuitOpenError:
+        pass
+    finally:
+        breaker.record_success()
+    assert calls == []
+    assert retry_after_seconds({"retry-after": "7"}) == 7.0
+
+
+def test_wait_for_completion_retries_transient_but_raises_permanent_errors():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        # 第一輪（含 upstream 的重試）都是 503，之後操作名稱無效
+        return httpx.Response(503 if len(calls) <= default_policy.max_attempts else 404, json={"error": {}})
+
+    client = VeoAPIClient("p")
+    client.get_access_token = lambda: "token"
+    started = time.time()
+    try:
+        _with_transport(handler, lambda: client.wait_for_completion("ops/bad", "veo", max_wait_time=30, check_interval=0.01))
+        assert False, "404 應該直接拋出"
+    except upstream.UpstreamStatusError as e:
+        assert e.status == 404
+    assert len(calls) == default_policy.max_attempts + 1 and time.time() - started < 5
+    assert upstream.is_transient_error(CircuitOpenError("open")) and not upstream.is_transient_error(ValueError())
+
+
+if __name__ == "__main__":
+    test_poll_retries_5xx_but_submit_does_not()
+    test_breaker_opens_after_consecutive_failures()
+    test_half_open_breaker_admits_a_single_probe()
+    test_open_breaker_fails_fast_without_request()
+    test_wait_for_completion_retries_transient_but_raises_permanent_errors()
+    print("✅ 單元測試通過：重試策略與熔斷器正常")
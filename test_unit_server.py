@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 server.py 的端點（SSE 進度串流、影片結果的 Range 與 ETag、/metrics）
+- 以假的 fetch 或本機 Vertex AI 替身（fake_vertex）取代上游，工作表與封存放在記憶體或暫存目錄，
+  不會連線到外部
+"""
+
+import asyncio
+import base64
+import json
+import os
+import tempfile
+
+import httpx
+from fastapi.testclient import TestClient
+
+import server
+import upstream
+from fake_vertex import FakeVertex, create_app
+from job_history import JobHistory
+from job_store import JobStore
+from operation_poller import OperationPoller
+from result_store import ResultStore
+
+OP = "projects/p/locations/us-central1/publishers/google/models/veo-3.0-fast-generate-001/operations/1"
+
+
+def _with_server(fetch, fn):
+    """以假的輪詢與暫存的工作表、封存執行 fn(client)；不觸發 lifespan"""
+    saved = (server.poller, server.job_store, server.result_store)
+    server.poller = OperationPoller(fetch, interval=0.01)
+    server.job_store = JobStore(":memory:")
+    server.result_store = ResultStore(tempfile.mkdtemp(), max_bytes=0)
+    try:
+        return fn(TestClient(server.app))
+    finally:
+        server.job_store.close()
+        server.poller, server.job_store, server.result_store = saved
+
+
+def _events(lines):
+    """把 SSE 文字行解析成 (event, data) 列表（略過心跳註解）"""
+    events, event = [], None
+    for line in lines:
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            events.append((event, json.loads(line[len("data: "):])))
+    return events
+
+
+def test_operation_events_stream_progress_until_done():
+    calls = []
+
+    async def fake_fetch(model_id, name):
+        calls.append(model_id)
+        if len(calls) < 3:
+            return {"ok": True, "done": False}
+        return {"ok": True, "done": True, "response": {"videos": [{"url": "/api/veo/results/x/0"}]}}
+
+    def run(client):
+        with client.stream("GET", f"/api/veo/operations/{OP}/events") as r:
+            assert r.headers["content-type"].startswith("text/event-stream")
+            events = _events(r.iter_lines())
+        return events, server.poller.get(OP)
+
+    events, st = _with_server(fake_fetch, run)
+    assert [e for e, _ in events] == ["submitted", "running", "running", "done"]
+    assert events[0][1]["operationName"] == OP and events[0][1]["pollCount"] == 0
+    assert [d["pollCount"] for _, d in events[1:]] == [1, 2, 3]
+    assert events[-1][1]["resultUrl"] == f"/api/veo/operations/{OP}"
+    assert events[-1][1]["videoUrls"] == ["/api/veo/results/x/0"]
+    # 模型由操作名稱解析；串流結束後取消訂閱
+    assert calls[0] == "veo-3.0-fast-generate-001" and st.subscribers == []
+
+
+def test_operation_events_error_and_disconnect_cleanup():
+    async def failing_fetch(model_id, name):
+        return {"ok": False, "status": 404, "error": "not found"}
+
+    def run_error(client):
+        with client.stream("GET", f"/api/veo/operations/{OP}/events") as r:
+            return _events(r.iter_lines())
+
+    events = _with_server(failing_fetch, run_error)
+    assert [e for e, _ in events] == ["submitted", "error"] and events[-1][1]["status"] == 404
+
+    async def running_fetch(model_id, name):
+        return {"ok": True, "done": False}
+
+    def run_disconnect(client):
+        # TestClient 會讀完整個回應，斷線改為直接關閉 StreamingResponse 使用的產生器
+        async def scenario():
+            events = server._operation_events(OP)
+            try:
+                assert (await events.__anext__()).startswith("event: submitted")
+                assert (await events.__anext__()).startswith("event: running")
+                st = server.poller.get(OP)
+                subscribed = len(st.subscribers)
+            finally:
+                await events.aclose()
+                await server.poller.stop()
+            return subscribed, st
+        return asyncio.run(scenario())
+
+    subscribed, st = _with_server(running_fetch, run_disconnect)
+    assert subscribed == 1
+    # 用戶端中途斷線：訂閱被移除，poller 不會替已離開的連線排隊結果
+    assert st.subscribers == []
+
+
+def test_result_supports_range_and_etag():
+    video = os.urandom(1000)
+
+    async def unused_fetch(model_id, name):
+        raise AssertionError("結果端點不應查詢上游")
+
+    def run(client):
+        stored = server.result_store.store(OP, {"videos": [{"bytesBase64Encoded": base64.b64encode(video).decode()}]})
+        url = f"/api/veo/results/{OP}/0"
+        full = client.get(url)
+        part = client.get(url, headers={"Range": "bytes=100-199"})
+        tail = client.get(url, headers={"Range": "bytes=-10"})
+        cached = client.get(url, headers={"If-None-Match": full.headers["etag"]})
+        stale = client.get(url, headers={"If-None-Match": '"other"'})
+        missing = client.get(f"/api/veo/results/{OP}/1")
+        return stored, full, part, tail, cached, stale, missing
+
+    stored, full, part, tail, cached, stale, missing = _with_server(unused_fetch, run)
+    etag = f'"{stored["videos"][0]["etag"]}"'
+    assert full.status_code == 200 and full.content == video
+    assert full.headers["content-type"] == "video/mp4" and full.headers["content-length"] == "1000"
+    assert full.headers["etag"] == etag and full.headers["accept-ranges"] == "bytes"
+    assert part.status_code == 206 and part.content == video[100:200]
+    assert part.headers["content-range"] == "bytes 100-199/1000" and part.headers["content-length"] == "100"
+    assert tail.status_code == 206 and tail.content == video[-10:]
+    assert cached.status_code == 304 and cached.content == b"" and cached.headers["etag"] == etag
+    assert stale.status_code == 200 and stale.content == video
+    assert missing.status_code == 404
+
+
+class _StaticToken:
+    async def aauth_headers(self):
+        return {"Authorization": "Bearer test"}
+
+
+def _scrape(client):
+    """抓取 /metrics，回傳 {樣本名稱含標籤: 數值}"""
+    r = client.get("/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in r.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return r.text, samples
+
+
+def test_metrics_endpoint_counts_job_lifecycle():
+    fake_app = create_app(FakeVertex(completion="0", video_bytes=2000, seed=1))
+    saved = (upstream.get_async_client, server.token_provider, server.job_history)
+    fake_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_app))
+    upstream.get_async_client = lambda: fake_client
+    server.token_provider = _StaticToken()
+    server.job_history = JobHistory(None)
+    model = server.MODEL_ID
+    host = f"{server.LOCATION}-aiplatform.googleapis.com"
+
+    def run(client):
+        _, before = _scrape(client)
+        result = client.post("/api/veo/generate/wait", json={"prompt": "貓"}).json()
+        text, after = _scrape(client)
+        return before, result, text, after
+
+    try:
+        before, result, text, after = _with_server(server._fetch_operation, run)
+    finally:
+        upstream.get_async_client, server.token_provider, server.job_history = saved
+        asyncio.run(fake_client.aclose())
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    assert result["ok"] and result["done"]
+    assert "# HELP veo_submit_seconds predictLongRunning latency" in text
+    assert "# TYPE veo_submit_seconds histogram" in text
+    assert "# TYPE veo_upstream_responses_total counter" in text
+    assert "# TYPE veo_inflight_operations gauge" in text
+    assert delta(f'veo_submit_seconds_count{{model="{model}",status="200"}}') == 1
+    assert delta(f'veo_poll_seconds_count{{model="{model}",status="200"}}') == result["pollCount"]
+    assert delta(f'veo_result_decode_seconds_count{{model="{model}"}}') == 1
+    assert delta(f'veo_poll_response_bytes_count{{model="{model}",done="true"}}') == 1
+    assert delta(f'veo_upstream_responses_total{{host="{host}",status="200"}}') == 1 + result["pollCount"]
+    # 直方圖的 +Inf 桶等於總數
+    assert after[f'veo_submit_seconds_bucket{{model="{model}",status="200",le="+Inf"}}'] == \
+        after[f'veo_submit_seconds_count{{model="{model}",status="200"}}']
+
+
+if __name__ == "__main__":
+    test_operation_events_stream_progress_until_done()
+    test_operation_events_error_and_disconnect_cleanup()
+    test_result_supports_range_and_etag()
+    test_metrics_endpoint_counts_job_lifecycle()
+    print("✅ 單元測試通過：server 端點正常")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 StreamingVideoExtractor 不論區塊怎麼切，都能還原影片位元組與 JSON 骨架
+- 使用隨機位元組當作影片內容（不是有效 MP4，只驗證解碼流程）
+"""
+
+import base64
+import io
+import json
+import os
+
+from stream_decode import StreamingVideoExtractor
+
+
+class KeepBytesIO(io.BytesIO):
+    def close(self):
+        pass  # 保留內容給測試檢查
+
+
+def _extract(body: bytes, chunk_size: int):
+    sinks = []
+
+    def open_sink(index):
+        sinks.append(KeepBytesIO())
+        return sinks[-1]
+
+    extractor = StreamingVideoExtractor(open_sink)
+    for start in range(0, len(body), chunk_size):
+        extractor.feed(body[start:start + chunk_size])
+    return extractor.close(), [s.getvalue() for s in sinks], extractor.samples
+
+
+def test_extracts_videos_for_any_chunk_size():
+    videos = [os.urandom(10_001), os.urandom(777)]
+    body = json.dumps({
+        "name": "projects/p/operations/1",
+        "done": True,
+        "response": {
+            "raiMediaFilteredCount": 0,
+            "note": "字串裡的 \"bytesBase64Encoded\" 不是欄位",
+            "videos": [
+                {"bytesBase64Encoded": base64.b64encode(v).decode(), "mimeType": "video/mp4"} for v in videos
+            ],
+        },
+    }, ensure_ascii=False).encode("utf-8")
+    # 模擬把 / 跳脫成 \/ 的 JSON 編碼器
+    body = body.replace(b"/", b"\\/")
+
+    for chunk_size in (1, 3, 4, 1000, len(body)):
+        data, decoded, samples = _extract(body, chunk_size)
+        assert decoded == videos, chunk_size
+        assert [s["bytes"] for s in samples] == [len(v) for v in videos]
+        assert data["done"] is True
+        assert data["name"] == "projects/p/operations/1"
+        assert data["response"]["videos"][0] == {"bytesBase64Encoded": "", "mimeType": "video/mp4"}
+
+
+def test_pending_response_has_no_samples():
+    data, decoded, samples = _extract(b'{"name": "ops/1", "done": false}', 5)
+    assert data == {"name": "ops/1", "done": False}
+    assert decoded == [] and samples == []
+
+
+if __name__ == "__main__":
+    test_extracts_videos_for_any_chunk_size()
+    test_pending_response_has_no_samples()
+    print("✅ 單元測試通過：串流解析與分段解碼正常")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 TokenProvider 只在快取失效時才刷新權杖
+- 使用假的憑證物件，不需要真正的 Google Cloud 認證
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from token_provider import TokenProvider
+
+
+class FakeCredentials:
+    def __init__(self, lifetime_seconds: int):
+        self.lifetime_seconds = lifetime_seconds
+        self.refresh_calls = 0
+        self.token = None
+        self.expiry = None
+
+    def refresh(self, request):
+        self.refresh_calls += 1
+        self.token = f"token-{self.refresh_calls}"
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=self.lifetime_seconds)
+
+
+def test_token_is_cached_between_requests():
+    creds = FakeCredentials(lifetime_seconds=3600)
+    provider = TokenProvider(credentials=creds)
+    try:
+        tokens = [provider.get_token() for _ in range(50)]
+        assert set(tokens) == {"token-1"}
+        assert creds.refresh_calls == 1
+
+        stats = provider.stats()
+        assert stats["source"] == "adc"
+        assert stats["cacheMisses"] == 1
+        assert stats["cacheHits"] == 49
+        assert stats["refreshCount"] == 1
+        assert stats["expiresInSeconds"] > 3000
+    finally:
+        provider.stop()
+
+
+def test_expired_token_is_refreshed_on_demand():
+    creds = FakeCredentials(lifetime_seconds=-1)  # 一取得就已過期
+    provider = TokenProvider(credentials=creds)
+    try:
+        assert provider.get_token() == "token-1"
+        assert provider.get_token() == "token-2"
+        assert provider.auth_headers()["Authorization"] == "Bearer token-3"
+    finally:
+        provider.stop()
+
+
+if __name__ == "__main__":
+    test_token_is_cached_between_requests()
+    test_expired_token_is_refreshed_on_demand()
+    print("✅ 單元測試通過：權杖快取與刷新流程正常")
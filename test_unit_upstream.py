@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 upstream 的同步與非同步用戶端在程序內共用，關閉後重新建立，換事件迴圈時關閉舊的連線池
+- 只建立用戶端物件，不會發出網路請求
+"""
+
+import asyncio
+import threading
+
+import upstream
+
+
+def test_sync_client_is_shared_until_closed():
+    first = upstream.get_client()
+    assert upstream.get_client() is first
+    upstream.close()
+    assert first.is_closed and upstream._client is None
+    second = upstream.get_client()
+    assert second is not first and upstream.get_client() is second
+    upstream.close()
+
+
+def test_async_client_is_shared_per_loop_until_closed():
+    async def scenario():
+        first = upstream.get_async_client()
+        same = upstream.get_async_client()
+        await upstream.aclose()
+        closed = first.is_closed and upstream._async_client is None
+        second = upstream.get_async_client()
+        await upstream.aclose()
+        return first, same, closed, second
+
+    first, same, closed, second = asyncio.run(scenario())
+    assert same is first and closed and second is not first
+
+    # 新的事件迴圈不沿用綁定在舊迴圈上的用戶端
+    async def other_loop():
+        client = upstream.get_async_client()
+        await upstream.aclose()
+        return client
+    assert asyncio.run(other_loop()) is not second
+
+
+def test_switching_loops_closes_the_abandoned_async_client():
+    async def leave_open():
+        return upstream.get_async_client()
+    abandoned = asyncio.run(leave_open())
+    assert not abandoned.is_closed
+
+    async def next_loop():
+        client = upstream.get_async_client()
+        for _ in range(100):
+            if abandoned.is_closed:
+                break
+            await asyncio.sleep(0.01)
+        await upstream.aclose()
+        return client
+    assert asyncio.run(next_loop()) is not abandoned and abandoned.is_closed
+
+    # 舊事件迴圈仍在另一個執行緒執行：拒絕替換，不關掉使用中的連線
+    ready, release = threading.Event(), threading.Event()
+    holder = {}
+
+    async def busy_loop():
+        holder["client"] = upstream.get_async_client()
+        ready.set()
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        await upstream.aclose()
+
+    thread = threading.Thread(target=lambda: asyncio.run(busy_loop()))
+    thread.start()
+    ready.wait(5)
+
+    async def competing_loop():
+        try:
+            upstream.get_async_client()
+            return False
+        except RuntimeError:
+            return True
+    try:
+        assert asyncio.run(competing_loop()) and not holder["client"].is_closed
+    finally:
+        release.set()
+        thread.join(5)
+
+
+if __name__ == "__main__":
+    test_sync_client_is_shared_until_closed()
+    test_async_client_is_shared_per_loop_until_closed()
+    test_switching_loops_closes_the_abandoned_async_client()
+    print("✅ 單元測試通過：上游共用用戶端正常")
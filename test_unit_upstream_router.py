@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+單元測試：驗證 UpstreamRouter 依延遲/錯誤/429 分數選擇目標，並把操作送回原本的目標
+- 只操作記憶體中的統計，不會發出網路請求
+"""
+
+from upstream_router import UpstreamRouter, parse_targets
+
+
+def test_parse_targets_and_default():
+    targets = parse_targets("proj-a:us-central1, us-east4", "default", "europe-west4")
+    assert [t.key for t in targets] == ["proj-a:us-central1", "default:us-east4"]
+    assert [t.key for t in parse_targets("", "p", "us-central1")] == ["p:us-central1"]
+
+
+def test_choose_prefers_fast_healthy_target_with_capacity():
+    router = UpstreamRouter(parse_targets("a:router-test-1,b:router-test-2", "p", "l"))
+    a, b = router.targets
+    for _ in range(5):
+        router.record(a, 0.1, 200)
+        router.record(b, 0.2, 200)
+    assert router.choose() is a
+
+    # a 開始回 429：分數變差，改選 b
+    for _ in range(5):
+        router.record(a, 0.1, 429)
+    assert router.choose() is b
+    # b 沒有配額時仍可退回 a
+    assert router.choose(lambda t: t is a) is a
+
+
+def test_operation_remembers_target():
+    router = UpstreamRouter(parse_targets("a:us-central1,b:us-central1", "p", "l"))
+    op = "projects/123/locations/us-central1/publishers/google/models/m/operations/1"
+    router.remember(op, "b:us-central1")
+    assert router.target_for(op).key == "b:us-central1"
+    router.forget(op)
+    assert router.target_for(op).key == "a:us-central1"
+    assert router.target_for("projects/x/locations/asia-east1/operations/2").key == "x:asia-east1"
+
+
+if __name__ == "__main__":
+    test_parse_targets_and_default()
+    test_choose_prefers_fast_healthy_target_with_capacity()
+    test_operation_remembers_target()
+    print("✅ 單元測試通過：上游路由選擇與操作對應正常")
@@ -15,10 +15,13 @@ Veo 3.0 Text-to-Video Generation API 測試
 import os
 import json
 import time
-import requests
 import subprocess
 from typing import Dict, Any, Optional, List
 
+import upstream
+from poll_scheduler import default_scheduler as poll_scheduler
+from token_provider import STATIC_TOKEN
+
 
 class VeoAPIClient:
     """Veo API 客戶端，基於官方 REST API 文檔"""
@@ -33,10 +36,12 @@ class VeoAPIClient:
         """
         self.project_id = project_id
         self.location = location
-        self.base_url = f"https://{location}-aiplatform.googleapis.com/v1"
+        self.base_url = upstream.vertex_base_url(location)
         
     def get_access_token(self) -> str:
         """獲取 Google Cloud 存取權杖"""
+        if STATIC_TOKEN:
+            return STATIC_TOKEN
         try:
             result = subprocess.run(
                 ["gcloud", "auth", "print-access-token"],
@@ -114,7 +119,7 @@ class VeoAPIClient:
         print(f"發送請求到: {url}")
         print(f"請求內容: {json.dumps(payload, indent=2, ensure_ascii=False)}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = upstream.post(url, headers=headers, json=payload, retry=False)
         
         if response.status_code == 200:
             return response.json()
@@ -145,15 +150,18 @@ class VeoAPIClient:
         
         print(f"檢查操作狀態: {operation_name}")
         
-        response = requests.post(url, headers=headers, json=payload)
+        # 查詢是冪等的：429/5xx 與網路錯誤會依退避自動重試
+        response = upstream.post(url, headers=headers, json=payload, idempotent=True)
         
         if response.status_code == 200:
             return response.json()
         else:
-            raise Exception(f"狀態檢查失敗: {response.status_code} - {response.text}")
+            raise upstream.UpstreamStatusError(f"狀態檢查失敗: {response.status_code} - {response.text}",
+                                               response.status_code)
     
     def wait_for_completion(self, operation_name: str, model_id: str, 
-                          max_wait_time: int = 300, check_interval: int = 10) -> Dict[str, Any]:
+                          max_wait_time: int = 300, check_interval: Optional[int] = None,
+                          resolution: Optional[str] = None, duration_seconds: Optional[int] = None) -> Dict[str, Any]:
         """
         等待操作完成
         
@@ -161,7 +169,9 @@ class VeoAPIClient:
             operation_name: 操作名稱
             model_id: 模型 ID
             max_wait_time: 最大等待時間（秒）
-            check_interval: 檢查間隔（秒）
+            check_interval: 固定檢查間隔（秒）；None 時依歷史完成時間調整
+            resolution: 影片解析度（用於查詢歷史完成時間）
+            duration_seconds: 影片長度（用於查詢歷史完成時間）
             
         Returns:
             完成後的操作結果
@@ -169,14 +179,28 @@ class VeoAPIClient:
         start_time = time.time()
         
         while time.time() - start_time < max_wait_time:
-            status = self.check_operation_status(operation_name, model_id)
+            try:
+                status = self.check_operation_status(operation_name, model_id)
+            except Exception as e:
+                # 400/403/404 等永久錯誤（操作名稱錯誤、權限被撤銷）直接拋出，不空等到逾時
+                if not upstream.is_transient_error(e):
+                    raise
+                # 重試後仍失敗：生成仍在上游進行，稍後再查而不是放棄整個工作
+                status = {}
+                print(f"⚠️ 狀態檢查暫時失敗，稍後重試: {e}")
             
+            elapsed = time.time() - start_time
             if status.get("done", False):
                 print("✅ 影片生成完成!")
+                if resolution is not None and duration_seconds is not None:
+                    # 參數未知時不記錄，避免 None 鍵的樣本扭曲同模型的預估
+                    poll_scheduler.record_completion(model_id, resolution, duration_seconds, elapsed)
                 return status
             
-            print(f"⏳ 操作進行中... (已等待 {int(time.time() - start_time)} 秒)")
-            time.sleep(check_interval)
+            remaining = poll_scheduler.estimate_remaining(elapsed, model_id, resolution, duration_seconds)
+            print(f"⏳ 操作進行中... (已等待 {int(elapsed)} 秒，預估還需 {remaining} 秒)")
+            # 未指定 check_interval 時依歷史完成時間調整輪詢間隔
+            time.sleep(check_interval or poll_scheduler.next_interval(elapsed, model_id, resolution, duration_seconds))
         
         raise Exception(f"操作超時，已等待 {max_wait_time} 秒")
 
@@ -238,7 +262,10 @@ def test_text_to_video():
             final_result = client.wait_for_completion(
                 operation_name, 
                 test_case["model"],
-                max_wait_time=300
+                max_wait_time=300,
+                # Veo 3 未指定解析度時為 720p；Veo 2 沒有解析度參數
+                resolution="720p" if "veo-3" in test_case["model"] else None,
+                duration_seconds=8
             )
             
             # 顯示結果
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+程序內共用的 Bearer 權杖提供者
+- 憑證只載入一次（ADC 優先，失敗才退回 gcloud auth print-access-token）
+- 背景執行緒在權杖到期前自動刷新，請求路徑上只讀取快取
+- 提供刷新延遲與快取命中統計，用來確認每個請求已不再付出認證成本
+- VEO_STATIC_TOKEN 設定時直接使用該權杖（對本機替身 fake_vertex.py 離線測試用）
+"""
+
+import asyncio
+import os
+import subprocess
+import threading
+import time
+from datetime import timezone
+from typing import Any, Dict, Optional
+
+import google.auth
+from google.auth.transport.requests import Request as GARequest
+
+from metrics import TOKEN_REFRESH_SECONDS
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# 到期前多少秒就由背景執行緒刷新
+REFRESH_MARGIN_SECONDS = int(os.environ.get("VEO_TOKEN_REFRESH_MARGIN", "300"))
+# gcloud 印出的權杖沒有到期資訊，視為此秒數內有效（實際約 60 分鐘）
+GCLOUD_TOKEN_TTL_SECONDS = int(os.environ.get("VEO_GCLOUD_TOKEN_TTL", "2700"))
+# 背景刷新失敗後的重試間隔
+REFRESH_RETRY_SECONDS = 10
+# 兩次背景刷新之間至少間隔（避免權杖壽命短於 margin 時不停刷新）
+MIN_REFRESH_INTERVAL_SECONDS = 30
+# 固定權杖：不載入憑證，也不會過期
+STATIC_TOKEN = os.environ.get("VEO_STATIC_TOKEN") or None
+STATIC_TOKEN_TTL_SECONDS = 365 * 24 * 3600
+
+
+class TokenProvider:
+    """執行緒安全、整個程序共用的權杖快取"""
+
+    def __init__(self, credentials: Any = None, refresh_margin: int = REFRESH_MARGIN_SECONDS):
+        """
+        Args:
+            credentials: 已建立的 google.auth 憑證；None 時於第一次使用時載入 ADC
+            refresh_margin: 到期前幾秒開始刷新
+        """
+        self.refresh_margin = refresh_margin
+        self._credentials = credentials
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refreshed_at = 0.0
+        self._source: Optional[str] = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_failures = 0
+        self._last_refresh_seconds = 0.0
+        self._total_refresh_seconds = 0.0
+        self._max_refresh_seconds = 0.0
+        self._last_error: Optional[str] = None
+
+    def get_token(self) -> str:
+        """取得有效權杖；只有快取為空或已過期時才會在呼叫端同步刷新"""
+        with self._lock:
+            if self._token and time.time() < self._expires_at:
+                self._hits += 1
+                return self._token
+            self._misses += 1
+        self._refresh(force=False)
+        self._ensure_background_refresh()
+        with self._lock:
+            return self._token
+
+    def auth_headers(self) -> Dict[str, str]:
+        """組出帶有最新權杖的請求標頭（長時間輪詢時每次都重新取得）"""
+        return {"Authorization": f"Bearer {self.get_token()}", "Content-Type": "application/json"}
+
+    async def aget_token(self) -> str:
+        """非同步版本：快取命中時直接回傳，需要刷新時改在執行緒中進行，不阻塞事件迴圈"""
+        with self._lock:
+            if self._token and time.time() < self._expires_at:
+                self._hits += 1
+                return self._token
+        return await asyncio.to_thread(self.get_token)
+
+    async def aauth_headers(self) -> Dict[str, str]:
+        """auth_headers() 的非同步版本"""
+        return {"Authorization": f"Bearer {await self.aget_token()}", "Content-Type": "application/json"}
+
+    def stats(self) -> Dict[str, Any]:
+        """快取命中與刷新延遲統計"""
+        with self._lock:
+            return {
+                "source": self._source,
+                "cacheHits": self._hits,
+                "cacheMisses": self._misses,
+                "refreshCount": self._refreshes,
+                "refreshFailures": self._refresh_failures,
+                "lastRefreshSeconds": round(self._last_refresh_seconds, 4),
+                "avgRefreshSeconds": round(self._total_refresh_seconds / self._refreshes, 4) if self._refreshes else 0.0,
+                "maxRefreshSeconds": round(self._max_refresh_seconds, 4),
+                "expiresInSeconds": max(0, int(self._expires_at - time.time())) if self._token else 0,
+                "lastError": self._last_error,
+            }
+
+    def stop(self):
+        """停止背景刷新執行緒"""
+        self._stop.set()
+        self._wakeup.set()
+
+    def _refresh(self, force: bool):
+        """刷新權杖；同一時間只有一個執行緒會真的去取，其餘等待結果"""
+        with self._refresh_lock:
+            if not force:
+                with self._lock:
+                    if self._token and time.time() < self._expires_at:
+                        return
+            started = time.perf_counter()
+            try:
+                token, expires_at, source = self._fetch_token()
+            except Exception as e:
+                TOKEN_REFRESH_SECONDS.observe(time.perf_counter() - started, source="", outcome="error")
+                with self._lock:
+                    self._refresh_failures += 1
+                    self._last_error = str(e)
+                raise
+            elapsed = time.perf_counter() - started
+            TOKEN_REFRESH_SECONDS.observe(elapsed, source=source, outcome="ok")
+            with self._lock:
+                self._token, self._expires_at, self._source = token, expires_at, source
+                self._refreshed_at = time.time()
+                self._refreshes += 1
+                self._last_refresh_seconds = elapsed
+                self._total_refresh_seconds += elapsed
+                self._max_refresh_seconds = max(self._max_refresh_seconds, elapsed)
+                self._last_error = None
+
+    def _fetch_token(self):
+        """回傳 (token, expires_at, source)；優先 ADC，失敗則改用 gcloud"""
+        if STATIC_TOKEN:
+            return STATIC_TOKEN, time.time() + STATIC_TOKEN_TTL_SECONDS, "static"
+        try:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=SCOPES)
+            self._credentials.refresh(GARequest())
+            expiry = getattr(self._credentials, "expiry", None)
+            if expiry is not None:
+                # google.auth 的 expiry 是不帶時區的 UTC 時間
+                if expiry.tzinfo is None:
+                    expiry = expiry.replace(tzinfo=timezone.utc)
+                expires_at = expiry.timestamp()
+            else:
+                expires_at = time.time() + GCLOUD_TOKEN_TTL_SECONDS
+            return self._credentials.token, expires_at, "adc"
+        except Exception:
+            # Fallback to gcloud auth print-access-token
+            token = subprocess.run(
+                ["gcloud", "auth", "print-access-token"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+            return token, time.time() + GCLOUD_TOKEN_TTL_SECONDS, "gcloud"
+
+    def _ensure_background_refresh(self):
+        if self._thread is not None or self._stop.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, name="veo-token-refresh", daemon=True)
+                self._thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                now = time.time()
+                wait = max(
+                    self._expires_at - self.refresh_margin - now,
+                    self._refreshed_at + MIN_REFRESH_INTERVAL_SECONDS - now,
+                )
+            if wait > 0:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                continue
+            try:
+                self._refresh(force=True)
+            except Exception:
+                # 舊權杖可能仍有效，稍後再試；過期後請求路徑會自行同步刷新
+                self._wakeup.wait(REFRESH_RETRY_SECONDS)
+                self._wakeup.clear()
+
+
+# 整個程序共用的實例
+default_provider = TokenProvider()
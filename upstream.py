@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+所有 Vertex AI 呼叫共用的上游 HTTP 傳輸層
+- 整個程序只有一個連線池，keep-alive 讓輪詢重用同一條 TLS 連線
+- 安裝 h2 套件時自動啟用 HTTP/2（多個請求共用一條連線）
+- 連線池大小、每個主機的並行上限與逾時都可用 VEO_* 環境變數調整
+- 同時提供非同步用戶端，讓長時間等待的端點不必佔用執行緒
+- 可重試的失敗依 retry_policy 退避重送，並經過每個區域端點的熔斷器
+- VEO_BASE_URL 可把所有 Vertex AI 呼叫導向本機替身（fake_vertex.py），離線壓測整個流程
+- VEO_CASSETTE_MODE=record/replay 時經過 cassette.py 錄製或重播真實的上游互動
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from cassette import default_cassette
+from metrics import UPSTREAM_RESPONSES
+from retry_policy import CircuitBreaker, CircuitOpenError, default_breakers, default_policy
+
+try:
+    import h2  # noqa: F401  # HTTP/2 需要的選用套件
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 連線池總上限與保持連線的數量
+MAX_CONNECTIONS = int(os.environ.get("VEO_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("VEO_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("VEO_HTTP_KEEPALIVE_EXPIRY", "90"))
+# 每個上游主機同時進行中的請求上限
+MAX_PER_HOST = int(os.environ.get("VEO_HTTP_MAX_PER_HOST", "50"))
+# 逾時（秒）
+TIMEOUT_SECONDS = float(os.environ.get("VEO_HTTP_TIMEOUT", "60"))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("VEO_HTTP_CONNECT_TIMEOUT", "10"))
+# VEO_HTTP2=0 可強制關閉 HTTP/2
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.environ.get("VEO_HTTP2", "1") != "0"
+# 例如 http://127.0.0.1:8090/v1；未設定時使用各區域的 aiplatform.googleapis.com
+BASE_URL_OVERRIDE = (os.environ.get("VEO_BASE_URL") or "").rstrip("/") or None
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+# 非同步用戶端的連線綁定在建立它的事件迴圈上
+_async_client: Optional[httpx.AsyncClient] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_host_slots: Dict[str, asyncio.Semaphore] = {}
+# 換事件迴圈時關閉舊用戶端的 task（事件迴圈只保留弱參照）
+_closing_tasks: set = set()
+
+
+class UpstreamStatusError(Exception):
+    """上游回傳非 200 的狀態碼"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def is_transient_status(status: int) -> bool:
+    """429 與 5xx：上游暫時無法回答，稍後再查可能成功"""
+    return status == 429 or status >= 500
+
+
+def is_transient_error(e: Exception) -> bool:
+    """輪詢迴圈可以稍後再試的錯誤（網路錯誤、熔斷、429/5xx）；其餘 4xx 重試也不會成功"""
+    if isinstance(e, (httpx.TransportError, CircuitOpenError)):
+        return True
+    return isinstance(e, UpstreamStatusError) and is_transient_status(e.status)
+
+
+def vertex_base_url(location: str) -> str:
+    """區域的 Vertex AI REST 端點（含 /v1）"""
+    return BASE_URL_OVERRIDE or f"https://{location}-aiplatform.googleapis.com/v1"
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def get_client() -> httpx.Client:
+    """取得共用的同步用戶端（第一次使用時建立）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                transport = httpx.HTTPTransport(http2=HTTP2_ENABLED, limits=_limits())
+                _client = httpx.Client(transport=default_cassette.transport(transport), timeout=_timeout())
+    return _client
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(url).netloc
+    slot = _host_slots.get(host)
+    if slot is None:
+        with _client_lock:
+            slot = _host_slots.setdefault(host, threading.BoundedSemaphore(MAX_PER_HOST))
+    return slot
+
+
+def _breaker(url: str) -> CircuitBreaker:
+    return default_breakers.get(urlsplit(url).netloc)
+
+
+def _record(url: str, breaker: CircuitBreaker, status: int):
+    UPSTREAM_RESPONSES.inc(host=urlsplit(url).netloc, status=status)
+    # 429 是配額問題，不代表上游不健康
+    if status >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def _record_error(url: str, breaker: CircuitBreaker):
+    UPSTREAM_RESPONSES.inc(host=urlsplit(url).netloc, status="error")
+    breaker.record_failure()
+
+
+def post(url: str, headers: Dict[str, str], json: Any = None, timeout: Optional[float] = None,
+         idempotent: bool = False, retry: bool = True) -> httpx.Response:
+    """
+    透過共用連線池送出 POST 請求。
+    idempotent=True（例如輪詢）時 5xx 與網路錯誤也會重試；retry=False 只經過熔斷器不重試。
+    熔斷中拋出 CircuitOpenError。
+    """
+    breaker = _breaker(url)
+    delays = default_policy.delays() if retry else iter(())
+    while True:
+        breaker.check()
+        try:
+            with _host_slot(url):
+                response = get_client().post(url, headers=headers, json=json, timeout=timeout or _timeout())
+        except httpx.TransportError as e:
+            _record_error(url, breaker)
+            delay = next(delays, None) if default_policy.should_retry_error(e, idempotent) else None
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        _record(url, breaker, response.status_code)
+        delay = next(delays, None) if default_policy.should_retry_status(response.status_code, idempotent) else None
+        if delay is None:
+            return response
+        time.sleep(default_policy.wait_time(delay, response.headers))
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    取得目前事件迴圈共用的非同步用戶端。
+    換了事件迴圈（例如測試中多次 asyncio.run）時先關閉舊用戶端的連線池；
+    舊事件迴圈仍在執行時拒絕替換，避免關掉還在使用中的連線。
+    """
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        old = _async_client
+        if old is not None and not old.is_closed:
+            if _async_loop is not None and _async_loop.is_running():
+                raise RuntimeError("共用的非同步用戶端仍在另一個執行中的事件迴圈使用")
+            # 舊迴圈已結束：在目前的迴圈關閉它的連線
+            task = loop.create_task(old.aclose())
+            _closing_tasks.add(task)
+            task.add_done_callback(_closing_tasks.discard)
+        transport = httpx.AsyncHTTPTransport(http2=HTTP2_ENABLED, limits=_limits())
+        _async_client = httpx.AsyncClient(transport=default_cassette.async_transport(transport), timeout=_timeout())
+        _async_loop = loop
+        _async_host_slots.clear()
+    return _async_client
+
+
+def _async_host_slot(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    slot = _async_host_slots.get(host)
+    if slot is None:
+        slot = _async_host_slots[host] = asyncio.Semaphore(MAX_PER_HOST)
+    return slot
+
+
+async def apost(url: str, headers: Dict[str, str], json: Any = None, timeout: Optional[float] = None,
+                idempotent: bool = False, retry: bool = True, content: Any = None) -> httpx.Response:
+    """
+    post() 的非同步版本。
+    content 可以是串流本文（非同步產生器）；串流本文只能送一次，因此不重試。
+    """
+    client = get_async_client()
+    breaker = _breaker(url)
+    delays = default_policy.delays() if retry and content is None else iter(())
+    while True:
+        breaker.check()
+        try:
+            async with _async_host_slot(url):
+                response = await client.post(url, headers=headers, json=json, content=content,
+                                             timeout=timeout or _timeout())
+        except httpx.TransportError as e:
+            _record_error(url, breaker)
+            delay = next(delays, None) if default_policy.should_retry_error(e, idempotent) else None
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        _record(url, breaker, response.status_code)
+        delay = next(delays, None) if default_policy.should_retry_status(response.status_code, idempotent) else None
+        if delay is None:
+            return response
+        await asyncio.sleep(default_policy.wait_time(delay, response.headers))
+
+
+@asynccontextmanager
+async def astream_post(url: str, headers: Dict[str, str], json: Any = None, timeout: Optional[float] = None,
+                       idempotent: bool = False):
+    """
+    串流版 apost()：回應本文以 aiter_bytes() 分塊讀取，不會整個載入記憶體。
+    重試只發生在交出回應之前；讀取本文途中的錯誤直接拋給呼叫端。
+    """
+    client = get_async_client()
+    breaker = _breaker(url)
+    delays = default_policy.delays()
+    while True:
+        breaker.check()
+        yielded = False
+        wait = None
+        try:
+            async with _async_host_slot(url):
+                async with client.stream("POST", url, headers=headers, json=json, timeout=timeout or _timeout()) as response:
+                    _record(url, breaker, response.status_code)
+                    delay = next(delays, None) if default_policy.should_retry_status(response.status_code, idempotent) else None
+                    if delay is None:
+                        yielded = True
+                        yield response
+                        return
+                    wait = default_policy.wait_time(delay, response.headers)
+        except httpx.TransportError as e:
+            if yielded:
+                raise
+            _record_error(url, breaker)
+            delay = next(delays, None) if default_policy.should_retry_error(e, idempotent) else None
+            if delay is None:
+                raise
+            wait = delay
+        await asyncio.sleep(wait)
+
+
+async def aclose():
+    """關閉非同步連線池"""
+    global _async_client, _async_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+        _async_loop = None
+
+
+def close():
+    """關閉連線池（應用程式結束時呼叫）"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
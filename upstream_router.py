@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+多專案 / 多區域的上游路由
+- 目標清單由 VEO_TARGETS 設定，例如 "proj-a:us-central1,proj-b:us-east4"
+- 每個目標以指數移動平均記錄延遲、錯誤率與 429 比例，算出分數（越低越好）
+- 新的送出交給分數最好且配額足夠的目標；每個操作記住自己的目標，輪詢時送回同一個區域
+- 熔斷中的區域暫時不選，全部熔斷時才退回分數最好的目標
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from retry_policy import default_breakers
+from upstream import vertex_base_url
+
+# 移動平均的權重（越大越重視最近的請求）
+EWMA_ALPHA = 0.2
+# 錯誤與 429 對分數的加權
+ERROR_WEIGHT = 4.0
+THROTTLE_WEIGHT = 2.0
+# 還沒有延遲資料的目標視為此延遲（秒），讓新目標也有機會被選到
+UNKNOWN_LATENCY_SECONDS = 0.2
+
+
+class UpstreamTarget:
+    """一個 (專案, 區域) 上游目標與其滾動統計"""
+
+    def __init__(self, project: str, location: str):
+        self.project = project
+        self.location = location
+        self.key = f"{project}:{location}"
+        self.base_url = vertex_base_url(location)
+        self.host = urlsplit(self.base_url).netloc
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.throttle_rate = 0.0
+        self.requests = 0
+
+    def model_url(self, model_id: str, method: str) -> str:
+        return (f"{self.base_url}/projects/{self.project}/locations/{self.location}"
+                f"/publishers/google/models/{model_id}:{method}")
+
+    @property
+    def healthy(self) -> bool:
+        return default_breakers.get(self.host).state != "open"
+
+    def score(self) -> float:
+        latency = UNKNOWN_LATENCY_SECONDS if self.latency is None else self.latency
+        return latency * (1 + ERROR_WEIGHT * self.error_rate + THROTTLE_WEIGHT * self.throttle_rate)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "score": round(self.score(), 4),
+            "latencySeconds": None if self.latency is None else round(self.latency, 4),
+            "errorRate": round(self.error_rate, 4),
+            "throttleRate": round(self.throttle_rate, 4),
+            "requests": self.requests,
+        }
+
+
+def parse_targets(spec: Optional[str], default_project: str, default_location: str) -> List[UpstreamTarget]:
+    """解析 "project:location,..."；省略專案時使用預設專案"""
+    targets = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        project, _, location = item.rpartition(":")
+        targets.append(UpstreamTarget(project or default_project, location))
+    return targets or [UpstreamTarget(default_project, default_location)]
+
+
+class UpstreamRouter:
+    """依分數選擇送出目標，並記住每個操作的目標"""
+
+    def __init__(self, targets: List[UpstreamTarget]):
+        self.targets = targets
+        self._by_key = {t.key: t for t in targets}
+        self._operations: Dict[str, UpstreamTarget] = {}
+        self._lock = threading.Lock()
+
+    def ranked(self) -> List[UpstreamTarget]:
+        """健康的目標依分數排序；全部不健康時回傳全部"""
+        healthy = [t for t in self.targets if t.healthy] or self.targets
+        return sorted(healthy, key=lambda t: t.score())
+
+    def choose(self, has_capacity: Optional[Callable[[UpstreamTarget], bool]] = None) -> UpstreamTarget:
+        """分數最好且有配額的目標；都沒有配額時回傳分數最好的目標（由呼叫端排隊等待）"""
+        ranked = self.ranked()
+        if has_capacity is not None:
+            for target in ranked:
+                if has_capacity(target):
+                    return target
+        return ranked[0]
+
+    def record(self, target: UpstreamTarget, seconds: float, status: Optional[int]):
+        """記錄一次請求的延遲與結果；status 為 None 表示網路錯誤"""
+        with self._lock:
+            target.requests += 1
+            if status is not None and status < 500:
+                target.latency = seconds if target.latency is None else (
+                    (1 - EWMA_ALPHA) * target.latency + EWMA_ALPHA * seconds)
+            failed = status is None or status >= 500
+            target.error_rate = (1 - EWMA_ALPHA) * target.error_rate + EWMA_ALPHA * failed
+            target.throttle_rate = (1 - EWMA_ALPHA) * target.throttle_rate + EWMA_ALPHA * (status == 429)
+
+    def remember(self, operation_name: str, target_key: Optional[str]):
+        target = self._by_key.get(target_key or "")
+        if target is not None:
+            self._operations[operation_name] = target
+
+    def target_for(self, operation_name: str) -> UpstreamTarget:
+        """
+        操作所屬的目標：先查記錄，再從名稱解析 projects/{p}/locations/{l}，
+        名稱沒有區域時使用第一個目標
+        """
+        target = self._operations.get(operation_name)
+        if target is not None:
+            return target
+        parts = operation_name.split("/")
+        if "locations" in parts and parts.index("locations") + 1 < len(parts):
+            location = parts[parts.index("locations") + 1]
+            project = parts[parts.index("projects") + 1] if "projects" in parts else ""
+            matches = [t for t in self.targets if t.location == location]
+            for t in matches:
+                if t.project == project:
+                    return t
+            if matches:
+                return matches[0]
+            if project:
+                # 不在清單中的區域（例如其他工具送出的操作）：照名稱直接查詢
+                return UpstreamTarget(project, location)
+        return self.targets[0]
+
+    def forget(self, operation_name: str):
+        self._operations.pop(operation_name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {t.key: t.stats() for t in self.targets}